@@ -1,5 +1,8 @@
 # app.py
 
+import functions_startup
+functions_startup.start_import_profiling()
+
 from config import *
 
 from functions_authentication import *
@@ -7,6 +10,7 @@ from functions_content import *
 from functions_documents import *
 from functions_search import *
 from functions_settings import *
+from functions_ingestion_jobs import *
 
 from route_frontend_authentication import *
 from route_frontend_profile import *
@@ -34,21 +38,50 @@ from route_backend_group_prompts import *
 from route_frontend_default_documents import *
 from route_backend_default_documents import *
 from route_document_viewer import *
+from route_backend_metrics import *
+from route_backend_ingestion_jobs import *
 
 
 logging.basicConfig(level=logging.DEBUG)
 
-# Initialize clients right after Flask app creation but before route registration
-print("Initializing clients at application startup...")
-settings = get_settings()
-initialize_clients(settings)
+CLIENTS_INIT_LOCK = threading.Lock()
+
+def ensure_clients_initialized():
+    """
+    Initialize the Azure clients once per worker process. Safe to call on
+    every request; after the first successful run it is a single pid check.
+    """
+    if clients_ready():
+        return True
+    with CLIENTS_INIT_LOCK:
+        if clients_ready():
+            return True
+        settings = get_settings()
+        if settings is None:
+            print("Settings unavailable, client initialization postponed")
+            return False
+        initialize_clients(settings)
+    return True
+
+# Outside fast-start mode keep initializing at application startup so the
+# first request does not pay for it; fast-start defers to the first request.
+if not SIMPLECHAT_FAST_START:
+    print("Initializing clients at application startup...")
+    ensure_clients_initialized()
 
 # =================== Helper Functions ===================
-@app.before_first_request
-def before_first_request():
-    print("Refreshing client initialization on first request...")
-    settings = get_settings()
-    initialize_clients(settings)
+@app.before_request
+def before_request_ensure_clients():
+    ensure_clients_initialized()
+    # Started from a request rather than at import so that the gunicorn
+    # master (preload_app) never runs jobs; each worker starts its own.
+    if INGESTION_MODE == "background":
+        start_ingestion_workers()
+
+@app.cli.command('bootstrap')
+def bootstrap_command():
+    """Provision the Cosmos database/containers and the blob container."""
+    bootstrap_resources()
 
 @app.context_processor
 def inject_settings():
@@ -66,6 +99,8 @@ def format_datetime_filter(value):
 
 # Register a custom Jinja filter for Markdown
 def markdown_filter(text):
+    import markdown2
+
     if not text:
         text = ""
 
@@ -94,6 +129,15 @@ def index():
 
     return render_template('index.html', app_settings=public_settings, landing_html=landing_html)
 
+@app.route('/readyz')
+def readyz():
+    """Readiness probe: 200 once this worker's clients are initialized."""
+    if CLIENTS_STATE["draining"]:
+        return jsonify({"status": "draining"}), 503
+    if ensure_clients_initialized():
+        return jsonify({"status": "ready"}), 200
+    return jsonify({"status": "initializing"}), 503
+
 @app.route('/robots933456.txt')
 def robots():
     return send_from_directory('static', 'robots.txt')
@@ -182,8 +226,12 @@ register_route_backend_default_documents(app)
 
 register_route_document_viewer(app)
 
+register_route_backend_ingestion_jobs(app)
+
+# ------------------- Metrics Route ---------------------
+register_route_backend_metrics(app)
+
+functions_startup.report_startup()
+
 if __name__ == '__main__':
-    # Ensure clients are initialized before running the app
-    settings = get_settings()
-    initialize_clients(settings)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,219 @@
+# asgi.py
+#
+# ASGI entry point. Streaming /api/chat requests are served by an asyncio
+# handler, so an open SSE stream holds no thread while the model generates
+# and one worker can keep thousands of streams open. Every other request is
+# handed to the Flask app on a thread pool.
+#
+#   SIMPLECHAT_ASGI=true gunicorn        (see gunicorn.conf.py)
+#   uvicorn asgi:application             (local development)
+
+import asyncio
+import io
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+
+from app import app
+from config import *
+from functions_authentication import *
+from functions_settings import *
+from functions_openai import *
+from functions_metrics import *
+from route_backend_chats import prepare_chat_turn, record_assistant_message, sse_event, SSE_HEADERS
+
+# Threads for the WSGI (non-streaming) part of the app, per worker
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "16"))
+
+wsgi_application = WSGIMiddleware(app, workers=ASGI_WSGI_THREADS)
+
+
+async def _read_body(receive):
+    """Read the whole request body; None if the client went away first."""
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+def _replay_receive(body, receive):
+    """receive() that hands out an already consumed body once more."""
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+
+async def _watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            disconnected.set()
+            return
+
+
+@login_required
+@user_required
+def _prepare_authorized_turn(data):
+    settings = get_settings()
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'User not authenticated'}), 401
+
+    turn, response = prepare_chat_turn(settings, data, user_id)
+    if response is not None:
+        return response
+    turn['settings'] = settings
+    return turn
+
+
+def _prepare_stream(environ, data):
+    """
+    Runs on a thread: session, auth, before_request hooks and the shared
+    chat preparation (conversation, safety, search) inside a regular Flask
+    request context. Returns (turn, None) or (None, (status, headers, body)).
+    """
+    with app.request_context(environ):
+        try:
+            result = app.preprocess_request()
+            if result is None:
+                result = _prepare_authorized_turn(data)
+        except Exception as e:
+            print(f"Error in chat_api: {str(e)}")
+            result = jsonify({'error': 'Internal server error'}), 500
+
+        if isinstance(result, dict):
+            return result, None
+
+        response = app.process_response(app.make_response(result))
+        headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+        return None, (response.status_code, headers, response.get_data())
+
+
+async def _stream_chat(turn, receive, send):
+    settings = turn.pop('settings')
+    gpt_client, gpt_model = get_async_gpt_client(settings)
+    conversation_item = turn['conversation_item']
+
+    headers = [(b"content-type", b"text/event-stream; charset=utf-8")]
+    headers += [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in SSE_HEADERS.items()]
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+    async def send_event(payload):
+        await send({"type": "http.response.body", "body": sse_event(payload).encode("utf-8"), "more_body": True})
+
+    disconnected = asyncio.Event()
+    disconnect_watcher = asyncio.create_task(_watch_disconnect(receive, disconnected))
+    full_response = ""
+    stream_start_time = time.perf_counter()
+    first_token_seen = False
+
+    try:
+        await send_event({'conversation_id': turn['conversation_id'], 'message_id': turn['assistant_message_id'], 'conversation_title': conversation_item['title'], 'type': 'info'})
+
+        stream = await gpt_client.chat.completions.create(
+            model=gpt_model,
+            messages=turn['messages'],
+            stream=True
+        )
+        async for chunk in stream:
+            if disconnected.is_set():
+                # Client went away: stop generating and, like the WSGI
+                # route, do not save a partial answer.
+                await stream.close()
+                return
+            if chunk.choices and chunk.choices[0].delta.content:
+                content = chunk.choices[0].delta.content
+                full_response += content
+                if not first_token_seen:
+                    first_token_seen = True
+                    CHAT_TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - stream_start_time)
+                await send_event({'content': content, 'type': 'chunk'})
+
+        with time_stage('conversation_upsert', 'cosmos'):
+            await get_async_cosmos_container(container_name).upsert_item(
+                body=record_assistant_message(turn, full_response, gpt_model)
+            )
+
+        await send_event({'type': 'done', 'model_deployment_name': gpt_model})
+
+    except Exception as e:
+        print(f"Streaming error: {str(e)}")
+        record_dependency_error('openai')
+        if not disconnected.is_set():
+            await send_event({'error': f"Error generating model response: {str(e)}", 'type': 'error'})
+    finally:
+        CHAT_STREAM_DURATION_SECONDS.observe(time.perf_counter() - stream_start_time)
+        disconnect_watcher.cancel()
+        if not disconnected.is_set():
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def chat_endpoint(scope, receive, send):
+    body = await _read_body(receive)
+    if body is None:
+        return
+
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+    streaming_enabled = data.get('streaming', True) if isinstance(data, dict) else False
+    if isinstance(streaming_enabled, str):
+        streaming_enabled = streaming_enabled.lower() == 'true'
+
+    # Non-streaming turns are short; let the Flask route answer them
+    if not streaming_enabled:
+        await wsgi_application(scope, _replay_receive(body, receive), send)
+        return
+
+    # Like the WSGI route, the request time ends when the response or the
+    # stream is ready; the stream itself is CHAT_STREAM_DURATION_SECONDS
+    request_start_time = time.perf_counter()
+    try:
+        environ = build_environ(scope, io.BytesIO(body))
+        turn, response = await asyncio.to_thread(_prepare_stream, environ, data)
+    finally:
+        CHAT_REQUEST_SECONDS.observe(time.perf_counter() - request_start_time)
+
+    if response is not None:
+        status, headers, content = response
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": content, "more_body": False})
+        return
+    await _stream_chat(turn, receive, send)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Uvicorn replaces gunicorn's SIGTERM handler, so the drain flag
+            # for /readyz is set here rather than in gunicorn.conf.py
+            CLIENTS_STATE["draining"] = True
+            await close_async_clients()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] == "http" and scope["path"] == "/api/chat" and scope["method"] == "POST":
+        await chat_endpoint(scope, receive, send)
+        return
+    await wsgi_application(scope, receive, send)
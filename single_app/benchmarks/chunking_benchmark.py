@@ -0,0 +1,270 @@
+# benchmarks/chunking_benchmark.py
+#
+# Micro-benchmark of document chunking (functions_content.chunk_text) over
+# synthetic corpora. Every corpus is chunked by:
+#
+#   reference       the chunk_text implementation that logged every page and
+#                   chunk, kept here verbatim as the baseline
+#   current         functions_content.chunk_text
+#   boundary_index  a variant that precomputes sentence/newline/space offsets
+#                   per page with NumPy and picks split points by bisect
+#
+# All strategies must produce identical chunks; the run fails otherwise.
+# Log output goes to os.devnull, which understates what logging costs when
+# stdout is a pipe to a log collector.
+#
+# Run from the single_app directory:
+#
+#   python -m benchmarks.chunking_benchmark
+#   python -m benchmarks.chunking_benchmark --pages 1000,10000,100000 --repeat 3
+
+import argparse
+import contextlib
+import hashlib
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.run_benchmarks import configure_environment, git_revision, load_previous_result, save_result
+
+WORDS = [
+    "the", "report", "covers", "quarterly", "revenue", "growth,", "which", "exceeded",
+    "expectations.", "Customers", "in", "EMEA", "adopted", "the", "new", "platform", "quickly;",
+    "support", "tickets", "fell", "by", "12%", "(see", "table", "4).", "Überblick", "für", "Kunden.",
+]
+
+
+def synthetic_corpus(pages, seed=1):
+    """pages of mixed length: empty, short, typical and long pages with paragraphs."""
+    rng = random.Random(seed)
+    corpus = []
+    for page_number in range(1, pages + 1):
+        kind = rng.random()
+        if kind < 0.05:
+            words = 0
+        elif kind < 0.25:
+            words = rng.randint(5, 120)
+        elif kind < 0.95:
+            words = rng.randint(300, 700)
+        else:
+            words = rng.randint(2000, 6000)
+        paragraphs = []
+        while words > 0:
+            length = min(words, rng.randint(40, 90))
+            paragraphs.append(" ".join(rng.choices(WORDS, k=length)))
+            words -= length
+        corpus.append({"page_number": page_number, "text": "\n".join(paragraphs)})
+    return corpus
+
+
+def reference_chunk_text(pages_content, pages_info=None, chunk_size=2000, overlap=200):
+    all_chunks = []
+
+    if not pages_content:
+        print("Warning: No content to chunk")
+        return [("No content was extracted from this document.", 1)]
+
+    print(f"Chunking {len(pages_content)} pages")
+
+    # Process each page independently to maintain page number association
+    for page_data in pages_content:
+        page_number = page_data["page_number"]
+        page_text = page_data.get("text", "")
+
+        if not page_text or not page_text.strip():
+            print(f"Skipping empty page {page_number}")
+            continue
+
+        print(f"Processing page {page_number}: {len(page_text)} chars")
+
+        # If page text is very small, just use it as is
+        if len(page_text) < chunk_size // 2:
+            all_chunks.append((page_text, page_number))
+            print(f"Added entire page {page_number} as single chunk ({len(page_text)} chars)")
+            continue
+
+        # Create chunks for larger pages
+        position = 0
+        chunks_from_page = 0
+
+        while position < len(page_text):
+            end = min(position + chunk_size, len(page_text))
+
+            # Try to find a natural break point (period, newline, etc.)
+            if end < len(page_text) and end - position > chunk_size // 2:
+                # Look for sentence endings, then for line breaks, then for word boundaries
+                natural_break = page_text.rfind('. ', position, end)
+                if natural_break == -1 or natural_break < position + chunk_size // 2:
+                    natural_break = page_text.rfind('\n', position, end)
+                if natural_break == -1 or natural_break < position + chunk_size // 2:
+                    natural_break = page_text.rfind(' ', position, end)
+                if natural_break != -1 and natural_break > position + chunk_size // 2:
+                    end = natural_break + 1  # Include the period or space
+
+            chunk_text = page_text[position:end].strip()
+
+            # Only add non-empty chunks
+            if chunk_text:
+                all_chunks.append((chunk_text, page_number))
+                chunks_from_page += 1
+                print(f"Created chunk {chunks_from_page} from page {page_number}: {len(chunk_text)} chars")
+
+            # Move to next chunk with overlap
+            position = end - overlap if end < len(page_text) else len(page_text)
+
+    # If we still have no chunks, create a minimal one to prevent downstream errors
+    if not all_chunks:
+        print("Warning: No chunks created, adding a minimal chunk")
+        all_chunks.append(("Document processing completed, but no usable content was found.", 1))
+
+    print(f"Generated {len(all_chunks)} total chunks across all pages")
+    return all_chunks
+
+
+def _boundary_index(page_text):
+    """Offsets of '. ', newlines and spaces, from one vectorized pass over the page."""
+    codes = np.frombuffer(page_text.encode("utf-32-le"), dtype=np.uint32)
+    spaces = codes == 32
+    sentence_ends = np.flatnonzero((codes[:-1] == 46) & spaces[1:])
+    return (
+        (sentence_ends.tolist(), 2),
+        (np.flatnonzero(codes == 10).tolist(), 1),
+        (np.flatnonzero(spaces).tolist(), 1),
+    )
+
+
+def boundary_index_chunk_text(pages_content, chunk_size=2000, overlap=200):
+    chunks = []
+    half = chunk_size // 2
+    for page_data in pages_content:
+        page_text = page_data.get("text", "")
+        if not page_text or not page_text.strip():
+            continue
+        if len(page_text) < half:
+            chunks.append((page_text, page_data["page_number"]))
+            continue
+        boundaries = _boundary_index(page_text)
+        length = len(page_text)
+        position = 0
+        while position < length:
+            end = min(position + chunk_size, length)
+            if end < length and end - position > half:
+                floor = position + half
+                natural_break = -1
+                for offsets, width in boundaries:
+                    index = bisect_right(offsets, end - width) - 1
+                    if index >= 0 and offsets[index] >= floor:
+                        natural_break = offsets[index]
+                        break
+                if natural_break > floor:
+                    end = natural_break + 1
+            chunk_text = page_text[position:end].strip()
+            if chunk_text:
+                chunks.append((chunk_text, page_data["page_number"]))
+            position = end - overlap if end < length else length
+    if not chunks:
+        chunks.append(("Document processing completed, but no usable content was found.", 1))
+    return chunks
+
+
+def _digest(chunks):
+    digest = hashlib.sha256()
+    for text, page_number in chunks:
+        digest.update(f"{page_number}\0{text}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _time(strategy, corpus, repeat):
+    """Best wall-clock time of repeat runs, and the digest of the chunks."""
+    best = None
+    digest = None
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            chunks = strategy(corpus)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            digest = _digest(chunks)
+            chunk_count = len(chunks)
+            del chunks
+    return best, digest, chunk_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark chunk_text over synthetic corpora.")
+    parser.add_argument("--pages", default="1000,10000,100000", help="Comma separated corpus sizes in pages")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per strategy; the best is reported")
+    parser.add_argument("--baseline", help="Result file to compare with (default: latest chunking result)")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="simplechat-chunking-")
+    configure_environment(work_dir)
+    os.environ.setdefault("CHUNKING_MODE", "characters")
+    from benchmarks.fakes import FakeServices, install_fakes
+    install_fakes(FakeServices(latency_scale=0))
+    from functions_content import chunk_text
+
+    strategies = {
+        "reference": reference_chunk_text,
+        # Compared without the token counts the other strategies do not produce
+        "current": lambda pages: [(text, page_number) for text, page_number, _ in chunk_text(pages)],
+        "boundary_index": boundary_index_chunk_text,
+    }
+
+    corpora = {}
+    mismatches = []
+    for pages in [int(value) for value in args.pages.split(",") if value.strip()]:
+        corpus = synthetic_corpus(pages)
+        characters = sum(len(page["text"]) for page in corpus)
+        timings = {}
+        digests = {}
+        for name, strategy in strategies.items():
+            seconds, digests[name], chunk_count = _time(strategy, corpus, args.repeat)
+            timings[name] = round(seconds, 4)
+        if len(set(digests.values())) != 1:
+            mismatches.append(pages)
+        corpora[str(pages)] = {"characters": characters, "chunks": chunk_count, "seconds": timings}
+        speedups = ", ".join(
+            f"{name} {timings['reference'] / timings[name]:.2f}x" for name in strategies if name != "reference"
+        )
+        print(f"{pages:>7} pages, {characters / 1e6:7.1f}M chars, {chunk_count:>7} chunks: "
+              + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items())
+              + f"  ({speedups} vs reference)"
+              + ("  <-- OUTPUT MISMATCH" if pages in mismatches else ""))
+        del corpus
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "corpora": corpora,
+    }
+
+    previous = load_previous_result("chunking", args.baseline)
+    if previous:
+        for pages, current in corpora.items():
+            before = previous.get("corpora", {}).get(pages)
+            if before:
+                delta = current["seconds"]["current"] / before["seconds"]["current"] - 1
+                print(f"{pages} pages vs {previous['git_revision']}: current {delta:+.1%}")
+
+    if not args.no_save:
+        print(f"\nResults written to {save_result('chunking', result)}")
+
+    if mismatches:
+        print(f"Chunk output differs from the reference for corpora of {mismatches} pages")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,622 @@
+# benchmarks/fakes.py
+#
+# In-process stand-ins for the Azure services the app talks to, so the Flask
+# app can be driven under load without any live resources. Every fake call
+# goes through a ServiceProfile that adds latency and injects failures.
+
+import asyncio
+import random
+import re
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from azure.core.exceptions import HttpResponseError
+from azure.cosmos.exceptions import CosmosResourceNotFoundError, CosmosResourceExistsError
+
+
+class FakeServiceError(HttpResponseError):
+    """Injected failure, raised with the configured failure rate."""
+
+
+async def _async_call(profile, operation):
+    """ServiceProfile.call() for the async fakes: sleeps without blocking the loop."""
+    delay_ms = max(0.0, random.gauss(profile.latency_ms, profile.jitter_ms)) if profile.jitter_ms else profile.latency_ms
+    if delay_ms:
+        await asyncio.sleep(delay_ms / 1000.0)
+    if profile.failure_rate and random.random() < profile.failure_rate:
+        raise FakeServiceError(message=f"Injected {profile.name} failure in {operation}")
+
+
+class ServiceProfile:
+    """Latency (mean +/- jitter, in ms) and failure rate of one fake service."""
+
+    def __init__(self, name, latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+
+    def call(self, operation):
+        delay_ms = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) if self.jitter_ms else self.latency_ms
+        if delay_ms:
+            time.sleep(delay_ms / 1000.0)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise FakeServiceError(message=f"Injected {self.name} failure in {operation}")
+
+
+# Rough medians for same-region Azure calls; override per run from the CLI.
+DEFAULT_PROFILES = {
+    "cosmos": dict(latency_ms=8, jitter_ms=2),
+    "search": dict(latency_ms=60, jitter_ms=15),
+    "blob": dict(latency_ms=25, jitter_ms=5),
+    "document_intelligence": dict(latency_ms=1500, jitter_ms=300),
+    "openai_embedding": dict(latency_ms=40, jitter_ms=10),
+    "openai_chat": dict(latency_ms=400, jitter_ms=100),
+    "openai_token": dict(latency_ms=15, jitter_ms=5),
+    "openai_image": dict(latency_ms=3000, jitter_ms=500),
+}
+
+
+class FakeServices:
+    """Holds the shared state and latency profiles of all fakes."""
+
+    def __init__(self, profiles=None, failure_rate=0.0, latency_scale=1.0, embedding_dimensions=1536, stream_tokens=40, embedding_tpm=None):
+        self.profiles = {}
+        for name, params in DEFAULT_PROFILES.items():
+            params = dict(params)
+            params.update((profiles or {}).get(name, {}))
+            self.profiles[name] = ServiceProfile(
+                name,
+                latency_ms=params["latency_ms"] * latency_scale,
+                jitter_ms=params["jitter_ms"] * latency_scale,
+                failure_rate=params.get("failure_rate", failure_rate)
+            )
+        self.embedding_dimensions = embedding_dimensions
+        self.stream_tokens = stream_tokens
+        self.cosmos_databases = {}
+        self.search_indexes = {}
+        self.blobs = {}
+        # Optional tokens-per-minute quota on embeddings (429 with Retry-After when exceeded)
+        self.embedding_tpm = embedding_tpm
+        self.embedding_token_window = []
+        self.embedding_rate_limited = 0
+        self.lock = threading.Lock()
+
+    def profile(self, name):
+        return self.profiles[name]
+
+
+# --------------------------------------------------------------------------
+# Cosmos DB
+# --------------------------------------------------------------------------
+
+_CONDITION_PATTERN = re.compile(
+    r"c\.(\w+)\s*=\s*(@\w+|'[^']*'|\"[^\"]*\"|true|false|-?\d+)",
+    re.IGNORECASE
+)
+
+
+def _literal(value, parameters):
+    if value.startswith("@"):
+        return parameters.get(value)
+    if value[0] in "'\"":
+        return value[1:-1]
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return int(value)
+
+
+class FakeContainer:
+    def __init__(self, services, name):
+        self._services = services
+        self.id = name
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        self._services.profile("cosmos").call(operation)
+
+    def read_item(self, item, partition_key, **kwargs):
+        self._call("read_item")
+        with self._lock:
+            doc = self._items.get(item)
+        if doc is None:
+            raise CosmosResourceNotFoundError(status_code=404, message=f"{item} not found")
+        return dict(doc)
+
+    def create_item(self, body, **kwargs):
+        self._call("create_item")
+        with self._lock:
+            if body["id"] in self._items:
+                raise CosmosResourceExistsError(status_code=409, message=f"{body['id']} exists")
+            stored = dict(body, _etag=str(uuid.uuid4()))
+            self._items[body["id"]] = stored
+        return dict(stored)
+
+    def upsert_item(self, body, **kwargs):
+        self._call("upsert_item")
+        with self._lock:
+            stored = dict(body, _etag=str(uuid.uuid4()))
+            self._items[body["id"]] = stored
+        return dict(stored)
+
+    def delete_item(self, item, partition_key=None, **kwargs):
+        self._call("delete_item")
+        with self._lock:
+            if self._items.pop(item, None) is None:
+                raise CosmosResourceNotFoundError(status_code=404, message=f"{item} not found")
+
+    def query_items(self, query, parameters=None, **kwargs):
+        """Supports the equality filters (c.field = value AND ...) the app uses."""
+        self._call("query_items")
+        params = {p["name"]: p["value"] for p in (parameters or [])}
+        where = query.split("WHERE", 1)[1] if "WHERE" in query.upper() else ""
+        where = re.split(r"ORDER BY", where, flags=re.IGNORECASE)[0]
+        conditions = [(field, _literal(value, params)) for field, value in _CONDITION_PATTERN.findall(where)]
+        with self._lock:
+            items = list(self._items.values())
+        return [dict(doc) for doc in items if all(doc.get(f) == v for f, v in conditions)]
+
+
+class FakeDatabase:
+    def __init__(self, services, name):
+        self._services = services
+        self.id = name
+        self._containers = {}
+        self._lock = threading.Lock()
+
+    def get_container_client(self, name):
+        with self._lock:
+            return self._containers.setdefault(name, FakeContainer(self._services, name))
+
+    def create_container_if_not_exists(self, id, partition_key=None, **kwargs):
+        self._services.profile("cosmos").call("create_container_if_not_exists")
+        return self.get_container_client(id)
+
+
+class FakeCosmosClient:
+    services = None
+
+    def __init__(self, url=None, credential=None, **kwargs):
+        self.client_connection = None
+
+    def get_database_client(self, name):
+        with self.services.lock:
+            return self.services.cosmos_databases.setdefault(name, FakeDatabase(self.services, name))
+
+    def create_database_if_not_exists(self, name, **kwargs):
+        self.services.profile("cosmos").call("create_database_if_not_exists")
+        return self.get_database_client(name)
+
+
+class FakeAsyncContainer:
+    """azure.cosmos.aio container view over the same items as FakeContainer."""
+
+    def __init__(self, container):
+        self._container = container
+
+    async def _call(self, operation):
+        profile = self._container._services.profile("cosmos")
+        await _async_call(profile, operation)
+
+    async def read_item(self, item, partition_key, **kwargs):
+        await self._call("read_item")
+        with self._container._lock:
+            doc = self._container._items.get(item)
+        if doc is None:
+            raise CosmosResourceNotFoundError(status_code=404, message=f"{item} not found")
+        return dict(doc)
+
+    async def upsert_item(self, body, **kwargs):
+        await self._call("upsert_item")
+        with self._container._lock:
+            stored = dict(body, _etag=str(uuid.uuid4()))
+            self._container._items[body["id"]] = stored
+        return dict(stored)
+
+
+class FakeAsyncCosmosClient:
+    services = None
+
+    def __init__(self, url=None, credential=None, **kwargs):
+        pass
+
+    def get_database_client(self, name):
+        database = FakeCosmosClient().get_database_client(name)
+        return SimpleNamespace(
+            get_container_client=lambda container: FakeAsyncContainer(database.get_container_client(container))
+        )
+
+    async def close(self):
+        pass
+
+
+# --------------------------------------------------------------------------
+# Azure AI Search
+# --------------------------------------------------------------------------
+
+_FILTER_PATTERN = re.compile(r"(\w+)\s+eq\s+('[^']*'|true|false|-?\d+)")
+
+
+class FakeSearchClient:
+    services = None
+
+    def __init__(self, endpoint=None, index_name=None, credential=None, **kwargs):
+        self._index_name = index_name
+        with self.services.lock:
+            self._docs = self.services.search_indexes.setdefault(index_name, {})
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        self.services.profile("search").call(operation)
+
+    def search(self, search_text=None, vector_queries=None, filter=None, select=None, top=None, **kwargs):
+        self._call("search")
+        conditions = []
+        for field, value in _FILTER_PATTERN.findall(filter or ""):
+            conditions.append((field, _literal(value, {})))
+        with self._lock:
+            docs = [d for d in self._docs.values() if all(d.get(f) == v for f, v in conditions)]
+        if top is not None:
+            docs = docs[:top]
+        results = []
+        for doc in docs:
+            result = {k: v for k, v in doc.items() if k != "embedding"}
+            result["@search.score"] = random.random()
+            results.append(result)
+        return iter(results)
+
+    def upload_documents(self, documents, **kwargs):
+        self._call("upload_documents")
+        with self._lock:
+            for doc in documents:
+                self._docs[doc["id"]] = dict(doc)
+        return [SimpleNamespace(key=d["id"], succeeded=True) for d in documents]
+
+    def merge_documents(self, documents, **kwargs):
+        self._call("merge_documents")
+        with self._lock:
+            for doc in documents:
+                self._docs.setdefault(doc["id"], {}).update(doc)
+        return [SimpleNamespace(key=d["id"], succeeded=True) for d in documents]
+
+    def delete_documents(self, documents=None, actions=None, **kwargs):
+        self._call("delete_documents")
+        with self._lock:
+            for doc in (documents or actions or []):
+                self._docs.pop(doc["id"], None)
+        return []
+
+    def index_documents(self, batch, **kwargs):
+        self._call("index_documents")
+        with self._lock:
+            for action in batch.actions:
+                doc = dict(action.additional_properties)
+                if action.action_type == "delete":
+                    self._docs.pop(doc.get("id"), None)
+                elif action.action_type in ("merge", "mergeOrUpload"):
+                    self._docs.setdefault(doc["id"], {}).update(doc)
+                else:
+                    self._docs[doc["id"]] = doc
+        return []
+
+
+# --------------------------------------------------------------------------
+# Blob Storage
+# --------------------------------------------------------------------------
+
+class FakeBlobClient:
+    def __init__(self, services, container, blob):
+        self._services = services
+        self._key = (container, blob)
+        self.url = f"https://fakeaccount.blob.core.windows.net/{container}/{blob}"
+
+    def _call(self, operation):
+        self._services.profile("blob").call(operation)
+
+    def upload_blob(self, data, content_settings=None, overwrite=False, **kwargs):
+        self._call("upload_blob")
+        if hasattr(data, "read"):
+            data = data.read()
+        with self._services.lock:
+            self._services.blobs[self._key] = bytes(data)
+
+    def download_blob(self, **kwargs):
+        self._call("download_blob")
+        with self._services.lock:
+            data = self._services.blobs[self._key]
+        return SimpleNamespace(readall=lambda: data)
+
+    def delete_blob(self, **kwargs):
+        self._call("delete_blob")
+        with self._services.lock:
+            self._services.blobs.pop(self._key, None)
+
+    def get_blob_properties(self, **kwargs):
+        self._call("get_blob_properties")
+        with self._services.lock:
+            data = self._services.blobs[self._key]
+        return SimpleNamespace(size=len(data), content_settings=SimpleNamespace(content_type=None))
+
+
+class FakeBlobContainerClient:
+    def __init__(self, services, name):
+        self._services = services
+        self.container_name = name
+
+    def exists(self):
+        self._services.profile("blob").call("exists")
+        return True
+
+    def create_container(self):
+        self._services.profile("blob").call("create_container")
+
+    def get_blob_client(self, blob):
+        return FakeBlobClient(self._services, self.container_name, blob)
+
+
+class FakeBlobServiceClient:
+    services = None
+
+    @classmethod
+    def from_connection_string(cls, connection_string, **kwargs):
+        return cls()
+
+    def get_container_client(self, container):
+        return FakeBlobContainerClient(self.services, container)
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient(self.services, container, blob)
+
+
+# --------------------------------------------------------------------------
+# Document Intelligence
+# --------------------------------------------------------------------------
+
+class FakeAnalyzePoller:
+    """Reports 'running' until the simulated analysis time has elapsed."""
+
+    def __init__(self, services, result, duration_s, failed):
+        self._result = result
+        self._ready_at = time.monotonic() + duration_s
+        self._failed = failed
+        self._callbacks = []
+        threading.Timer(duration_s, self._finish).start()
+
+    def _finish(self):
+        for callback in self._callbacks:
+            callback(self)
+
+    def status(self):
+        if time.monotonic() < self._ready_at:
+            return "running"
+        return "failed" if self._failed else "succeeded"
+
+    def done(self):
+        return time.monotonic() >= self._ready_at
+
+    def wait(self, timeout=None):
+        remaining = self._ready_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining if timeout is None else min(remaining, timeout))
+
+    def result(self, timeout=None):
+        self.wait(timeout)
+        if self._failed:
+            raise FakeServiceError(message="Injected document analysis failure")
+        return self._result
+
+    def add_done_callback(self, func):
+        if self.done():
+            func(self)
+        else:
+            self._callbacks.append(func)
+
+
+class FakeDocumentIntelligenceClient:
+    services = None
+    pages_per_document = 3
+
+    def __init__(self, endpoint=None, credential=None, **kwargs):
+        pass
+
+    def begin_analyze_document(self, model_id, document=None, analyze_request=None, pages=None, **kwargs):
+        profile = self.services.profile("document_intelligence")
+        data = document if document is not None else analyze_request
+        if hasattr(data, "read"):
+            data = data.read()
+        text = data.decode("utf-8", errors="ignore") if isinstance(data, (bytes, bytearray)) else str(data)
+        words = text.split() or ["empty"]
+        page_count = self.pages_per_document
+        page_numbers = list(range(1, page_count + 1))
+        if pages:
+            page_numbers = []
+            for part in str(pages).split(","):
+                first, _, last = part.partition("-")
+                page_numbers.extend(range(int(first), int(last or first) + 1))
+        result_pages = []
+        for page_number in page_numbers:
+            lines = [SimpleNamespace(content=" ".join(words[i:i + 12])) for i in range(0, len(words), 12)]
+            result_pages.append(SimpleNamespace(page_number=page_number, lines=lines))
+        result = SimpleNamespace(pages=result_pages, content=text)
+        duration_s = max(0.0, random.gauss(profile.latency_ms, profile.jitter_ms)) / 1000.0
+        failed = bool(profile.failure_rate and random.random() < profile.failure_rate)
+        return FakeAnalyzePoller(self.services, result, duration_s, failed)
+
+
+# --------------------------------------------------------------------------
+# Azure OpenAI
+# --------------------------------------------------------------------------
+
+class _FakeRawResponse:
+    def __init__(self, parsed, headers):
+        self._parsed = parsed
+        self.headers = headers
+
+    def parse(self):
+        return self._parsed
+
+
+class _FakeEmbeddings:
+    def __init__(self, services):
+        self._services = services
+        self.with_raw_response = SimpleNamespace(create=self._create_raw)
+
+    def _check_quota(self, tokens):
+        """Sliding one-minute token window when FakeServices.embedding_tpm is set."""
+        quota = self._services.embedding_tpm
+        if not quota:
+            return {}
+        with self._services.lock:
+            now = time.monotonic()
+            window = self._services.embedding_token_window
+            while window and window[0][0] <= now - 60:
+                window.pop(0)
+            used = sum(count for _, count in window)
+            if used + tokens > quota:
+                retry_after = max(0.1, window[0][0] + 60 - now) if window else 1.0
+                response = httpx.Response(
+                    429,
+                    headers={"retry-after-ms": str(int(retry_after * 1000))},
+                    request=httpx.Request("POST", "https://fakeopenai.example/embeddings")
+                )
+                self._services.embedding_rate_limited += 1
+                raise openai.RateLimitError("Fake TPM quota exceeded", response=response, body=None)
+            window.append((now, tokens))
+            return {"x-ratelimit-remaining-tokens": str(quota - used - tokens)}
+
+    def _create_raw(self, model=None, input=None, **kwargs):
+        inputs = input if isinstance(input, list) else [input]
+        headers = self._check_quota(sum(len(str(t)) // 4 for t in inputs))
+        return _FakeRawResponse(self.create(model=model, input=input, **kwargs), headers)
+
+    def create(self, model=None, input=None, **kwargs):
+        self._services.profile("openai_embedding").call("embeddings.create")
+        inputs = input if isinstance(input, list) else [input]
+        dims = kwargs.get("dimensions") or self._services.embedding_dimensions
+        data = []
+        for index, text in enumerate(inputs):
+            rng = random.Random(hash(text))
+            data.append(SimpleNamespace(index=index, embedding=[rng.random() for _ in range(dims)]))
+        usage = SimpleNamespace(prompt_tokens=sum(len(str(t)) // 4 for t in inputs), total_tokens=0)
+        return SimpleNamespace(data=data, model=model, usage=usage)
+
+
+class _FakeCompletions:
+    def __init__(self, services):
+        self._services = services
+
+    def _stream(self, tokens):
+        token_profile = self._services.profile("openai_token")
+        for token in tokens:
+            token_profile.call("stream")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        self._services.profile("openai_chat").call("chat.completions.create")
+        tokens = [f"token{i} " for i in range(self._services.stream_tokens)]
+        if stream:
+            return self._stream(tokens)
+        message = SimpleNamespace(content="".join(tokens), role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class _FakeImages:
+    def __init__(self, services):
+        self._services = services
+
+    def generate(self, prompt=None, n=1, model=None, **kwargs):
+        self._services.profile("openai_image").call("images.generate")
+        url = f"https://fakeimages.example/{uuid.uuid4()}.png"
+        return SimpleNamespace(model_dump_json=lambda: '{"data": [{"url": "%s"}]}' % url)
+
+
+class FakeAzureOpenAI:
+    services = None
+
+    def __init__(self, **kwargs):
+        self.embeddings = _FakeEmbeddings(self.services)
+        self.chat = SimpleNamespace(completions=_FakeCompletions(self.services))
+        self.images = _FakeImages(self.services)
+        self.deployments = SimpleNamespace(list=lambda: SimpleNamespace(data=[]))
+
+    def with_options(self, **kwargs):
+        return self
+
+
+class _FakeAsyncStream:
+    def __init__(self, services, tokens):
+        self._services = services
+        self._tokens = iter(tokens)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        token = next(self._tokens, None)
+        if token is None:
+            raise StopAsyncIteration
+        await _async_call(self._services.profile("openai_token"), "stream")
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+    async def close(self):
+        self._tokens = iter(())
+
+
+class _FakeAsyncCompletions:
+    def __init__(self, services):
+        self._services = services
+
+    async def create(self, model=None, messages=None, stream=False, **kwargs):
+        await _async_call(self._services.profile("openai_chat"), "chat.completions.create")
+        tokens = [f"token{i} " for i in range(self._services.stream_tokens)]
+        if stream:
+            return _FakeAsyncStream(self._services, tokens)
+        message = SimpleNamespace(content="".join(tokens), role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeAsyncAzureOpenAI:
+    services = None
+
+    def __init__(self, **kwargs):
+        self.chat = SimpleNamespace(completions=_FakeAsyncCompletions(self.services))
+
+    async def close(self):
+        pass
+
+
+# --------------------------------------------------------------------------
+# Installation
+# --------------------------------------------------------------------------
+
+def install_fakes(services):
+    """
+    Replace the Azure SDK classes with the fakes. Must run before the app
+    (config.py) is imported, since config binds the names at import time.
+    """
+    import azure.ai.documentintelligence
+    import azure.ai.formrecognizer
+    import azure.cosmos
+    import azure.cosmos.aio
+    import azure.search.documents
+    import azure.storage.blob
+    import openai
+
+    for fake in (FakeCosmosClient, FakeSearchClient, FakeBlobServiceClient,
+                 FakeDocumentIntelligenceClient, FakeAzureOpenAI, FakeAsyncCosmosClient, FakeAsyncAzureOpenAI):
+        fake.services = services
+
+    azure.cosmos.CosmosClient = FakeCosmosClient
+    azure.search.documents.SearchClient = FakeSearchClient
+    azure.storage.blob.BlobServiceClient = FakeBlobServiceClient
+    azure.ai.documentintelligence.DocumentIntelligenceClient = FakeDocumentIntelligenceClient
+    azure.ai.formrecognizer.DocumentAnalysisClient = FakeDocumentIntelligenceClient
+    openai.AzureOpenAI = FakeAzureOpenAI
+    azure.cosmos.aio.CosmosClient = FakeAsyncCosmosClient
+    openai.AsyncAzureOpenAI = FakeAsyncAzureOpenAI
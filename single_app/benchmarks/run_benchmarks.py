@@ -0,0 +1,487 @@
+# benchmarks/run_benchmarks.py
+#
+# Drives the Flask app in-process against the fakes in benchmarks/fakes.py
+# and reports throughput and latency percentiles per endpoint.
+#
+# Run from the single_app directory:
+#
+#   python -m benchmarks.run_benchmarks
+#   python -m benchmarks.run_benchmarks --scenarios chat_stream,get_citation --concurrency 16
+#   python -m benchmarks.run_benchmarks --latency-scale 0 --requests 500
+#
+# Every run is written to benchmarks/results/ and compared with the latest
+# previous run, so regressions show up between commits.
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+
+BENCHMARK_USER_ID = "benchmark-user"
+SEEDED_DOCUMENTS = 20
+CHUNKS_PER_DOCUMENT = 10
+
+
+def configure_environment(work_dir):
+    """Dummy configuration so config.py imports without real resources."""
+    defaults = {
+        "SECRET_KEY": "benchmark-secret-key",
+        "AZURE_COSMOS_ENDPOINT": "https://fake-cosmos.documents.azure.com:443/",
+        "AZURE_COSMOS_KEY": "ZmFrZQ==",
+        "AZURE_COSMOS_AUTHENTICATION_TYPE": "key",
+        "AZURE_STORAGE_CONNECTION_STRING": "UseDevelopmentStorage=true",
+        "SIMPLECHAT_FAST_START": "true",
+        "SESSION_BACKEND": "memory",
+        "SETTINGS_VERSION_FILE": os.path.join(work_dir, "settings.version"),
+        "INGESTION_JOB_STORE_PATH": os.path.join(work_dir, "ingestion_jobs.sqlite3"),
+        "CONTENT_REGISTRY_PATH": os.path.join(work_dir, "content_registry.sqlite3"),
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+def _benchmark_settings():
+    return {
+        "id": "app_settings",
+        "app_title": "Simple Chat",
+        "enable_user_workspace": True,
+        "enable_group_workspaces": True,
+        "enable_content_safety": False,
+        "enable_image_generation": False,
+        "enable_web_search": False,
+        "enable_gpt_apim": False,
+        "enable_embedding_apim": False,
+        "azure_openai_gpt_endpoint": "https://fake-openai.openai.azure.com/",
+        "azure_openai_gpt_api_version": "2024-05-01-preview",
+        "azure_openai_gpt_authentication_type": "key",
+        "azure_openai_gpt_key": "fake",
+        "gpt_model": {"selected": [{"deploymentName": "gpt-4o", "modelName": "gpt-4o"}], "all": []},
+        "azure_openai_embedding_endpoint": "https://fake-openai.openai.azure.com/",
+        "azure_openai_embedding_api_version": "2024-05-01-preview",
+        "azure_openai_embedding_authentication_type": "key",
+        "azure_openai_embedding_key": "fake",
+        "embedding_model": {"selected": [{"deploymentName": "text-embedding-3-small", "modelName": "text-embedding-3-small"}], "all": []},
+        "azure_ai_search_endpoint": "https://fake-search.search.windows.net",
+        "azure_ai_search_key": "fake",
+        "azure_ai_search_authentication_type": "key",
+        "azure_document_intelligence_endpoint": "https://fake-di.cognitiveservices.azure.com/",
+        "azure_document_intelligence_key": "fake",
+        "azure_document_intelligence_authentication_type": "key",
+        "max_file_size_mb": 150,
+        "conversation_history_limit": 10,
+        "default_system_prompt": "",
+    }
+
+
+def _seed_data(config_module, services):
+    """Documents, search chunks and conversations for the read-only scenarios."""
+    config_module.settings_container.upsert_item(_benchmark_settings())
+
+    search_index = services.search_indexes.setdefault("simplechat-user-index", {})
+    citation_ids = []
+    for doc_number in range(SEEDED_DOCUMENTS):
+        document_id = str(uuid.uuid4())
+        file_name = f"benchmark-{doc_number}.txt"
+        config_module.documents_container.upsert_item({
+            "id": document_id,
+            "file_name": file_name,
+            "user_id": BENCHMARK_USER_ID,
+            "upload_date": "2025-01-01T00:00:00Z",
+            "version": 1,
+            "num_chunks": CHUNKS_PER_DOCUMENT,
+            "blob_url": None,
+        })
+        for chunk_number in range(1, CHUNKS_PER_DOCUMENT + 1):
+            chunk_id = f"{document_id}_{chunk_number}"
+            search_index[chunk_id] = {
+                "id": chunk_id,
+                "document_id": document_id,
+                "chunk_id": str(chunk_number),
+                "chunk_text": f"Benchmark chunk {chunk_number} of {file_name}. " * 40,
+                "chunk_sequence": chunk_number,
+                "page_number": chunk_number,
+                "file_name": file_name,
+                "user_id": BENCHMARK_USER_ID,
+                "version": 1,
+                "upload_date": "2025-01-01T00:00:00Z",
+                "storage_url": None,
+                "is_default": False,
+            }
+            citation_ids.append((chunk_id, file_name, chunk_number))
+
+    for conversation_number in range(50):
+        config_module.container.upsert_item({
+            "id": str(uuid.uuid4()),
+            "user_id": BENCHMARK_USER_ID,
+            "title": f"Benchmark conversation {conversation_number}",
+            "messages": [],
+            "last_updated": datetime.now(timezone.utc).isoformat(),
+        })
+    return citation_ids
+
+
+# --------------------------------------------------------------------------
+# Scenarios: each takes (client, context, iteration) and returns a response
+# --------------------------------------------------------------------------
+
+def _chat(client, streaming, hybrid_search):
+    response = client.post("/api/chat", json={
+        "message": "Summarize the benchmark documents.",
+        "conversation_id": None,
+        "hybrid_search": hybrid_search,
+        "doc_scope": "personal",
+        "streaming": streaming,
+    }, buffered=True)
+    return response
+
+
+def scenario_chat(client, context, iteration):
+    return _chat(client, streaming=False, hybrid_search=False)
+
+
+def scenario_chat_stream(client, context, iteration):
+    return _chat(client, streaming=True, hybrid_search=False)
+
+
+def scenario_chat_hybrid_search(client, context, iteration):
+    return _chat(client, streaming=False, hybrid_search=True)
+
+
+def scenario_documents_upload(client, context, iteration):
+    body = ("Benchmark upload paragraph with enough words to chunk. " * 400).encode("utf-8")
+    return client.post("/api/documents/upload", data={
+        "file": (io.BytesIO(body), f"upload-{iteration}.txt"),
+    }, content_type="multipart/form-data")
+
+
+def scenario_get_citation(client, context, iteration):
+    citation_id, file_name, page = context["citation_ids"][iteration % len(context["citation_ids"])]
+    return client.post("/api/get_citation", json={
+        "citation_id": citation_id,
+        "expected_filename": file_name,
+        "expected_page": page,
+    })
+
+
+def scenario_list_documents(client, context, iteration):
+    return client.get("/api/documents")
+
+
+def scenario_list_conversations(client, context, iteration):
+    return client.get("/api/get_conversations")
+
+
+SCENARIOS = {
+    "chat": scenario_chat,
+    "chat_stream": scenario_chat_stream,
+    "chat_hybrid_search": scenario_chat_hybrid_search,
+    "documents_upload": scenario_documents_upload,
+    "get_citation": scenario_get_citation,
+    "list_documents": scenario_list_documents,
+    "list_conversations": scenario_list_conversations,
+}
+
+# Served by asgi.py on an event loop instead of the Flask test client
+ASGI_SCENARIOS = ["chat_stream_asgi"]
+
+# Uploads go through Document Intelligence polling and are much slower than
+# everything else, so they get fewer iterations by default.
+DEFAULT_REQUESTS = {"documents_upload": 10, "chat_stream_asgi": 1000}
+
+
+# --------------------------------------------------------------------------
+# Runner
+# --------------------------------------------------------------------------
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(percent / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def _authenticated_client(flask_app):
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session["user"] = {
+            "oid": BENCHMARK_USER_ID,
+            "name": "Benchmark User",
+            "preferred_username": "benchmark@example.com",
+            "roles": ["User", "Admin"],
+        }
+    return client
+
+
+def run_scenario(flask_app, name, scenario, context, concurrency, total_requests, warmup):
+    local = threading.local()
+    latencies = []
+    errors = []
+    results_lock = threading.Lock()
+
+    def one_request(iteration, record=True):
+        if not hasattr(local, "client"):
+            local.client = _authenticated_client(flask_app)
+        start = time.perf_counter()
+        try:
+            response = scenario(local.client, context, iteration)
+            response.get_data()  # drain streamed bodies
+            ok = response.status_code < 400
+            error = None if ok else f"HTTP {response.status_code}"
+        except Exception as e:
+            ok = False
+            error = type(e).__name__
+        elapsed = time.perf_counter() - start
+        if record:
+            with results_lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors.append(error)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda i: one_request(i, record=False), range(warmup)))
+        started = time.perf_counter()
+        list(executor.map(one_request, range(total_requests)))
+        wall_time = time.perf_counter() - started
+
+    return _summarize(latencies, errors, concurrency, wall_time)
+
+
+def run_asgi_stream_scenario(flask_app, concurrency, total_requests):
+    """
+    Streaming chat through asgi.py on a single event loop, with up to
+    `concurrency` streams open at once, to check that open streams do not
+    need a thread each.
+    """
+    import asyncio
+    import httpx
+    from asgi import application
+
+    session_cookie = _authenticated_client(flask_app).get_cookie("session").value
+    latencies = []
+    errors = []
+
+    async def one_stream(client, semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post("/api/chat", json={
+                    "message": "Summarize the benchmark documents.",
+                    "streaming": True,
+                })
+                ok = response.status_code < 400 and '"type": "done"' in response.text
+                error = None if ok else f"HTTP {response.status_code}"
+            except Exception as e:
+                ok = False
+                error = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors.append(error)
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", cookies={"session": session_cookie}) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(one_stream(client, semaphore) for _ in range(total_requests)))
+            return time.perf_counter() - started
+
+    wall_time = asyncio.run(run_all())
+    return _summarize(latencies, errors, concurrency, wall_time)
+
+
+def _summarize(latencies, errors, concurrency, wall_time):
+    ordered = sorted(latencies)
+    error_counts = {}
+    for error in errors:
+        error_counts[error] = error_counts.get(error, 0) + 1
+
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "wall_time_s": round(wall_time, 4),
+        "throughput_rps": round(len(latencies) / wall_time, 3) if wall_time else None,
+        "error_rate": round(len(errors) / len(latencies), 4) if latencies else None,
+        "errors": error_counts,
+        "latency_ms": {
+            "mean": round(statistics.mean(ordered) * 1000, 2) if ordered else None,
+            "p50": round(_percentile(ordered, 50) * 1000, 2) if ordered else None,
+            "p90": round(_percentile(ordered, 90) * 1000, 2) if ordered else None,
+            "p99": round(_percentile(ordered, 99) * 1000, 2) if ordered else None,
+            "max": round(ordered[-1] * 1000, 2) if ordered else None,
+        },
+    }
+
+
+# --------------------------------------------------------------------------
+# Result storage and comparison
+# --------------------------------------------------------------------------
+
+def git_revision():
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], cwd=APP_DIR, stderr=subprocess.DEVNULL) != 0
+        return sha + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_previous_result(kind, path=None):
+    """The given result file, or the latest stored result of this kind."""
+    if path:
+        with open(path) as f:
+            return json.load(f)
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    runs = sorted(name for name in os.listdir(RESULTS_DIR) if name.startswith(f"{kind}_") and name.endswith(".json"))
+    if not runs:
+        return None
+    with open(os.path.join(RESULTS_DIR, runs[-1])) as f:
+        return json.load(f)
+
+
+def save_result(kind, result):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    file_name = f"{kind}_{result['timestamp'].replace(':', '').replace('-', '')}_{result['git_revision']}.json"
+    path = os.path.join(RESULTS_DIR, file_name)
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    return path
+
+
+def compare_results(current, previous, threshold):
+    """Print per-scenario deltas; return the scenarios that regressed beyond threshold."""
+    regressions = []
+    if not previous:
+        return regressions
+    print(f"\nComparison with {previous['git_revision']} ({previous['timestamp']}):")
+    for name, stats in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before or not before["latency_ms"]["p50"] or not stats["latency_ms"]["p50"]:
+            continue
+        p50_delta = stats["latency_ms"]["p50"] / before["latency_ms"]["p50"] - 1
+        p99_delta = stats["latency_ms"]["p99"] / before["latency_ms"]["p99"] - 1
+        rps_delta = stats["throughput_rps"] / before["throughput_rps"] - 1 if before["throughput_rps"] else 0.0
+        flag = ""
+        if p50_delta > threshold or p99_delta > threshold or rps_delta < -threshold:
+            flag = "  <-- REGRESSION"
+            regressions.append(name)
+        print(f"  {name:22s} p50 {p50_delta:+7.1%}  p99 {p99_delta:+7.1%}  rps {rps_delta:+7.1%}{flag}")
+    return regressions
+
+
+def _print_table(result):
+    print(f"\n{'scenario':22s} {'reqs':>6s} {'rps':>9s} {'p50 ms':>9s} {'p90 ms':>9s} {'p99 ms':>9s} {'errors':>7s}")
+    for name, stats in result["scenarios"].items():
+        latency = stats["latency_ms"]
+        print(f"{name:22s} {stats['requests']:6d} {stats['throughput_rps']:9.2f} "
+              f"{latency['p50']:9.2f} {latency['p90']:9.2f} {latency['p99']:9.2f} {stats['error_rate']:7.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline SimpleChat benchmarks against in-process Azure fakes.")
+    all_scenarios = list(SCENARIOS) + ASGI_SCENARIOS
+    parser.add_argument("--scenarios", default=",".join(all_scenarios), help="Comma separated list of: " + ", ".join(all_scenarios))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--asgi-concurrency", type=int, default=500, help="Concurrent streams for the ASGI scenarios")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="Unrecorded requests per scenario")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier for all fake latencies (0 = no latency)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that any fake call fails")
+    parser.add_argument("--embedding-tpm", type=int, help="Tokens-per-minute quota of the fake embedding deployment (default: unlimited)")
+    parser.add_argument("--profile", action="append", default=[],
+                        help="Override one fake, e.g. openai_chat:latency_ms=800 or search:failure_rate=0.05")
+    parser.add_argument("--baseline", help="Result file to compare with (default: latest in benchmarks/results)")
+    parser.add_argument("--regression-threshold", type=float, default=0.10)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args(argv)
+
+    scenario_names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenario_names if name not in all_scenarios]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    profiles = {}
+    for override in args.profile:
+        service, _, assignment = override.partition(":")
+        key, _, value = assignment.partition("=")
+        profiles.setdefault(service, {})[key] = float(value)
+
+    # Sessions are filesystem-backed and created relative to the cwd, so keep
+    # them (and the settings version file) out of the source tree.
+    work_dir = tempfile.mkdtemp(prefix="simplechat-bench-")
+    configure_environment(work_dir)
+    sys.path.insert(0, APP_DIR)
+    os.chdir(work_dir)
+
+    from benchmarks.fakes import FakeServices, install_fakes
+    services = FakeServices(profiles=profiles, failure_rate=args.failure_rate, latency_scale=args.latency_scale, embedding_tpm=args.embedding_tpm)
+    install_fakes(services)
+
+    # Seed with latency and failures off so setup is fast and deterministic
+    seed_profiles = {name: (p.latency_ms, p.jitter_ms, p.failure_rate) for name, p in services.profiles.items()}
+    for profile in services.profiles.values():
+        profile.latency_ms = profile.jitter_ms = profile.failure_rate = 0.0
+
+    import config as config_module
+    context = {"citation_ids": _seed_data(config_module, services)}
+    from app import app as flask_app
+
+    for name, (latency_ms, jitter_ms, failure_rate) in seed_profiles.items():
+        profile = services.profiles[name]
+        profile.latency_ms, profile.jitter_ms, profile.failure_rate = latency_ms, jitter_ms, failure_rate
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "parameters": {
+            "concurrency": args.concurrency,
+            "asgi_concurrency": args.asgi_concurrency,
+            "requests": args.requests,
+            "latency_scale": args.latency_scale,
+            "failure_rate": args.failure_rate,
+            "profiles": profiles,
+        },
+        "scenarios": {},
+    }
+
+    for name in scenario_names:
+        total = DEFAULT_REQUESTS.get(name, args.requests) if args.requests == parser.get_default("requests") else args.requests
+        if name in ASGI_SCENARIOS:
+            print(f"Running {name}: {total} requests at concurrency {args.asgi_concurrency}...", file=sys.stderr)
+            result["scenarios"][name] = run_asgi_stream_scenario(flask_app, args.asgi_concurrency, total)
+            continue
+        print(f"Running {name}: {total} requests at concurrency {args.concurrency}...", file=sys.stderr)
+        result["scenarios"][name] = run_scenario(
+            flask_app, name, SCENARIOS[name], context, args.concurrency, total, args.warmup if name != "documents_upload" else 0
+        )
+
+    _print_table(result)
+    previous = load_previous_result("endpoints", args.baseline)
+    regressions = compare_results(result, previous, args.regression_threshold)
+
+    if not args.no_save:
+        print(f"\nResults written to {save_result('endpoints', result)}")
+
+    if regressions and args.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+# benchmarks/startup_benchmark.py
+#
+# Measures what a fresh worker pays to import the app: wall-clock import
+# time, resident memory, module count, and which heavy optional SDKs were
+# loaded eagerly. Each run imports the app in a new interpreter (with
+# -X importtime) against a fake Cosmos client.
+#
+# Run from the single_app directory:
+#
+#   python -m benchmarks.startup_benchmark
+#   python -m benchmarks.startup_benchmark --runs 10 --fail-on-regression
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from benchmarks.run_benchmarks import APP_DIR, configure_environment, git_revision, load_previous_result, save_result
+
+# Modules that should only be imported by the code paths that need them
+LAZY_MODULES = [
+    "pandas",
+    "docx",
+    "markdown2",
+    "sklearn",
+    "scipy",
+    "azure.ai.formrecognizer",
+    "azure.ai.documentintelligence",
+    "azure.ai.contentsafety",
+    "azure.mgmt.cognitiveservices",
+]
+
+# Executed in the child interpreter. config.py builds a CosmosClient at import
+# time, which would otherwise try to reach the account endpoint.
+CHILD_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {app_dir!r})
+import azure.cosmos
+from benchmarks.fakes import FakeCosmosClient, FakeServices
+FakeCosmosClient.services = FakeServices(latency_scale=0)
+azure.cosmos.CosmosClient = FakeCosmosClient
+baseline_modules = set(sys.modules)
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+import functions_startup
+print("STARTUP_RESULT " + json.dumps({{
+    "import_seconds": elapsed,
+    "rss_mb": functions_startup.get_rss_mb(),
+    "modules": len(sys.modules),
+    "new_modules": len(set(sys.modules) - baseline_modules),
+    "lazy_modules_loaded": [m for m in {lazy_modules!r} if m in sys.modules],
+}}))
+"""
+
+
+def _parse_importtime(stderr, top):
+    """Top modules by self time from -X importtime output."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "", 1).split("|")]
+            entries.append({"module": name, "self_ms": int(self_us) / 1000.0, "cumulative_ms": int(cumulative_us) / 1000.0})
+        except ValueError:
+            continue
+    entries.sort(key=lambda entry: entry["self_ms"], reverse=True)
+    return entries[:top]
+
+
+def run_once(work_dir, top):
+    script = CHILD_SCRIPT.format(app_dir=APP_DIR, lazy_modules=LAZY_MODULES)
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=work_dir, env=os.environ.copy(), capture_output=True, text=True
+    )
+    result_lines = [line for line in completed.stdout.splitlines() if line.startswith("STARTUP_RESULT ")]
+    if completed.returncode != 0 or not result_lines:
+        raise RuntimeError(f"App import failed:\n{completed.stderr[-4000:]}")
+    result = json.loads(result_lines[-1][len("STARTUP_RESULT "):])
+    result["slowest_imports"] = _parse_importtime(completed.stderr, top)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app import time and per-worker memory.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to report")
+    parser.add_argument("--baseline", help="Result file to compare with (default: latest startup result)")
+    parser.add_argument("--regression-threshold", type=float, default=0.10)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="simplechat-startup-")
+    configure_environment(work_dir)
+
+    runs = []
+    for run_number in range(args.runs):
+        print(f"Import run {run_number + 1}/{args.runs}...", file=sys.stderr)
+        runs.append(run_once(work_dir, args.top))
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "runs": args.runs,
+        "import_seconds": {
+            "median": round(statistics.median(r["import_seconds"] for r in runs), 4),
+            "min": round(min(r["import_seconds"] for r in runs), 4),
+            "max": round(max(r["import_seconds"] for r in runs), 4),
+        },
+        "rss_mb": round(statistics.median(r["rss_mb"] for r in runs), 1) if runs[0]["rss_mb"] is not None else None,
+        "modules": runs[-1]["modules"],
+        "lazy_modules_loaded": runs[-1]["lazy_modules_loaded"],
+        "slowest_imports": runs[-1]["slowest_imports"],
+    }
+
+    print(f"\nImport time: median {result['import_seconds']['median']:.3f}s "
+          f"(min {result['import_seconds']['min']:.3f}s, max {result['import_seconds']['max']:.3f}s)")
+    print(f"RSS after import: {result['rss_mb']} MB, {result['modules']} modules")
+    if result["lazy_modules_loaded"]:
+        print(f"Eagerly loaded heavy modules: {', '.join(result['lazy_modules_loaded'])}")
+    print("\nSlowest imports (self time):")
+    for entry in result["slowest_imports"]:
+        print(f"  {entry['self_ms']:9.1f} ms  {entry['module']}")
+
+    regressed = False
+    previous = load_previous_result("startup", args.baseline)
+    if previous:
+        time_delta = result["import_seconds"]["median"] / previous["import_seconds"]["median"] - 1
+        rss_delta = (result["rss_mb"] / previous["rss_mb"] - 1) if result["rss_mb"] and previous.get("rss_mb") else 0.0
+        regressed = time_delta > args.regression_threshold or rss_delta > args.regression_threshold
+        print(f"\nComparison with {previous['git_revision']} ({previous['timestamp']}): "
+              f"import {time_delta:+.1%}, RSS {rss_delta:+.1%}" + ("  <-- REGRESSION" if regressed else ""))
+
+    if not args.no_save:
+        print(f"\nResults written to {save_result('startup', result)}")
+
+    if regressed and args.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,16 +6,15 @@ import uuid
 import tempfile
 import json
 import openai
-import pandas as pd
+import httpx
+import hashlib
 import time
 import threading
 import random
 import base64
-import markdown2
 import re
 import traceback
 import logging
-import docx
 
 import smtplib
 from email.mime.text import MIMEText
@@ -29,33 +28,41 @@ from email.mime.text import MIMEText
 from azure.search.documents import SearchClient
 
 from flask import Flask, request, jsonify, render_template, redirect, url_for, session, send_from_directory, send_file, Markup
-from flask import Response
+from flask import Response, g, has_request_context
 from werkzeug.utils import secure_filename
 from datetime import datetime, timezone
 from functools import wraps
+from collections import OrderedDict
+from itertools import islice
 from msal import ConfidentialClientApplication
 from flask_session import Session
 from uuid import uuid4
 from threading import Thread
-from openai import AzureOpenAI, RateLimitError
+from concurrent.futures import ThreadPoolExecutor, Future, InvalidStateError, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from openai import AzureOpenAI, AsyncAzureOpenAI, RateLimitError
 from cryptography.fernet import Fernet, InvalidToken
 from urllib.parse import quote
 
 from azure.cosmos import CosmosClient, PartitionKey, exceptions
-from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from azure.cosmos.exceptions import CosmosResourceNotFoundError, CosmosResourceExistsError
+from azure.core import MatchConditions
 from azure.core.credentials import AzureKeyCredential
-from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.search.documents import SearchClient, IndexDocumentsBatch
 from azure.search.documents.models import VectorizedQuery
 from azure.core.exceptions import AzureError, ResourceNotFoundError, HttpResponseError
 from azure.core.polling import LROPoller
-from azure.mgmt.cognitiveservices import CognitiveServicesManagementClient
 from azure.identity import ClientSecretCredential, DefaultAzureCredential, get_bearer_token_provider, AzureAuthorityHosts
-from azure.ai.contentsafety import ContentSafetyClient
-from azure.ai.contentsafety.models import AnalyzeTextOptions, TextCategory
+from functions_credentials import get_shared_credential, get_async_shared_credential
+from functions_rate_limit import AdaptiveRateLimiter, retry_after_seconds
+from functions_session import configure_session, compact_user_claims
 from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient, ContentSettings
 
+# Heavy, rarely used SDKs (Document Intelligence / Form Recognizer, Content
+# Safety, the cognitive services management client, pandas, python-docx,
+# markdown2) are imported inside the functions that use them, so a worker
+# only pays for them once it actually serves an upload or an admin page.
+
 from azure.search.documents import SearchClient
 from azure.core.credentials import AzureKeyCredential
 
@@ -65,10 +72,9 @@ from azure.search.documents import SearchClient
 app = Flask(__name__)
 
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
-app.config['SESSION_TYPE'] = 'filesystem'
 app.config['VERSION'] = '0.203.16'
 app.config['UPLOAD_TIMEOUT'] = 300
-Session(app)
+configure_session(app)
 
 CLIENTS = {}
 CLIENTS_LOCK = threading.Lock()
@@ -99,12 +105,127 @@ else:
 
 BING_SEARCH_ENDPOINT = os.getenv("BING_SEARCH_ENDPOINT")
 
+# App settings cache: how long a worker trusts its snapshot before revalidating
+# against Cosmos (ETag check), and the local file whose mtime is bumped on every
+# update_settings() so sibling workers on the same host drop their snapshot at once.
+SETTINGS_CACHE_TTL_SECONDS = float(os.getenv("SETTINGS_CACHE_TTL_SECONDS", "30"))
+SETTINGS_VERSION_FILE = os.getenv("SETTINGS_VERSION_FILE", os.path.join(tempfile.gettempdir(), "simplechat_settings.version"))
+
+# Connection pool sizing for the shared Azure OpenAI clients (see functions_openai.py)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "60"))
+OPENAI_REQUEST_TIMEOUT_SECONDS = float(os.getenv("OPENAI_REQUEST_TIMEOUT_SECONDS", "600"))
+
+# Document chunking (functions_content.py): CHUNKING_MODE=characters splits
+# pages into 2000 character chunks with 200 characters of overlap;
+# CHUNKING_MODE=tokens uses CHUNK_SIZE_TOKENS / CHUNK_OVERLAP_TOKENS tokens of
+# TOKENIZER_ENCODING (functions_tokenizer.py).
+CHUNKING_MODE = os.getenv("CHUNKING_MODE", "characters").lower()
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "500"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+# Oldest conversation messages are left out of a chat prompt above this many
+# tokens (0 = only conversation_history_limit applies)
+CHAT_PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "0"))
+
+# .docx, .pptx, .xlsx and .html files are parsed locally (functions_content.py
+# LOCAL_EXTRACTORS) and only sent to Document Intelligence when that finds no
+# text; XLSX_ROWS_PER_PAGE rows of a sheet make one page. PDF pages whose text
+# layer has at least PDF_TEXT_LAYER_MIN_CHARS letters or digits, and at least
+# PDF_TEXT_LAYER_MIN_DENSITY per square inch, are read locally too unless
+# images cover PDF_SCANNED_IMAGE_COVERAGE of the page; only the other pages
+# are sent to Document Intelligence.
+LOCAL_EXTRACTION_ENABLED = os.getenv("LOCAL_EXTRACTION_ENABLED", "true").lower() == "true"
+XLSX_ROWS_PER_PAGE = int(os.getenv("XLSX_ROWS_PER_PAGE", "200"))
+PDF_TEXT_LAYER_MIN_CHARS = int(os.getenv("PDF_TEXT_LAYER_MIN_CHARS", "20"))
+PDF_TEXT_LAYER_MIN_DENSITY = float(os.getenv("PDF_TEXT_LAYER_MIN_DENSITY", "2"))
+PDF_SCANNED_IMAGE_COVERAGE = float(os.getenv("PDF_SCANNED_IMAGE_COVERAGE", "0.5"))
+
+# Document Intelligence extraction (functions_content.py): PDFs longer than
+# DOCUMENT_INTELLIGENCE_PAGE_RANGE_SIZE pages are analyzed as page ranges,
+# at most DOCUMENT_INTELLIGENCE_MAX_PARALLEL_RANGES at a time per worker
+# process; a failed range is retried up to DOCUMENT_INTELLIGENCE_RANGE_ATTEMPTS
+# times on its own.
+DOCUMENT_INTELLIGENCE_PAGE_RANGE_SIZE = int(os.getenv("DOCUMENT_INTELLIGENCE_PAGE_RANGE_SIZE", "50"))
+DOCUMENT_INTELLIGENCE_MAX_PARALLEL_RANGES = int(os.getenv("DOCUMENT_INTELLIGENCE_MAX_PARALLEL_RANGES", "4"))
+DOCUMENT_INTELLIGENCE_RANGE_ATTEMPTS = int(os.getenv("DOCUMENT_INTELLIGENCE_RANGE_ATTEMPTS", "3"))
+# Status polls of an analysis start DOCUMENT_INTELLIGENCE_POLL_INITIAL_SECONDS
+# apart and back off to DOCUMENT_INTELLIGENCE_POLL_MAX_SECONDS; an analysis
+# still running after DOCUMENT_INTELLIGENCE_TIMEOUT_SECONDS fails
+DOCUMENT_INTELLIGENCE_POLL_INITIAL_SECONDS = float(os.getenv("DOCUMENT_INTELLIGENCE_POLL_INITIAL_SECONDS", "0.25"))
+DOCUMENT_INTELLIGENCE_POLL_MAX_SECONDS = float(os.getenv("DOCUMENT_INTELLIGENCE_POLL_MAX_SECONDS", "5"))
+DOCUMENT_INTELLIGENCE_TIMEOUT_SECONDS = float(os.getenv("DOCUMENT_INTELLIGENCE_TIMEOUT_SECONDS", "600"))
+
+# Limits for one embeddings.create call made by generate_embeddings_batch
+# (Azure OpenAI accepts up to 2048 inputs per request)
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "64"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "60000"))
+
+# Quota of the embedding deployment, used by the ingestion rate limiter in
+# functions_content.py. Ingestion only uses EMBEDDING_INGESTION_QUOTA_SHARE of
+# it; the rest is left for query embeddings during chat.
+EMBEDDING_TPM_LIMIT = int(os.getenv("EMBEDDING_TPM_LIMIT", "120000"))
+EMBEDDING_RPM_LIMIT = int(os.getenv("EMBEDDING_RPM_LIMIT", "720"))
+EMBEDDING_INGESTION_QUOTA_SHARE = float(os.getenv("EMBEDDING_INGESTION_QUOTA_SHARE", "0.8"))
+# Embedding requests in flight per worker process, across all uploads
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", "4"))
+# Chunks embedded per window by the streaming ingestion pipeline; at most
+# two windows of vectors are held in memory per upload
+EMBEDDING_PIPELINE_WINDOW = int(os.getenv("EMBEDDING_PIPELINE_WINDOW", "256"))
+
+# Content-addressed embedding cache (functions_embedding_cache.py): a local
+# SQLite file shared by the workers on a host, plus an optional Cosmos
+# container shared by all instances.
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(tempfile.gettempdir(), "simplechat_embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+EMBEDDING_CACHE_COSMOS_ENABLED = os.getenv("EMBEDDING_CACHE_COSMOS_ENABLED", "false").lower() == "true"
+
+# Re-uploading a file updates its latest version in place and only re-indexes
+# the chunks whose text changed (functions_incremental_index.py). When off,
+# every upload is indexed as a new, separate document.
+ENABLE_INCREMENTAL_REINDEX = os.getenv("ENABLE_INCREMENTAL_REINDEX", "true").lower() == "true"
+
+# Document ingestion (functions_ingestion_jobs.py):
+#   INGESTION_MODE=background  uploads return 202 and INGESTION_WORKERS threads
+#                              per process run the jobs
+#   INGESTION_MODE=queue       uploads return 202; jobs are run by a separate
+#                              "python ingestion_worker.py" process
+#   INGESTION_MODE=sync        the upload request runs the whole pipeline
+#   INGESTION_JOB_STORE=sqlite (INGESTION_JOB_STORE_PATH, one host) | cosmos | memory
+INGESTION_MODE = os.getenv("INGESTION_MODE", "background").lower()
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_JOB_STORE = os.getenv("INGESTION_JOB_STORE", "sqlite").lower()
+INGESTION_JOB_STORE_PATH = os.getenv("INGESTION_JOB_STORE_PATH", os.path.join(tempfile.gettempdir(), "simplechat_ingestion_jobs.sqlite3"))
+INGESTION_POLL_INTERVAL_SECONDS = float(os.getenv("INGESTION_POLL_INTERVAL_SECONDS", "2"))
+# A running job whose worker has not reported (heartbeat or progress) for
+# this long is picked up again
+INGESTION_JOB_STALE_SECONDS = float(os.getenv("INGESTION_JOB_STALE_SECONDS", "900"))
+# How often a worker marks the job it is running as alive
+INGESTION_JOB_HEARTBEAT_SECONDS = float(os.getenv("INGESTION_JOB_HEARTBEAT_SECONDS", str(INGESTION_JOB_STALE_SECONDS / 5)))
+INGESTION_JOB_MAX_ATTEMPTS = int(os.getenv("INGESTION_JOB_MAX_ATTEMPTS", "3"))
+
+# Uploads of a file already stored (any workspace) reuse its blob and
+# extracted pages (functions_content_registry.py). CONTENT_REGISTRY=sqlite
+# (CONTENT_REGISTRY_PATH) only sees uploads made on this host; deployments
+# with several instances need cosmos to share blobs between them. Blobs are
+# only deleted once no document metadata points at them, whatever the
+# registry knows.
+CONTENT_DEDUP_ENABLED = os.getenv("CONTENT_DEDUP_ENABLED", "true").lower() == "true"
+CONTENT_REGISTRY = os.getenv("CONTENT_REGISTRY", "cosmos" if INGESTION_JOB_STORE == "cosmos" else "sqlite").lower()
+CONTENT_REGISTRY_PATH = os.getenv("CONTENT_REGISTRY_PATH", os.path.join(tempfile.gettempdir(), "simplechat_content_registry.sqlite3"))
+
+# In-process cache of search query embeddings (functions_search.py)
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "2048"))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+
 # Initialize Azure Cosmos DB client
 cosmos_endpoint = os.getenv("AZURE_COSMOS_ENDPOINT")
 cosmos_key = os.getenv("AZURE_COSMOS_KEY")
 cosmos_authentication_type = os.getenv("AZURE_COSMOS_AUTHENTICATION_TYPE", "key") #key or managed_identity
 if cosmos_authentication_type == "managed_identity":
-    cosmos_client = CosmosClient(cosmos_endpoint, credential=DefaultAzureCredential())
+    cosmos_client = CosmosClient(cosmos_endpoint, credential=get_shared_credential())
 else:
     cosmos_client = CosmosClient(cosmos_endpoint, cosmos_key)
 
@@ -112,227 +233,336 @@ else:
 blob_connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 blob_container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME", "documents")
 
+# Fast-start mode skips all provisioning round trips at import time: containers
+# are only created by the explicit bootstrap command (flask --app app bootstrap)
+# and clients are initialized lazily, once per worker.
+SIMPLECHAT_FAST_START = os.getenv("SIMPLECHAT_FAST_START", "false").lower() == "true"
+
 database_name = "SimpleChat"
-database = cosmos_client.create_database_if_not_exists(database_name)
+COSMOS_CONTAINER_NAMES = [
+    "conversations",
+    "documents",
+    "settings",
+    "groups",
+    "group_documents",
+    "user_settings",
+    "safety",
+    "feedback",
+    "archived_conversations",
+    "prompts",
+    "group_prompts",
+    "default_documents",
+    "embedding_cache",
+    "ingestion_jobs",
+    "content_registry"
+]
+
+if SIMPLECHAT_FAST_START:
+    database = cosmos_client.get_database_client(database_name)
+else:
+    database = cosmos_client.create_database_if_not_exists(database_name)
+
+def _get_cosmos_container(name):
+    if SIMPLECHAT_FAST_START:
+        return database.get_container_client(name)
+    return database.create_container_if_not_exists(
+        id=name,
+        partition_key=PartitionKey(path="/id")
+    )
 
 container_name = "conversations"
-container = database.create_container_if_not_exists(
-    id=container_name,
-    partition_key=PartitionKey(path="/id")
-)
+container = _get_cosmos_container(container_name)
+
 documents_container_name = "documents"
-documents_container = database.create_container_if_not_exists(
-    id=documents_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+documents_container = _get_cosmos_container(documents_container_name)
 
 settings_container_name = "settings"
-settings_container = database.create_container_if_not_exists(
-    id=settings_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+settings_container = _get_cosmos_container(settings_container_name)
 
 groups_container_name = "groups"
-groups_container = database.create_container_if_not_exists(
-    id=groups_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+groups_container = _get_cosmos_container(groups_container_name)
 
 group_documents_container_name = "group_documents"
-group_documents_container = database.create_container_if_not_exists(
-    id=group_documents_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+group_documents_container = _get_cosmos_container(group_documents_container_name)
 
 user_settings_container_name = "user_settings"
-user_settings_container = database.create_container_if_not_exists(
-    id=user_settings_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+user_settings_container = _get_cosmos_container(user_settings_container_name)
 
 safety_container_name = "safety"
-safety_container = database.create_container_if_not_exists(
-    id=safety_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+safety_container = _get_cosmos_container(safety_container_name)
 
 feedback_container_name = "feedback"
-feedback_container = database.create_container_if_not_exists(
-    id=feedback_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+feedback_container = _get_cosmos_container(feedback_container_name)
 
 archived_conversations_container_name = "archived_conversations"
-archived_conversations_container = database.create_container_if_not_exists(
-    id=archived_conversations_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+archived_conversations_container = _get_cosmos_container(archived_conversations_container_name)
 
 prompts_container_name = "prompts"
-prompts_container = database.create_container_if_not_exists(
-    id=prompts_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+prompts_container = _get_cosmos_container(prompts_container_name)
 
 group_prompts_container_name = "group_prompts"
-group_prompts_container = database.create_container_if_not_exists(
-    id=group_prompts_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+group_prompts_container = _get_cosmos_container(group_prompts_container_name)
 
 default_documents_container_name = "default_documents"
-default_documents_container = database.create_container_if_not_exists(
-    id=default_documents_container_name,
-    partition_key=PartitionKey(path="/id")
-)
+default_documents_container = _get_cosmos_container(default_documents_container_name)
 
-def initialize_clients(settings):
+embedding_cache_container_name = "embedding_cache"
+embedding_cache_container = _get_cosmos_container(embedding_cache_container_name) if EMBEDDING_CACHE_COSMOS_ENABLED else None
+
+ingestion_jobs_container_name = "ingestion_jobs"
+ingestion_jobs_container = _get_cosmos_container(ingestion_jobs_container_name) if INGESTION_JOB_STORE == "cosmos" else None
+
+content_registry_container_name = "content_registry"
+content_registry_container = _get_cosmos_container(content_registry_container_name) if CONTENT_DEDUP_ENABLED and CONTENT_REGISTRY == "cosmos" else None
+
+def bootstrap_resources():
     """
-    Initialize/re-initialize all your clients based on the provided settings.
-    Store them in a global dictionary so they're accessible throughout the app.
+    Create the Cosmos database, every container and the blob container if
+    they do not exist yet. Run once per deployment, not on every worker start.
     """
-    global CLIENTS
-    with CLIENTS_LOCK:
-        print("Initializing clients...")
-        
-        # Initialize default values to prevent key errors
-        CLIENTS["blob_service_client"] = None
-        CLIENTS["blob_container_client"] = None
-        CLIENTS["document_intelligence_client"] = None
-        CLIENTS["search_client_user"] = None
-        CLIENTS["search_client_group"] = None
-        CLIENTS["content_safety_client"] = None
-        
-        # Initialize Blob Storage Client
-        try:
-            blob_connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
-            blob_container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME", "documents")
-            
-            if blob_connection_string:
-                blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
-                container_client = blob_service_client.get_container_client(blob_container_name)
-                
-                # Make sure the container exists
-                if not container_client.exists():
-                    container_client.create_container()
-                    
-                CLIENTS["blob_service_client"] = blob_service_client
-                CLIENTS["blob_container_client"] = container_client
-                print("Blob Storage client initialized successfully")
-            else:
-                print("AZURE_STORAGE_CONNECTION_STRING environment variable not set")
-        except Exception as e:
-            print(f"Failed to initialize Blob Storage client: {e}")
-
-        # Initialize Document Intelligence Client
-        form_recognizer_endpoint = settings.get("azure_document_intelligence_endpoint")
-        form_recognizer_key = settings.get("azure_document_intelligence_key")
-        enable_document_intelligence_apim = settings.get("enable_document_intelligence_apim")
-        azure_apim_document_intelligence_endpoint = settings.get("azure_apim_document_intelligence_endpoint")
-        azure_apim_document_intelligence_subscription_key = settings.get("azure_apim_document_intelligence_subscription_key")
-
-        try:
-            if enable_document_intelligence_apim:
+    print(f"Provisioning Cosmos database '{database_name}'...")
+    db = cosmos_client.create_database_if_not_exists(database_name)
+    for name in COSMOS_CONTAINER_NAMES:
+        db.create_container_if_not_exists(
+            id=name,
+            partition_key=PartitionKey(path="/id")
+        )
+        print(f"Container '{name}' ready")
+
+    blob_connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+    if blob_connection_string:
+        blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
+        container_client = blob_service_client.get_container_client(blob_container_name)
+        if not container_client.exists():
+            container_client.create_container()
+        print(f"Blob container '{blob_container_name}' ready")
+    else:
+        print("AZURE_STORAGE_CONNECTION_STRING environment variable not set, skipping blob container")
+
+CLIENTS_STATE = {"initialized_pid": None, "draining": False}
+
+def clients_ready():
+    """True once initialize_clients() has completed in this process."""
+    return CLIENTS_STATE["initialized_pid"] == os.getpid()
+
+def _close_pooled_connections(sdk_client):
+    """Drop the HTTP connections an azure-core based client keeps pooled."""
+    try:
+        pipeline_client = getattr(sdk_client, "client_connection", sdk_client).pipeline_client
+        session = getattr(pipeline_client._pipeline._transport, "session", None)
+        if session is not None:
+            session.close()
+    except Exception as e:
+        print(f"Could not reset pooled connections: {e}")
+
+def reset_clients_after_fork():
+    """
+    Run in every worker right after it is forked from a preloaded master.
+    Sockets, locks and background threads inherited from the master are not
+    safe to share, so drop them here; ensure_clients_initialized() rebuilds
+    the clients on the worker's first request.
+    """
+    global CLIENTS_LOCK
+    CLIENTS_LOCK = threading.Lock()
+    CLIENTS.clear()
+    CLIENTS_STATE["initialized_pid"] = None
+    CLIENTS_STATE["draining"] = False
+    get_shared_credential().reset()
+    _close_pooled_connections(cosmos_client)
+
+def get_async_cosmos_container(container_name):
+    """
+    aio container client for the async chat path (asgi.py). The aio client
+    is created on first use so it binds to the worker's event loop.
+    """
+    cosmos_client_async = CLIENTS.get("async_cosmos_client")
+    if cosmos_client_async is None:
+        from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+
+        if cosmos_authentication_type == "managed_identity":
+            cosmos_client_async = AsyncCosmosClient(cosmos_endpoint, credential=get_async_shared_credential())
+        else:
+            cosmos_client_async = AsyncCosmosClient(cosmos_endpoint, cosmos_key)
+        CLIENTS["async_cosmos_client"] = cosmos_client_async
+    return cosmos_client_async.get_database_client(database_name).get_container_client(container_name)
+
+async def close_async_clients():
+    """Close the event-loop bound clients when the ASGI worker shuts down."""
+    cosmos_client_async = CLIENTS.pop("async_cosmos_client", None)
+    if cosmos_client_async is not None:
+        await cosmos_client_async.close()
+    for entry in (CLIENTS.pop("async_openai_clients", None) or {}).values():
+        await entry["client"].close()
+
+def _init_blob_clients(settings):
+    clients = {"blob_service_client": None, "blob_container_client": None}
+    try:
+        blob_connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+        blob_container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME", "documents")
+
+        if blob_connection_string:
+            blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
+            container_client = blob_service_client.get_container_client(blob_container_name)
+
+            # Make sure the container exists (fast-start leaves this to bootstrap_resources)
+            if not SIMPLECHAT_FAST_START and not container_client.exists():
+                container_client.create_container()
+
+            clients["blob_service_client"] = blob_service_client
+            clients["blob_container_client"] = container_client
+            print("Blob Storage client initialized successfully")
+        else:
+            print("AZURE_STORAGE_CONNECTION_STRING environment variable not set")
+    except Exception as e:
+        print(f"Failed to initialize Blob Storage client: {e}")
+    return clients
+
+def _init_document_intelligence_client(settings):
+    clients = {"document_intelligence_client": None}
+    form_recognizer_endpoint = settings.get("azure_document_intelligence_endpoint")
+    form_recognizer_key = settings.get("azure_document_intelligence_key")
+    enable_document_intelligence_apim = settings.get("enable_document_intelligence_apim")
+    azure_apim_document_intelligence_endpoint = settings.get("azure_apim_document_intelligence_endpoint")
+    azure_apim_document_intelligence_subscription_key = settings.get("azure_apim_document_intelligence_subscription_key")
+
+    try:
+        from azure.ai.documentintelligence import DocumentIntelligenceClient
+        from azure.ai.formrecognizer import DocumentAnalysisClient
+
+        if enable_document_intelligence_apim:
+            document_intelligence_client = DocumentIntelligenceClient(
+                endpoint=azure_apim_document_intelligence_endpoint,
+                credential=AzureKeyCredential(azure_apim_document_intelligence_subscription_key)
+            )
+        else:
+            if settings.get("azure_document_intelligence_authentication_type") == "managed_identity":
                 document_intelligence_client = DocumentIntelligenceClient(
-                    endpoint=azure_apim_document_intelligence_endpoint,
-                    credential=AzureKeyCredential(azure_apim_document_intelligence_subscription_key)
+                    endpoint=form_recognizer_endpoint,
+                    credential=get_shared_credential()
                 )
             else:
-                if settings.get("azure_document_intelligence_authentication_type") == "managed_identity":
-                    document_intelligence_client = DocumentIntelligenceClient(
-                        endpoint=form_recognizer_endpoint,
-                        credential=DefaultAzureCredential()
-                    )
-                else:
-                    document_intelligence_client = DocumentAnalysisClient(
-                        endpoint=form_recognizer_endpoint,
-                        credential=AzureKeyCredential(form_recognizer_key)
-                    )
-            CLIENTS["document_intelligence_client"] = document_intelligence_client
-            print("Document Intelligence client initialized successfully")
-        except Exception as e:
-            print(f"Failed to initialize Document Intelligence client: {e}")
-
-        # Initialize Search Clients
-        azure_ai_search_endpoint = settings.get("azure_ai_search_endpoint")
-        azure_ai_search_key = settings.get("azure_ai_search_key")
-        enable_ai_search_apim = settings.get("enable_ai_search_apim")
-        azure_apim_ai_search_endpoint = settings.get("azure_apim_ai_search_endpoint")
-        azure_apim_ai_search_subscription_key = settings.get("azure_apim_ai_search_subscription_key")
-
-        try:
-            if enable_ai_search_apim:
+                document_intelligence_client = DocumentAnalysisClient(
+                    endpoint=form_recognizer_endpoint,
+                    credential=AzureKeyCredential(form_recognizer_key)
+                )
+        clients["document_intelligence_client"] = document_intelligence_client
+        print("Document Intelligence client initialized successfully")
+    except Exception as e:
+        print(f"Failed to initialize Document Intelligence client: {e}")
+    return clients
+
+def _init_search_clients(settings):
+    clients = {"search_client_user": None, "search_client_group": None}
+    azure_ai_search_endpoint = settings.get("azure_ai_search_endpoint")
+    azure_ai_search_key = settings.get("azure_ai_search_key")
+    enable_ai_search_apim = settings.get("enable_ai_search_apim")
+    azure_apim_ai_search_endpoint = settings.get("azure_apim_ai_search_endpoint")
+    azure_apim_ai_search_subscription_key = settings.get("azure_apim_ai_search_subscription_key")
+
+    try:
+        if enable_ai_search_apim:
+            search_client_user = SearchClient(
+                endpoint=azure_apim_ai_search_endpoint,
+                index_name="simplechat-user-index",
+                credential=AzureKeyCredential(azure_apim_ai_search_subscription_key)
+            )
+            search_client_group = SearchClient(
+                endpoint=azure_apim_ai_search_endpoint,
+                index_name="simplechat-group-index",
+                credential=AzureKeyCredential(azure_apim_ai_search_subscription_key)
+            )
+        else:
+            if settings.get("azure_ai_search_authentication_type") == "managed_identity":
                 search_client_user = SearchClient(
-                    endpoint=azure_apim_ai_search_endpoint,
+                    endpoint=azure_ai_search_endpoint,
                     index_name="simplechat-user-index",
-                    credential=AzureKeyCredential(azure_apim_ai_search_subscription_key)
+                    credential=get_shared_credential()
                 )
                 search_client_group = SearchClient(
-                    endpoint=azure_apim_ai_search_endpoint,
+                    endpoint=azure_ai_search_endpoint,
                     index_name="simplechat-group-index",
-                    credential=AzureKeyCredential(azure_apim_ai_search_subscription_key)
+                    credential=get_shared_credential()
                 )
             else:
-                if settings.get("azure_ai_search_authentication_type") == "managed_identity":
-                    search_client_user = SearchClient(
-                        endpoint=azure_ai_search_endpoint,
-                        index_name="simplechat-user-index",
-                        credential=DefaultAzureCredential()
-                    )
-                    search_client_group = SearchClient(
-                        endpoint=azure_ai_search_endpoint,
-                        index_name="simplechat-group-index",
-                        credential=DefaultAzureCredential()
+                search_client_user = SearchClient(
+                    endpoint=azure_ai_search_endpoint,
+                    index_name="simplechat-user-index",
+                    credential=AzureKeyCredential(azure_ai_search_key)
+                )
+                search_client_group = SearchClient(
+                    endpoint=azure_ai_search_endpoint,
+                    index_name="simplechat-group-index",
+                    credential=AzureKeyCredential(azure_ai_search_key)
+                )
+        clients["search_client_user"] = search_client_user
+        clients["search_client_group"] = search_client_group
+        print("Search clients initialized successfully")
+    except Exception as e:
+        print(f"Failed to initialize Search clients: {e}")
+    return clients
+
+def _init_content_safety_client(settings):
+    clients = {"content_safety_client": None}
+    if settings.get("enable_content_safety"):
+        safety_endpoint = settings.get("content_safety_endpoint", "")
+        safety_key = settings.get("content_safety_key", "")
+        enable_content_safety_apim = settings.get("enable_content_safety_apim")
+        azure_apim_content_safety_endpoint = settings.get("azure_apim_content_safety_endpoint")
+        azure_apim_content_safety_subscription_key = settings.get("azure_apim_content_safety_subscription_key")
+
+        if safety_endpoint and safety_key:
+            try:
+                from azure.ai.contentsafety import ContentSafetyClient
+
+                if enable_content_safety_apim:
+                    content_safety_client = ContentSafetyClient(
+                        endpoint=azure_apim_content_safety_endpoint,
+                        credential=AzureKeyCredential(azure_apim_content_safety_subscription_key)
                     )
                 else:
-                    search_client_user = SearchClient(
-                        endpoint=azure_ai_search_endpoint,
-                        index_name="simplechat-user-index",
-                        credential=AzureKeyCredential(azure_ai_search_key)
-                    )
-                    search_client_group = SearchClient(
-                        endpoint=azure_ai_search_endpoint,
-                        index_name="simplechat-group-index",
-                        credential=AzureKeyCredential(azure_ai_search_key)
-                    )
-            CLIENTS["search_client_user"] = search_client_user
-            CLIENTS["search_client_group"] = search_client_group
-            print("Search clients initialized successfully")
-        except Exception as e:
-            print(f"Failed to initialize Search clients: {e}")
-
-        # Initialize Content Safety Client
-        if settings.get("enable_content_safety"):
-            safety_endpoint = settings.get("content_safety_endpoint", "")
-            safety_key = settings.get("content_safety_key", "")
-            enable_content_safety_apim = settings.get("enable_content_safety_apim")
-            azure_apim_content_safety_endpoint = settings.get("azure_apim_content_safety_endpoint")
-            azure_apim_content_safety_subscription_key = settings.get("azure_apim_content_safety_subscription_key")
-
-            if safety_endpoint and safety_key:
-                try:
-                    if enable_content_safety_apim:
+                    if settings.get("content_safety_authentication_type") == "managed_identity":
                         content_safety_client = ContentSafetyClient(
-                            endpoint=azure_apim_content_safety_endpoint,
-                            credential=AzureKeyCredential(azure_apim_content_safety_subscription_key)
+                            endpoint=safety_endpoint,
+                            credential=get_shared_credential()
                         )
                     else:
-                        if settings.get("content_safety_authentication_type") == "managed_identity":
-                            content_safety_client = ContentSafetyClient(
-                                endpoint=safety_endpoint,
-                                credential=DefaultAzureCredential()
-                            )
-                        else:
-                            content_safety_client = ContentSafetyClient(
-                                endpoint=safety_endpoint,
-                                credential=AzureKeyCredential(safety_key)
-                            )
-                    CLIENTS["content_safety_client"] = content_safety_client
-                    print("Content Safety client initialized successfully")
-                except Exception as e:
-                    print(f"Failed to initialize Content Safety client: {e}")
-            else:
-                print("Content Safety enabled, but endpoint/key not provided.")
+                        content_safety_client = ContentSafetyClient(
+                            endpoint=safety_endpoint,
+                            credential=AzureKeyCredential(safety_key)
+                        )
+                clients["content_safety_client"] = content_safety_client
+                print("Content Safety client initialized successfully")
+            except Exception as e:
+                print(f"Failed to initialize Content Safety client: {e}")
+        else:
+            print("Content Safety enabled, but endpoint/key not provided.")
+    return clients
 
-        print("Client initialization complete")
+def initialize_clients(settings):
+    """
+    Initialize/re-initialize all your clients based on the provided settings.
+    Store them in a global dictionary so they're accessible throughout the app.
+
+    The individual clients are built in parallel and outside CLIENTS_LOCK;
+    the lock is only held to swap the finished set into CLIENTS.
+    """
+    global CLIENTS
+    print("Initializing clients...")
+    start_time = time.time()
+
+    initializers = [
+        _init_blob_clients,
+        _init_document_intelligence_client,
+        _init_search_clients,
+        _init_content_safety_client
+    ]
+    new_clients = {}
+    with ThreadPoolExecutor(max_workers=len(initializers)) as executor:
+        for clients in executor.map(lambda init: init(settings), initializers):
+            new_clients.update(clients)
+
+    with CLIENTS_LOCK:
+        CLIENTS.update(new_clients)
+        CLIENTS_STATE["initialized_pid"] = os.getpid()
 
+    print(f"Client initialization complete in {time.time() - start_time:.2f}s")
@@ -3,9 +3,13 @@ import config
 import uuid
 from azure.storage.blob import ContentSettings
 
-def upload_to_blob_storage(file_content, file_name, content_type=None):
+def upload_to_blob_storage(file_content, file_name, content_type=None, blob_name=None):
     """
     Upload file content to Azure Blob Storage
+
+    Without a blob_name the blob gets a unique name. A given blob_name is
+    overwritten if it exists, so it must only be used for content-addressed
+    data.
     """
     try:
         # Access CLIENTS through the config module
@@ -19,7 +23,9 @@ def upload_to_blob_storage(file_content, file_name, content_type=None):
         blob_container_name = config.blob_container_name
         
         # Create a unique blob name using UUID
-        blob_name = f"{str(uuid.uuid4())}/{file_name}"
+        overwrite = blob_name is not None
+        if blob_name is None:
+            blob_name = f"{str(uuid.uuid4())}/{file_name}"
         
         # Get blob client
         blob_client = blob_service_client.get_blob_client(
@@ -33,7 +39,7 @@ def upload_to_blob_storage(file_content, file_name, content_type=None):
             content_settings = ContentSettings(content_type=content_type)
         
         # Upload the file
-        blob_client.upload_blob(file_content, content_settings=content_settings)
+        blob_client.upload_blob(file_content, content_settings=content_settings, overwrite=overwrite)
         
         # Return the blob URL
         return blob_client.url
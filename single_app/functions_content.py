@@ -2,8 +2,16 @@
 
 from config import *
 from functions_settings import *
+from functions_openai import *
+from functions_metrics import *
+from functions_embedding_cache import get_embedding_cache, embedding_cache_key
+from functions_ingestion_jobs import report_ingestion_progress, current_ingestion_job
+from functions_tokenizer import count_tokens, split_text_by_tokens
 from azure.search.documents import SearchClient
 from azure.core.credentials import AzureKeyCredential
+from azure.core.polling.base_polling import LROBasePolling
+from html.parser import HTMLParser
+import unicodedata
 
 def extract_text_file(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
@@ -13,56 +21,570 @@ def extract_markdown_file(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
         return f.read()
 
-# Update extract_content_with_azure_di in functions_content.py
+# Local extraction of formats that carry their text, so they skip the
+# Document Intelligence round trip. Each extractor returns the non-empty
+# pages as [{page_number, text}]; an empty list means Document Intelligence
+# should be tried instead. A page whose text could not be extracted is a
+# message flagged "placeholder": True.
+
+def _table_row_line(cells):
+    cells = [" ".join(cell.split()) for cell in cells]
+    while cells and not cells[-1]:
+        cells.pop()
+    return " | ".join(cells)
+
+
+def _numbered_pages(page_texts, first_page=1):
+    return [
+        {"page_number": number, "text": text}
+        for number, text in enumerate(page_texts, start=first_page)
+        if text.strip()
+    ]
+
+
+def extract_docx_file(file_path):
+    """
+    Paragraphs and tables of a Word document in document order, including
+    the content of content controls (cover pages, tables of contents,
+    template fields). Pages follow the explicit and last rendered page
+    breaks Word saves in the file. Nested tables follow the row they are in.
+    """
+    from docx import Document
+    from docx.oxml.ns import qn
+
+    page_break_tags = (qn('w:lastRenderedPageBreak'), qn('w:br'))
+    body = Document(file_path).element.body
+    pages = [[]]
+    line = []
+
+    def end_line():
+        if line:
+            pages[-1].append("".join(line))
+            line.clear()
+
+    def break_page():
+        end_line()
+        # Word often saves both kinds of break at the same place
+        if any(text.strip() for text in pages[-1]):
+            pages.append([])
+
+    def children(element):
+        # Content controls (w:sdt) wrap blocks, rows and cells alike
+        for child in element.iterchildren():
+            if child.tag == qn('w:sdt'):
+                content = child.find(qn('w:sdtContent'))
+                if content is not None:
+                    yield from children(content)
+            else:
+                yield child
+
+    def add_paragraph(paragraph):
+        for node in paragraph.iter(qn('w:t'), qn('w:tab'), *page_break_tags):
+            if node.tag == qn('w:t'):
+                line.append(node.text or "")
+            elif node.tag == qn('w:tab'):
+                line.append("\t")
+            elif node.tag == qn('w:lastRenderedPageBreak') or node.get(qn('w:type')) == 'page':
+                break_page()
+            else:
+                line.append("\n")
+        end_line()
+
+    def add_table(table):
+        for row in children(table):
+            if row.tag != qn('w:tr'):
+                continue
+            cells = []
+            nested_tables = []
+            for cell in children(row):
+                if cell.tag != qn('w:tc'):
+                    continue
+                paragraphs = []
+                for block in children(cell):
+                    if block.tag == qn('w:p'):
+                        paragraphs.append("".join(t.text or "" for t in block.iter(qn('w:t'))))
+                    elif block.tag == qn('w:tbl'):
+                        nested_tables.append(block)
+                cells.append(" ".join(paragraphs))
+            pages[-1].append(_table_row_line(cells))
+            for nested_table in nested_tables:
+                add_table(nested_table)
+
+    for block in children(body):
+        if block.tag == qn('w:p'):
+            add_paragraph(block)
+        elif block.tag == qn('w:tbl'):
+            add_table(block)
+
+    return _numbered_pages("\n".join(lines) + "\n" for lines in pages)
+
+
+def _pptx_shape_lines(shape):
+    from pptx.enum.shapes import MSO_SHAPE_TYPE
+
+    if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+        for child in shape.shapes:
+            yield from _pptx_shape_lines(child)
+        return
+    if getattr(shape, "has_text_frame", False) and shape.has_text_frame:
+        for paragraph in shape.text_frame.paragraphs:
+            yield "".join(run.text for run in paragraph.runs)
+    if getattr(shape, "has_table", False) and shape.has_table:
+        for row in shape.table.rows:
+            yield _table_row_line(cell.text for cell in row.cells)
+
+
+def extract_pptx_file(file_path):
+    """One page per slide: the text of its shapes and tables, then its notes."""
+    from pptx import Presentation
+
+    page_texts = []
+    for slide in Presentation(file_path).slides:
+        lines = []
+        for shape in slide.shapes:
+            lines.extend(_pptx_shape_lines(shape))
+        if slide.has_notes_slide:
+            lines.append(slide.notes_slide.notes_text_frame.text)
+        page_texts.append("".join(f"{line}\n" for line in lines if line.strip()))
+    return _numbered_pages(page_texts)
+
+
+def extract_xlsx_file(file_path):
+    """
+    One page per XLSX_ROWS_PER_PAGE non-empty rows of each sheet, cells
+    separated by " | ", each page headed by its sheet name.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    page_texts = []
+    try:
+        for sheet in workbook.worksheets:
+            rows = []
+            for values in sheet.iter_rows(values_only=True):
+                row_line = _table_row_line("" if value is None else str(value) for value in values)
+                if row_line.strip(" |"):
+                    rows.append(row_line)
+            for start in range(0, len(rows), XLSX_ROWS_PER_PAGE):
+                window = rows[start:start + XLSX_ROWS_PER_PAGE]
+                page_texts.append(f"Sheet: {sheet.title}\n" + "".join(f"{row}\n" for row in window))
+    finally:
+        workbook.close()
+    return _numbered_pages(page_texts)
+
+
+class _HTMLTextParser(HTMLParser):
+    BLOCK_TAGS = {
+        'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article',
+        'header', 'footer', 'pre', 'blockquote', 'table', 'ul', 'ol', 'title'
+    }
+    SKIPPED_TAGS = {'script', 'style', 'noscript', 'template'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skipping += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+        elif tag in ('td', 'th'):
+            self.parts.append(" | ")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def extract_html_file(file_path):
+    """The visible text of an HTML file as a single page."""
+    with open(file_path, 'rb') as f:
+        html = f.read().decode('utf-8', errors='replace')
+    parser = _HTMLTextParser()
+    parser.feed(html)
+    parser.close()
+    lines = (" ".join(line.split()).strip(" |") for line in "".join(parser.parts).split("\n"))
+    return _numbered_pages(["".join(f"{line}\n" for line in lines if line)])
+
+
+# Points per inch in PDF user space
+PDF_POINTS_PER_INCH = 72
+
+
+def _pdf_image_names(resources, names=None):
+    """Names of the image XObjects in resources and in the forms they use."""
+    names = set() if names is None else names
+    xobjects = resources.get("/XObject") if resources else None
+    if xobjects is None:
+        return names
+    for name, xobject in xobjects.get_object().items():
+        xobject = xobject.get_object()
+        if xobject.get("/Subtype") == "/Image":
+            names.add(name)
+        elif xobject.get("/Subtype") == "/Form" and "/Resources" in xobject:
+            _pdf_image_names(xobject["/Resources"].get_object(), names)
+    return names
+
+
+def read_pdf_page(page):
+    """
+    The text layer of a pypdf page, the page area and the area images are
+    drawn over, both in square points.
+    """
+    image_names = _pdf_image_names(page.get("/Resources"))
+    image_area = 0.0
+
+    def visitor(operator, operands, cm, tm):
+        nonlocal image_area
+        # An image fills the unit square, mapped to the page by the current matrix
+        if operator == b"Do" and operands and operands[0] in image_names:
+            image_area += abs(float(cm[0]) * float(cm[3]) - float(cm[1]) * float(cm[2]))
+
+    text = page.extract_text(visitor_operand_before=visitor) or ""
+    page_area = float(page.mediabox.width) * float(page.mediabox.height)
+    return text, page_area, image_area
+
+
+def pdf_text_is_usable(text, page_area, image_area=0.0):
+    """
+    Whether a page's text layer can stand in for OCR. Scanned pages often
+    carry a little text (a header, footer or Bates stamp) over the image,
+    so the page needs:
+
+    - at least PDF_TEXT_LAYER_MIN_CHARS letters or digits, and at least
+      PDF_TEXT_LAYER_MIN_DENSITY per square inch of the page
+    - images covering less than PDF_SCANNED_IMAGE_COVERAGE of the page
+    - letters or digits making up most of the visible characters, with few
+      glyphs the PDF maps to no character (U+FFFD or private use)
+    """
+    visible = "".join(text.split())
+    if not visible or not page_area:
+        return False
+    if image_area / page_area >= PDF_SCANNED_IMAGE_COVERAGE:
+        return False
+    unmapped = sum(1 for char in visible if char == "\ufffd" or unicodedata.category(char) == "Co")
+    if unmapped > 0.1 * len(visible):
+        return False
+    alphanumeric = sum(1 for char in visible if char.isalnum())
+    square_inches = page_area / PDF_POINTS_PER_INCH ** 2
+    return (
+        alphanumeric >= PDF_TEXT_LAYER_MIN_CHARS
+        and alphanumeric >= PDF_TEXT_LAYER_MIN_DENSITY * square_inches
+        and alphanumeric >= 0.5 * len(visible)
+    )
+
+
+def extract_pdf_file(file_path):
+    """
+    Pages of a PDF with a usable text layer, read in-process with pypdf;
+    only scanned or image-only pages are sent to Document Intelligence.
+    Returns [] (the whole file goes to Document Intelligence) when no page
+    has usable text. Scanned pages whose analysis keeps failing become
+    placeholder pages, so the text layer pages are not thrown away.
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return []
+
+    read_pages = [read_pdf_page(page) for page in PdfReader(file_path).pages]
+    local_pages = [
+        {"page_number": number, "text": text if text.endswith("\n") else text + "\n"}
+        for number, (text, page_area, image_area) in enumerate(read_pages, start=1)
+        if pdf_text_is_usable(text, page_area, image_area)
+    ]
+    if not local_pages:
+        return []
+
+    local_numbers = {page["page_number"] for page in local_pages}
+    scanned_numbers = [number for number in range(1, len(read_pages) + 1) if number not in local_numbers]
+    print(f"{file_path}: {len(local_pages)} of {len(read_pages)} pages have a text layer")
+    PDF_PAGES_EXTRACTED.labels(method='text_layer').inc(len(local_pages))
+    if not scanned_numbers:
+        return local_pages
+
+    PDF_PAGES_EXTRACTED.labels(method='document_intelligence').inc(len(scanned_numbers))
+    failed_numbers = []
+    scanned_pages = extract_pdf_page_ranges(file_path, scanned_numbers, failed_pages=failed_numbers)
+    scanned_pages += [
+        {"page_number": number, "text": "Error processing page.\n", "placeholder": True}
+        for number in failed_numbers
+    ]
+    return sorted(local_pages + scanned_pages, key=lambda page: page["page_number"])
+
+
+LOCAL_EXTRACTORS = {
+    '.pdf': extract_pdf_file,
+    '.docx': extract_docx_file,
+    '.pptx': extract_pptx_file,
+    '.xlsx': extract_xlsx_file,
+    '.html': extract_html_file,
+}
+
+# Page-range analyses a worker process has in flight, across all documents
+DOCUMENT_INTELLIGENCE_RANGE_SLOTS = threading.BoundedSemaphore(DOCUMENT_INTELLIGENCE_MAX_PARALLEL_RANGES)
+# Growth of the interval between status polls of an analysis
+DOCUMENT_INTELLIGENCE_POLL_BACKOFF = 1.5
+
+_PDF_PAGE_PATTERN = re.compile(rb"/Type\s*/Page\b")
+
+
+def count_pdf_pages(file_path):
+    """Number of pages of a PDF, or None if it cannot be determined."""
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(file_path).pages)
+    except ImportError:
+        # Page objects are only visible this way when they are not in compressed object streams
+        with open(file_path, "rb") as f:
+            return len(_PDF_PAGE_PATTERN.findall(f.read())) or None
+    except Exception as e:
+        print(f"Could not count the pages of {file_path}: {e}")
+        return None
+
+
+def pdf_page_groups(page_numbers, group_size):
+    """The sorted page numbers in consecutive groups of at most group_size pages."""
+    page_numbers = sorted(page_numbers)
+    return [page_numbers[start:start + group_size] for start in range(0, len(page_numbers), group_size)]
+
+
+def pages_parameter(page_numbers):
+    """Document Intelligence `pages` value for sorted page numbers, e.g. "1-50" or "3,7-9"."""
+    parts = []
+    first = previous = page_numbers[0]
+    for number in list(page_numbers[1:]) + [None]:
+        if number is not None and number == previous + 1:
+            previous = number
+            continue
+        parts.append(str(first) if first == previous else f"{first}-{previous}")
+        first = previous = number
+    return ",".join(parts)
+
+
+class AdaptiveAnalysisPolling(LROBasePolling):
+    """
+    Polls an analysis DOCUMENT_INTELLIGENCE_POLL_INITIAL_SECONDS after it
+    starts, then at intervals growing by DOCUMENT_INTELLIGENCE_POLL_BACKOFF
+    up to DOCUMENT_INTELLIGENCE_POLL_MAX_SECONDS. A longer Retry-After from
+    the service is honored. Polling stops with TimeoutError at the deadline.
+    """
+
+    def __init__(self, deadline, **kwargs):
+        super().__init__(timeout=DOCUMENT_INTELLIGENCE_POLL_INITIAL_SECONDS, **kwargs)
+        self._interval = DOCUMENT_INTELLIGENCE_POLL_INITIAL_SECONDS
+        self._deadline = deadline
+
+    def _extract_delay(self):
+        retry_after = retry_after_seconds(self._pipeline_response.http_response.headers, default=0.0)
+        delay = max(self._interval, retry_after)
+        self._interval = min(self._interval * DOCUMENT_INTELLIGENCE_POLL_BACKOFF, DOCUMENT_INTELLIGENCE_POLL_MAX_SECONDS)
+        remaining = self._deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Document analysis did not finish within {DOCUMENT_INTELLIGENCE_TIMEOUT_SECONDS}s")
+        return min(delay, remaining)
+
+
+class DocumentAnalysis:
+    """
+    One prebuilt-read analysis of a file, or of the page range `pages`
+    (e.g. "51-100"). The SDK poller runs on its own thread; `future`
+    completes from its done callback, so callers can wait on several
+    analyses at once instead of polling each. on_done(), if given, is called
+    once when the analysis ends, however it ends.
+    """
+
+    def __init__(self, file_path, pages=None, on_done=None):
+        self.pages = pages
+        self.future = Future()
+        self.deadline = time.monotonic() + DOCUMENT_INTELLIGENCE_TIMEOUT_SECONDS
+        self._on_done = on_done
+        document_intelligence_client = CLIENTS['document_intelligence_client']
+        with open(file_path, "rb") as f:
+            if pages:
+                self._poller = document_intelligence_client.begin_analyze_document(
+                    model_id="prebuilt-read",
+                    document=f,
+                    pages=pages,
+                    polling=AdaptiveAnalysisPolling(self.deadline)
+                )
+            else:
+                self._poller = document_intelligence_client.begin_analyze_document(
+                    model_id="prebuilt-read",
+                    document=f,
+                    polling=AdaptiveAnalysisPolling(self.deadline)
+                )
+        self._poller.add_done_callback(self._finished)
+
+    def _finished(self, _):
+        # The SDK may report completion more than once
+        try:
+            self.future.set_result(True)
+        except InvalidStateError:
+            return
+        if self._on_done:
+            self._on_done()
+
+    @property
+    def expires_at(self):
+        """When to stop waiting for the done callback: the deadline plus one poll interval."""
+        return self.deadline + DOCUMENT_INTELLIGENCE_POLL_MAX_SECONDS
+
+    def result(self, timeout=None):
+        """The AnalyzeResult; raises the analysis error, or TimeoutError past the deadline."""
+        if timeout is None:
+            timeout = max(0.0, self.expires_at - time.monotonic())
+        try:
+            self.future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            raise TimeoutError(f"Document analysis did not finish within {DOCUMENT_INTELLIGENCE_TIMEOUT_SECONDS}s")
+        return self._poller.result()
+
+
+def analyze_with_azure_di(file_path, pages=None):
+    """Run one prebuilt-read analysis of file_path (or of a page range) and return its result."""
+    return DocumentAnalysis(file_path, pages).result()
+
+
+def di_result_pages(result, first_page=1):
+    """The non-empty pages of an analysis result as {page_number, text}."""
+    pages_content = []
+    for page_idx, page in enumerate(getattr(result, 'pages', None) or []):
+        # Document Intelligence numbers the pages of a range as in the whole document
+        page_number = getattr(page, 'page_number', None) or first_page + page_idx
+        page_text = ""
+
+        for line in page.lines:
+            page_text += line.content + "\n"
+
+        if page_text.strip():
+            pages_content.append({
+                "page_number": page_number,
+                "text": page_text
+            })
+    return pages_content
+
+
+def extract_pdf_page_ranges(file_path, page_numbers, failed_pages=None):
+    """
+    Analyze the given pages of a PDF as concurrent page-range analyses of up
+    to DOCUMENT_INTELLIGENCE_PAGE_RANGE_SIZE pages and merge their pages in
+    document order. At most DOCUMENT_INTELLIGENCE_MAX_PARALLEL_RANGES ranges
+    per process are in flight; a failed range is retried on its own.
+
+    A range still failing after DOCUMENT_INTELLIGENCE_RANGE_ATTEMPTS raises,
+    unless a failed_pages list is given: its page numbers are then added to
+    that list and the other ranges carry on.
+    """
+    groups = pdf_page_groups(page_numbers, DOCUMENT_INTELLIGENCE_PAGE_RANGE_SIZE)
+    ranges = [pages_parameter(group) for group in groups]
+    first_pages = [int(re.match(r"\d+", pages).group()) for pages in ranges]
+    print(f"Extracting {len(page_numbers)} pages of {file_path} as {len(ranges)} page ranges")
+    range_pages = [None] * len(ranges)
+    attempts = [0] * len(ranges)
+    # Range index -> monotonic time it may be (re)started
+    scheduled = {index: 0.0 for index in range(len(ranges))}
+    running = {}
+    finished = 0
+
+    def range_failed(index, error):
+        """Schedule a retry; returns True if the range is given up instead."""
+        if attempts[index] >= DOCUMENT_INTELLIGENCE_RANGE_ATTEMPTS:
+            if failed_pages is None:
+                raise error
+            print(f"Pages {ranges[index]} of {file_path} failed after {attempts[index]} attempts: {error}")
+            failed_pages.extend(groups[index])
+            range_pages[index] = []
+            return True
+        delay = min(30, 2 ** attempts[index]) + random.uniform(0, 1)
+        print(f"Pages {ranges[index]} of {file_path} failed (attempt {attempts[index]}): {error}; "
+              f"retrying in {delay:.1f}s")
+        scheduled[index] = time.monotonic() + delay
+        return False
+
+    while finished < len(ranges):
+        now = time.monotonic()
+        for index in sorted(i for i, start_at in scheduled.items() if start_at <= now):
+            # Wait for a free slot only when none of this document's ranges could free one
+            if not DOCUMENT_INTELLIGENCE_RANGE_SLOTS.acquire(blocking=not running):
+                break
+            del scheduled[index]
+            attempts[index] += 1
+            try:
+                analysis = DocumentAnalysis(
+                    file_path, ranges[index], on_done=DOCUMENT_INTELLIGENCE_RANGE_SLOTS.release
+                )
+            except Exception as e:
+                DOCUMENT_INTELLIGENCE_RANGE_SLOTS.release()
+                if range_failed(index, e):
+                    finished += 1
+                continue
+            running[analysis.future] = (index, analysis)
+
+        if not running:
+            if not scheduled:
+                # The last ranges were given up
+                continue
+            # Only ranges waiting to be retried
+            time.sleep(max(0.0, min(scheduled.values()) - time.monotonic()))
+            continue
+
+        # Wake for the next retry, a deadline, or now and then to look for a free slot
+        wake_times = [analysis.expires_at for _, analysis in running.values()]
+        wake_times += [start_at for start_at in scheduled.values() if start_at > now]
+        if any(start_at <= now for start_at in scheduled.values()):
+            wake_times.append(now + 1.0)
+        wake_at = min(wake_times)
+        done, _ = wait(list(running), timeout=max(0.0, wake_at - time.monotonic()), return_when=FIRST_COMPLETED)
+        for future in list(running):
+            index, analysis = running[future]
+            if future not in done and time.monotonic() < analysis.expires_at:
+                continue
+            del running[future]
+            try:
+                range_pages[index] = di_result_pages(analysis.result(timeout=0), first_pages[index])
+            except Exception as e:
+                if not range_failed(index, e):
+                    continue
+            finished += 1
+            report_ingestion_progress('extracting', finished / len(ranges))
+
+    return [page for pages in range_pages for page in pages]
+
 
 def extract_content_with_azure_di(file_path):
     """
     Extract content from document using Azure Document Intelligence.
+    PDFs longer than DOCUMENT_INTELLIGENCE_PAGE_RANGE_SIZE pages are
+    extracted as parallel page ranges. When no text is found or analysis
+    fails, the single page returned is a message, flagged "placeholder".
     """
     try:
         print(f"Extracting content with Azure Document Intelligence: {file_path}")
-        
-        with open(file_path, "rb") as f:
-            document_intelligence_client = CLIENTS['document_intelligence_client']
-            poller = document_intelligence_client.begin_analyze_document(
-                model_id="prebuilt-read",
-                document=f
-            )
-        
-        max_wait_time = 10000
-        start_time = time.time()
 
-        while True:
-            status = poller.status()
-            if status in ["succeeded", "failed", "canceled"]:
-                break
-            if time.time() - start_time > max_wait_time:
-                raise TimeoutError("Document analysis took too long.")
-            time.sleep(5)
+        page_count = None
+        if file_path.lower().endswith('.pdf'):
+            page_count = count_pdf_pages(file_path)
+
+        if page_count and page_count > DOCUMENT_INTELLIGENCE_PAGE_RANGE_SIZE:
+            result = None
+            pages_content = extract_pdf_page_ranges(file_path, range(1, page_count + 1))
+        else:
+            result = analyze_with_azure_di(file_path)
+            # Process each page separately with its page number
+            pages_content = di_result_pages(result)
+        print(f"Extracted {len(pages_content)} pages with text")
 
-        result = poller.result()
-        
-        # Process each page separately with its page number
-        pages_content = []
-        
-        if hasattr(result, 'pages') and result.pages:
-            # Handle multi-page documents
-            for page_idx, page in enumerate(result.pages):
-                page_number = page_idx + 1
-                page_text = ""
-                
-                for line in page.lines:
-                    page_text += line.content + "\n"
-                
-                if page_text.strip():
-                    pages_content.append({
-                        "page_number": page_number,
-                        "text": page_text
-                    })
-                    print(f"Extracted page {page_number}")
-        
         # If no pages were processed but there's content, create a single page
-        if not pages_content and result.content:
+        if not pages_content and result is not None and result.content:
             # Split the content into multiple artificial pages
             full_text = result.content
             words = full_text.split()
@@ -84,7 +606,8 @@ def extract_content_with_azure_di(file_path):
                 print(f"Created artificial page {i+1}")
         
         # Fallback for empty documents
-        if not pages_content:
+        placeholder = not pages_content
+        if placeholder:
             pages_content.append({
                 "page_number": 1,
                 "text": "No text content could be extracted from this document."
@@ -93,7 +616,8 @@ def extract_content_with_azure_di(file_path):
         
         return {
             "content": pages_content,
-            "pages_info": pages_content
+            "pages_info": pages_content,
+            "placeholder": placeholder
         }
 
     except Exception as e:
@@ -109,84 +633,169 @@ def extract_content_with_azure_di(file_path):
             "pages_info": [{
                 "page_number": 1,
                 "text": "Error processing document."
-            }]
+            }],
+            "placeholder": True
         }
     
-def chunk_text(pages_content, pages_info=None, chunk_size=2000, overlap=200):
+def extract_content(file_path, file_ext=None):
     """
-    Split text into chunks with accurate tracking of original page numbers.
-    Improved for better handling of Azure Document Intelligence results.
-    
-    Args:
-        pages_content: List of dicts with page number and text
-        pages_info: Not used, kept for compatibility
-        chunk_size: Maximum characters per chunk
-        overlap: Number of characters to overlap between chunks
+    Extract the pages of a document, in the structure returned by
+    extract_content_with_azure_di. Formats in LOCAL_EXTRACTORS are parsed
+    locally (LOCAL_EXTRACTION_ENABLED); Document Intelligence handles the
+    rest, and any file whose local extraction fails or finds no text.
+    """
+    file_ext = (file_ext or os.path.splitext(file_path)[1]).lower()
+    extractor = LOCAL_EXTRACTORS.get(file_ext) if LOCAL_EXTRACTION_ENABLED else None
+    if extractor:
+        try:
+            pages_content = extractor(file_path)
+            if pages_content:
+                print(f"Extracted {len(pages_content)} pages of {file_path} locally")
+                return {
+                    "content": pages_content,
+                    "pages_info": pages_content,
+                    "placeholder": any(page.get("placeholder") for page in pages_content)
+                }
+            print(f"No text found in {file_path} locally, using Azure Document Intelligence")
+        except Exception as e:
+            print(f"Local extraction of {file_path} failed, using Azure Document Intelligence: {e}")
+    return extract_content_with_azure_di(file_path)
+
+
+def split_text_by_characters(page_text, chunk_size=2000, overlap=200):
+    """
+    Split the text of one page into pieces of at most chunk_size
+    characters, overlapping by overlap characters and preferably ending at
+    a sentence end, line break or space.
+
+    The break points are found with str.rfind, which scans in C and usually
+    stops close to the end of the window; a precomputed per-page boundary
+    index with bisect was measured slower (benchmarks/chunking_benchmark.py).
+    """
+    # If page text is very small, just use it as is
+    if len(page_text) < chunk_size // 2:
+        yield page_text
+        return
         
-    Returns:
-        List of tuples: (chunk_text, page_number)
+    position = 0
+    while position < len(page_text):
+        end = min(position + chunk_size, len(page_text))
+        
+        # Try to find a natural break point (period, newline, etc.)
+        if end < len(page_text) and end - position > chunk_size // 2:
+            # Look for sentence endings, then for line breaks, then for word boundaries
+            natural_break = page_text.rfind('. ', position, end)
+            if natural_break == -1 or natural_break < position + chunk_size // 2:
+                natural_break = page_text.rfind('\n', position, end)
+            if natural_break == -1 or natural_break < position + chunk_size // 2:
+                natural_break = page_text.rfind(' ', position, end)
+            if natural_break != -1 and natural_break > position + chunk_size // 2:
+                end = natural_break + 1  # Include the period or space
+        
+        chunk_text = page_text[position:end].strip()
+        
+        # Only add non-empty chunks
+        if chunk_text:
+            yield chunk_text
+        
+        # Move to next chunk with overlap
+        position = end - overlap if end < len(page_text) else len(page_text)
+
+
+def iter_chunks(pages_content, chunk_size=2000, overlap=200):
+    """
+    Generator form of chunk_text(): yields (chunk_text, page_number,
+    token_count) tuples page by page, so chunks can be embedded and indexed
+    while later pages are still being split. With CHUNKING_MODE=tokens pages
+    are split by CHUNK_SIZE_TOKENS / CHUNK_OVERLAP_TOKENS instead of
+    chunk_size / overlap characters, and token_count is the chunk's token
+    count, reused when it is batched for embedding; in character mode it is
+    None. Chunk totals, and token totals in token mode, are logged once per
+    document.
     """
-    all_chunks = []
-    
     if not pages_content:
         print("Warning: No content to chunk")
-        return [("No content was extracted from this document.", 1)]
+        yield ("No content was extracted from this document.", 1, None)
+        return
     
-    print(f"Chunking {len(pages_content)} pages")
+    by_tokens = CHUNKING_MODE == "tokens"
+    total_chunks = 0
+    # Characters in character mode
+    total_tokens = 0
+    largest_chunk_tokens = 0
+    empty_pages = 0
     
-    # Process each page independently to maintain page number association
+    # Process each page independently to maintain page number association.
+    # Nothing is logged per page or per chunk: on large documents the
+    # logging cost more than the splitting.
     for page_data in pages_content:
         page_number = page_data["page_number"]
         page_text = page_data.get("text", "")
         
         if not page_text or not page_text.strip():
-            print(f"Skipping empty page {page_number}")
+            empty_pages += 1
             continue
         
-        print(f"Processing page {page_number}: {len(page_text)} chars")
-        
-        # If page text is very small, just use it as is
-        if len(page_text) < chunk_size // 2:
-            all_chunks.append((page_text, page_number))
-            print(f"Added entire page {page_number} as single chunk ({len(page_text)} chars)")
-            continue
-            
-        # Create chunks for larger pages
-        position = 0
-        chunks_from_page = 0
-        
-        while position < len(page_text):
-            end = min(position + chunk_size, len(page_text))
-            
-            # Try to find a natural break point (period, newline, etc.)
-            if end < len(page_text) and end - position > chunk_size // 2:
-                # Look for sentence endings, then for line breaks, then for word boundaries
-                natural_break = page_text.rfind('. ', position, end)
-                if natural_break == -1 or natural_break < position + chunk_size // 2:
-                    natural_break = page_text.rfind('\n', position, end)
-                if natural_break == -1 or natural_break < position + chunk_size // 2:
-                    natural_break = page_text.rfind(' ', position, end)
-                if natural_break != -1 and natural_break > position + chunk_size // 2:
-                    end = natural_break + 1  # Include the period or space
-            
-            chunk_text = page_text[position:end].strip()
-            
-            # Only add non-empty chunks
-            if chunk_text:
-                all_chunks.append((chunk_text, page_number))
-                chunks_from_page += 1
-                print(f"Created chunk {chunks_from_page} from page {page_number}: {len(chunk_text)} chars")
-            
-            # Move to next chunk with overlap
-            position = end - overlap if end < len(page_text) else len(page_text)
+        if by_tokens:
+            for chunk_text, token_count in split_text_by_tokens(page_text, CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS):
+                total_chunks += 1
+                total_tokens += token_count
+                largest_chunk_tokens = max(largest_chunk_tokens, token_count)
+                yield (chunk_text, page_number, token_count)
+        else:
+            # Token counts of character chunks are taken once, when they are
+            # batched for embedding
+            for chunk_text in split_text_by_characters(page_text, chunk_size, overlap):
+                total_chunks += 1
+                total_tokens += len(chunk_text)
+                yield (chunk_text, page_number, None)
     
     # If we still have no chunks, create a minimal one to prevent downstream errors
-    if not all_chunks:
+    if not total_chunks:
         print("Warning: No chunks created, adding a minimal chunk")
-        all_chunks.append(("Document processing completed, but no usable content was found.", 1))
+        yield ("Document processing completed, but no usable content was found.", 1, None)
+        return
     
-    print(f"Generated {len(all_chunks)} total chunks across all pages")
-    return all_chunks
+    pages_summary = f"{len(pages_content) - empty_pages} pages ({empty_pages} empty)"
+    if by_tokens:
+        print(f"Generated {total_chunks} chunks by tokens from {pages_summary}: "
+              f"{total_tokens} tokens, largest chunk {largest_chunk_tokens} tokens")
+    else:
+        print(f"Generated {total_chunks} chunks by characters from {pages_summary}: {total_tokens} chars")
+
+
+def chunk_text(pages_content, pages_info=None, chunk_size=2000, overlap=200):
+    """
+    Split text into chunks with accurate tracking of original page numbers.
+    Improved for better handling of Azure Document Intelligence results.
+    
+    Args:
+        pages_content: List of dicts with page number and text
+        pages_info: Not used, kept for compatibility
+        chunk_size: Maximum characters per chunk
+        overlap: Number of characters to overlap between chunks
+        
+    Returns:
+        List of tuples: (chunk_text, page_number, token_count), token_count
+        being None in character mode
+    """
+    return list(iter_chunks(pages_content, chunk_size, overlap))
+
+
+# Shared by every upload in this worker, so concurrent uploads together stay
+# within EMBEDDING_MAX_WORKERS requests in flight and the ingestion quota share.
+EMBEDDING_RATE_LIMITER = AdaptiveRateLimiter(
+    EMBEDDING_TPM_LIMIT,
+    EMBEDDING_RPM_LIMIT,
+    share=EMBEDDING_INGESTION_QUOTA_SHARE
+)
+EMBEDDING_EXECUTOR = ThreadPoolExecutor(max_workers=EMBEDDING_MAX_WORKERS, thread_name_prefix="embedding")
+# Embeds the next window of a streaming upload while the current one is
+# indexed. Its threads only wait on EMBEDDING_EXECUTOR, so it can be generous.
+EMBEDDING_WINDOW_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="embedding-window")
+
+# Chunk documents sent per upload_documents call
+INDEX_BATCH_SIZE = 100
 
 
 def generate_embedding(
@@ -195,43 +804,29 @@ def generate_embedding(
     initial_delay=1.0,
     delay_multiplier=2.0
 ):
+    """
+    Embed a single text (used for search queries). Not throttled by the
+    ingestion limiter, but a 429 here waits for Retry-After and also pauses
+    ingestion so interactive requests get through.
+
+    A query matching a cached chunk reuses its vector, but query vectors
+    are not written to the embedding cache: they are rarely reused, would
+    evict chunk vectors under its size cap, and QUERY_EMBEDDING_CACHE
+    (functions_search.py) already keeps recent ones in memory.
+    """
     settings = get_settings()
 
     retries = 0
     current_delay = initial_delay
 
-    enable_image_gen_apim = settings.get('enable_image_gen_apim', False)
+    embedding_client, embedding_model = get_embedding_client(settings)
 
-    if enable_image_gen_apim:
-        embedding_model = settings.get('azure_apim_embedding_deployment')
-        embedding_client = AzureOpenAI(
-            api_version = settings.get('azure_apim_embedding_api_version'),
-            azure_endpoint = settings.get('azure_apim_embedding_endpoint'),
-            api_key=settings.get('azure_apim_embedding_subscription_key'))
-    else:
-        if (settings.get('azure_openai_embedding_authentication_type') == 'managed_identity'):
-            token_provider = get_bearer_token_provider(DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default")
-            embedding_client = AzureOpenAI(
-                api_version=settings.get('azure_openai_embedding_api_version'),
-                azure_endpoint=settings.get('azure_openai_embedding_endpoint'),
-                azure_ad_token_provider=token_provider
-            )
-        
-            embedding_model_obj = settings.get('embedding_model', {})
-            if embedding_model_obj and embedding_model_obj.get('selected'):
-                selected_embedding_model = embedding_model_obj['selected'][0]
-                embedding_model = selected_embedding_model['deploymentName']
-        else:
-            embedding_client = AzureOpenAI(
-                api_version=settings.get('azure_openai_embedding_api_version'),
-                azure_endpoint=settings.get('azure_openai_embedding_endpoint'),
-                api_key=settings.get('azure_openai_embedding_key')
-            )
-            
-            embedding_model_obj = settings.get('embedding_model', {})
-            if embedding_model_obj and embedding_model_obj.get('selected'):
-                selected_embedding_model = embedding_model_obj['selected'][0]
-                embedding_model = selected_embedding_model['deploymentName']
+    cache = get_embedding_cache()
+    cache_key = embedding_cache_key(text, embedding_model_id(settings, embedding_model))
+    if cache:
+        cached = cache.get_many([cache_key])
+        if cache_key in cached:
+            return cached[cache_key]
 
     while True:
         try:
@@ -240,18 +835,251 @@ def generate_embedding(
                 input=text
             )
 
-            embedding = response.data[0].embedding
-            return embedding
+            return response.data[0].embedding
 
         except RateLimitError as e:
             retries += 1
             if retries > max_retries:
+                record_dependency_error('openai')
                 return None
 
-            wait_time = current_delay * random.uniform(1.0, 1.5)
+            wait_time = retry_after_seconds(e.response.headers, default=current_delay * random.uniform(1.0, 1.5))
+            EMBEDDING_RATE_LIMITER.record_rate_limited(wait_time)
             time.sleep(wait_time)
             current_delay *= delay_multiplier
 
         except Exception as e:
+            record_dependency_error('openai')
             return None
-        
+
+
+def embedding_model_id(settings, embedding_model):
+    """Endpoint plus deployment name: what the embedding cache keys vectors by."""
+    if settings.get('enable_embedding_apim', False):
+        endpoint = settings.get('azure_apim_embedding_endpoint')
+    else:
+        endpoint = settings.get('azure_openai_embedding_endpoint')
+    return f"{endpoint}|{embedding_model}"
+
+
+def _plan_embedding_batches(texts, max_batch_items, max_batch_tokens, token_counts=None):
+    """
+    Split the indexes of texts into consecutive batches within both bounds.
+    Returns (batches, token counts of texts); counts missing from
+    token_counts are counted here, once.
+    """
+    counts = [
+        known if known is not None else count_tokens(text)
+        for text, known in zip(texts, token_counts or [None] * len(texts))
+    ]
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for idx, tokens in enumerate(counts):
+        if batch and (len(batch) >= max_batch_items or batch_tokens + tokens > max_batch_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(idx)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches, counts
+
+
+def _create_embeddings(embedding_client, embedding_model, inputs, estimated_tokens):
+    """
+    One rate-limited embeddings.create call for inputs of estimated_tokens
+    tokens; runs on EMBEDDING_EXECUTOR. The SDK's own retries are disabled
+    so 429s reach the limiter.
+    """
+    EMBEDDING_RATE_LIMITER.acquire(estimated_tokens)
+    raw_response = embedding_client.with_options(max_retries=0).embeddings.with_raw_response.create(
+        model=embedding_model,
+        input=inputs
+    )
+    EMBEDDING_RATE_LIMITER.record_response(raw_response.headers)
+    response = raw_response.parse()
+    usage = getattr(response, 'usage', None)
+    EMBEDDING_RATE_LIMITER.record_usage(estimated_tokens, getattr(usage, 'prompt_tokens', None))
+    return response
+
+
+def generate_embeddings_batch(
+    texts,
+    max_batch_items=None,
+    max_batch_tokens=None,
+    max_retries=5,
+    on_progress=None,
+    token_counts=None
+):
+    """
+    Embed many texts with as few embeddings.create calls as possible.
+
+    Texts are packed into requests of at most max_batch_items inputs and
+    max_batch_tokens tokens, which are sent concurrently on
+    EMBEDDING_EXECUTOR as fast as EMBEDDING_RATE_LIMITER allows. Returns a
+    list in the same order as texts, holding each vector or None where
+    embedding failed. A request that fails is split in half and only the
+    halves are retried, so one bad input costs a few extra calls rather
+    than the whole document. Rate-limited requests are retried up to
+    max_retries times after the Retry-After pause.
+
+    Texts found in the embedding cache are not sent at all; new vectors are
+    added to it. on_progress(finished), if given, is called with the number
+    of texts done so far. token_counts, if given, holds the token count of
+    each text (or None where unknown) so texts are not tokenized again.
+    """
+    if not texts:
+        return []
+
+    settings = get_settings()
+    max_batch_items = max_batch_items or EMBEDDING_BATCH_MAX_ITEMS
+    max_batch_tokens = max_batch_tokens or EMBEDDING_BATCH_MAX_TOKENS
+    embedding_client, embedding_model = get_embedding_client(settings)
+
+    embeddings = [None] * len(texts)
+
+    cache = get_embedding_cache()
+    model_id = embedding_model_id(settings, embedding_model)
+    cache_keys = [embedding_cache_key(text, model_id) for text in texts]
+    cached = cache.get_many(cache_keys) if cache else {}
+    to_embed = []
+    for idx, key in enumerate(cache_keys):
+        if key in cached:
+            embeddings[idx] = cached[key]
+        else:
+            to_embed.append(idx)
+
+    # Batches hold positions in to_embed; (batch, rate limited attempts so far)
+    batches, batch_token_counts = _plan_embedding_batches(
+        [texts[idx] for idx in to_embed],
+        max_batch_items,
+        max_batch_tokens,
+        [token_counts[idx] for idx in to_embed] if token_counts else None
+    )
+    pending = [(batch, 0) for batch in batches]
+    print(f"Embedding {len(to_embed)} texts in {len(pending)} batches ({len(texts) - len(to_embed)} cached)")
+    in_flight = {}
+    finished = len(texts) - len(to_embed)
+    if on_progress:
+        on_progress(finished)
+
+    while pending or in_flight:
+        while pending and len(in_flight) < EMBEDDING_MAX_WORKERS:
+            batch, attempts = pending.pop(0)
+            future = EMBEDDING_EXECUTOR.submit(
+                _create_embeddings,
+                embedding_client,
+                embedding_model,
+                [texts[to_embed[position]] for position in batch],
+                sum(batch_token_counts[position] for position in batch)
+            )
+            in_flight[future] = (batch, attempts)
+
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            batch, attempts = in_flight.pop(future)
+            try:
+                response = future.result()
+                # item.index is the position within this request's input list
+                new_vectors = {}
+                for item in response.data:
+                    idx = to_embed[batch[item.index]]
+                    embeddings[idx] = item.embedding
+                    new_vectors[cache_keys[idx]] = item.embedding
+                if cache:
+                    cache.put_many(new_vectors)
+                finished += len(batch)
+                if on_progress:
+                    on_progress(finished)
+            except RateLimitError as e:
+                EMBEDDING_RATE_LIMITER.record_rate_limited(retry_after_seconds(e.response.headers))
+                if attempts < max_retries:
+                    pending.insert(0, (batch, attempts + 1))
+                else:
+                    print(f"Embedding batch of {len(batch)} still rate limited after {max_retries} retries: {e}")
+                    record_dependency_error('openai')
+            except Exception as e:
+                if len(batch) > 1:
+                    middle = len(batch) // 2
+                    pending[0:0] = [(batch[:middle], attempts), (batch[middle:], attempts)]
+                else:
+                    print(f"Error generating embedding for text {to_embed[batch[0]]}: {e}")
+                    record_dependency_error('openai')
+
+    return embeddings
+
+
+def iter_embedded_chunks(chunks, window=None, total_pages=None, total_chunks=None):
+    """
+    Embed a stream of (chunk_text, page_number, token_count) tuples in windows of
+    EMBEDDING_PIPELINE_WINDOW chunks and yield (idx, chunk_text,
+    page_number, embedding). The next window is embedded while the caller
+    consumes the current one, so at most two windows of vectors are held
+    at a time. Job progress follows the chunks embedded when total_chunks
+    is known, otherwise the page reached out of total_pages.
+    """
+    window = window or EMBEDDING_PIPELINE_WINDOW
+    chunks = iter(chunks)
+    # Windows are embedded on other threads, which do not know the job
+    job = current_ingestion_job()
+    submitted = [0]
+
+    def embed_next_window():
+        window_chunks = list(islice(chunks, window))
+        if not window_chunks:
+            return None
+        on_progress = None
+        if total_chunks:
+            offset = submitted[0]
+            on_progress = lambda finished: report_ingestion_progress(
+                'embedding', min((offset + finished) / total_chunks, 1.0), job=job
+            )
+        submitted[0] += len(window_chunks)
+        future = EMBEDDING_WINDOW_EXECUTOR.submit(
+            generate_embeddings_batch,
+            [text for text, _, _ in window_chunks],
+            on_progress=on_progress,
+            token_counts=[token_count for _, _, token_count in window_chunks]
+        )
+        return window_chunks, future
+
+    idx = 0
+    current = embed_next_window()
+    while current:
+        window_chunks, future = current
+        embeddings = future.result()
+        current = embed_next_window()
+        for (text, page_number, _), embedding in zip(window_chunks, embeddings):
+            yield idx, text, page_number, embedding
+            idx += 1
+        if total_pages and not total_chunks:
+            report_ingestion_progress('embedding', min(normalize_page_number(window_chunks[-1][1]) / total_pages, 1.0), job=job)
+
+
+def normalize_page_number(page_number):
+    """Page numbers are stored as integers >= 1."""
+    try:
+        return max(int(page_number), 1)
+    except (ValueError, TypeError):
+        return 1
+
+
+def upload_chunk_documents(search_client, documents, batch_size=INDEX_BATCH_SIZE):
+    """
+    Upload an iterable of chunk documents to the search index, flushing a
+    batch every batch_size documents. Returns the number uploaded.
+    """
+    uploaded = 0
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            search_client.upload_documents(documents=batch)
+            uploaded += len(batch)
+            batch = []
+    if batch:
+        search_client.upload_documents(documents=batch)
+        uploaded += len(batch)
+    return uploaded
@@ -0,0 +1,359 @@
+# functions_content_registry.py
+#
+# Content-addressed registry of uploaded files (CONTENT_DEDUP_ENABLED). An
+# upload is hashed (SHA-256) as it is read; the registry maps the hash to
+# the blob holding the file and to the pages extracted from it. When the
+# same file is uploaded again -- to another personal workspace, a group or
+# as a default document -- the upload reuses that blob and those pages, and
+# its chunks hit the embedding cache, so only the workspace's own index
+# documents and metadata are written.
+#
+# Registered content is stored as content/<hash><extension>, whoever uploads
+# it first. Every document version pointing at a registered blob holds one
+# reference; release_document_blob() drops one and deletes the blob (and its
+# pages) with the last. Because a registry can lose entries (a sqlite file
+# of another host, or one lost with a restart), a blob is only deleted once
+# no document metadata outside the one being deleted still points at it.
+# Entries live in a store picked by CONTENT_REGISTRY:
+#
+#   sqlite  local file shared by every process on the host
+#   cosmos  the "content_registry" container, for several instances
+#
+# Registry failures are logged and treated as misses; they never fail an
+# upload.
+
+import gzip
+import sqlite3
+
+from config import *
+from functions_blob_storage import upload_to_blob_storage, download_from_blob_storage, delete_blob
+
+# Attempts at an ETag-checked reference count update before giving up
+COSMOS_UPDATE_ATTEMPTS = 5
+# Bytes read from an upload per hash update
+HASH_READ_SIZE = 1024 * 1024
+# Metadata containers and the fields in them that point at a document's blob
+DOCUMENT_BLOB_FIELDS = (
+    (documents_container, "storage_url"),
+    (default_documents_container, "storage_url"),
+    (group_documents_container, "document_source_url"),
+    (group_documents_container, "blob_url"),
+)
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def read_and_hash(file):
+    """Read an uploaded file from its current position. Returns (content, sha256 hex digest)."""
+    digest = hashlib.sha256()
+    parts = []
+    while True:
+        part = file.read(HASH_READ_SIZE)
+        if not part:
+            break
+        digest.update(part)
+        parts.append(part)
+    return b"".join(parts), digest.hexdigest()
+
+
+class SQLiteContentRegistry:
+    """Entries as rows of a SQLite file; reference counts change under the write lock."""
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS content_registry ("
+                "id TEXT PRIMARY KEY, blob_url TEXT NOT NULL, references_count INTEGER NOT NULL, "
+                "data TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS content_registry_blob_url ON content_registry (blob_url)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def _write(self, statement):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = statement(connection)
+            connection.execute("COMMIT")
+            return result
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def get(self, content_hash):
+        row = self._connection().execute(
+            "SELECT data, references_count FROM content_registry WHERE id = ?", (content_hash,)
+        ).fetchone()
+        return dict(json.loads(row[0]), references=row[1]) if row else None
+
+    def acquire(self, content_hash):
+        def statement(connection):
+            connection.execute(
+                "UPDATE content_registry SET references_count = references_count + 1 WHERE id = ?",
+                (content_hash,)
+            )
+            row = connection.execute(
+                "SELECT data, references_count FROM content_registry WHERE id = ?", (content_hash,)
+            ).fetchone()
+            return dict(json.loads(row[0]), references=row[1]) if row else None
+        return self._write(statement)
+
+    def register(self, entry):
+        def statement(connection):
+            connection.execute(
+                "INSERT INTO content_registry (id, blob_url, references_count, data) VALUES (?, ?, 1, ?)",
+                (entry["id"], entry["blob_url"], json.dumps(entry))
+            )
+        try:
+            self._write(statement)
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def update(self, content_hash, fields):
+        def statement(connection):
+            row = connection.execute("SELECT data FROM content_registry WHERE id = ?", (content_hash,)).fetchone()
+            if row:
+                entry = json.loads(row[0])
+                entry.update(fields)
+                connection.execute(
+                    "UPDATE content_registry SET data = ? WHERE id = ?", (json.dumps(entry), content_hash)
+                )
+        self._write(statement)
+
+    def release(self, blob_url):
+        def statement(connection):
+            row = connection.execute(
+                "SELECT id, data, references_count FROM content_registry WHERE blob_url = ?", (blob_url,)
+            ).fetchone()
+            if not row:
+                return None
+            remaining = row[2] - 1
+            if remaining > 0:
+                connection.execute(
+                    "UPDATE content_registry SET references_count = ? WHERE id = ?", (remaining, row[0])
+                )
+            else:
+                connection.execute("DELETE FROM content_registry WHERE id = ?", (row[0],))
+            return dict(json.loads(row[1]), references=max(remaining, 0))
+        return self._write(statement)
+
+
+class CosmosContentRegistry:
+    """Entries as items of the content_registry container (id = hash); counts use ETag checks."""
+
+    def __init__(self, container):
+        self._container = container
+
+    def get(self, content_hash):
+        try:
+            return self._container.read_item(item=content_hash, partition_key=content_hash)
+        except CosmosResourceNotFoundError:
+            return None
+
+    def _replace(self, entry):
+        return self._container.replace_item(
+            item=entry["id"],
+            body=entry,
+            etag=entry.get("_etag"),
+            match_condition=MatchConditions.IfNotModified
+        )
+
+    def acquire(self, content_hash):
+        for _ in range(COSMOS_UPDATE_ATTEMPTS):
+            entry = self.get(content_hash)
+            if entry is None:
+                return None
+            entry["references"] += 1
+            try:
+                return self._replace(entry)
+            except exceptions.CosmosAccessConditionFailedError:
+                continue
+            except CosmosResourceNotFoundError:
+                # Released to zero in between
+                return None
+        raise Exception(f"Could not add a reference to content {content_hash}")
+
+    def register(self, entry):
+        try:
+            self._container.create_item(body=dict(entry, references=1))
+            return True
+        except CosmosResourceExistsError:
+            return False
+
+    def update(self, content_hash, fields):
+        entry = self.get(content_hash)
+        if entry:
+            entry.update(fields)
+            self._container.upsert_item(entry)
+
+    def release(self, blob_url):
+        for _ in range(COSMOS_UPDATE_ATTEMPTS):
+            entries = list(self._container.query_items(
+                query="SELECT * FROM c WHERE c.blob_url = @blob_url",
+                parameters=[{"name": "@blob_url", "value": blob_url}],
+                enable_cross_partition_query=True
+            ))
+            if not entries:
+                return None
+            entry = entries[0]
+            entry["references"] -= 1
+            try:
+                if entry["references"] > 0:
+                    return self._replace(entry)
+                self._container.delete_item(
+                    item=entry["id"],
+                    partition_key=entry["id"],
+                    etag=entry.get("_etag"),
+                    match_condition=MatchConditions.IfNotModified
+                )
+                entry["references"] = 0
+                return entry
+            except exceptions.CosmosAccessConditionFailedError:
+                continue
+            except CosmosResourceNotFoundError:
+                return None
+        raise Exception(f"Could not release a reference to {blob_url}")
+
+
+CONTENT_REGISTRIES = {
+    "sqlite": lambda: SQLiteContentRegistry(CONTENT_REGISTRY_PATH),
+    "cosmos": lambda: CosmosContentRegistry(content_registry_container),
+}
+
+_content_registry_lock = threading.Lock()
+
+
+def get_content_registry():
+    """The process-wide content registry, or None if CONTENT_DEDUP_ENABLED is off."""
+    if not CONTENT_DEDUP_ENABLED:
+        return None
+    registry = CLIENTS.get("content_registry")
+    if registry is None:
+        with _content_registry_lock:
+            registry = CLIENTS.get("content_registry")
+            if registry is None:
+                if CONTENT_REGISTRY not in CONTENT_REGISTRIES:
+                    raise ValueError(f"Unsupported CONTENT_REGISTRY: {CONTENT_REGISTRY}")
+                registry = CONTENT_REGISTRIES[CONTENT_REGISTRY]()
+                CLIENTS["content_registry"] = registry
+    return registry
+
+
+def store_content(file_content, content_hash, filename, content_type=None):
+    """
+    The blob URL of an uploaded file, reusing the blob of an earlier upload
+    with the same content hash. Either way the caller now holds one
+    reference to the blob, dropped with release_document_blob().
+    """
+    registry = get_content_registry()
+    if registry:
+        try:
+            entry = registry.acquire(content_hash)
+            if entry:
+                print(f"Reusing stored content {content_hash[:12]} for {filename}: {entry['blob_url']}")
+                return entry["blob_url"]
+        except Exception as e:
+            print(f"Content registry lookup failed: {e}")
+
+    if not registry:
+        return upload_to_blob_storage(file_content, filename, content_type)
+
+    blob_name = f"content/{content_hash}{os.path.splitext(filename)[1].lower()}"
+    blob_url = upload_to_blob_storage(file_content, filename, content_type, blob_name=blob_name)
+    try:
+        if not registry.register({"id": content_hash, "blob_url": blob_url, "size": len(file_content),
+                                  "created_at": _now()}):
+            # Registered by a concurrent upload of the same file
+            entry = registry.acquire(content_hash)
+            if entry:
+                if entry["blob_url"] != blob_url:
+                    delete_blob(blob_url)
+                return entry["blob_url"]
+    except Exception as e:
+        print(f"Content registry update failed: {e}")
+    return blob_url
+
+
+def load_registered_pages(content_hash, file_ext):
+    """The pages extracted from this content for a file of type file_ext, or None."""
+    registry = get_content_registry()
+    if not registry or not content_hash:
+        return None
+    try:
+        entry = registry.get(content_hash)
+        if not entry or not entry.get("pages_url") or entry.get("pages_extension") != file_ext:
+            return None
+        pages = json.loads(gzip.decompress(download_from_blob_storage(entry["pages_url"])))
+        print(f"Reusing {len(pages)} extracted pages of content {content_hash[:12]}")
+        return pages
+    except Exception as e:
+        print(f"Could not load registered pages of {content_hash[:12]}: {e}")
+        return None
+
+
+def register_pages(content_hash, file_ext, pages):
+    """Keep the pages extracted from registered content for later uploads of it."""
+    registry = get_content_registry()
+    if not registry or not content_hash:
+        return
+    try:
+        entry = registry.get(content_hash)
+        if not entry or entry.get("pages_url"):
+            return
+        payload = gzip.compress(json.dumps(pages).encode("utf-8"))
+        pages_url = upload_to_blob_storage(payload, "pages.json.gz", "application/gzip")
+        registry.update(content_hash, {"pages_url": pages_url, "pages_extension": file_ext})
+    except Exception as e:
+        print(f"Could not register extracted pages of {content_hash[:12]}: {e}")
+
+
+def blob_in_use(blob_url, document_id=None):
+    """Whether document metadata other than document_id's points at blob_url."""
+    for container, field in DOCUMENT_BLOB_FIELDS:
+        items = container.query_items(
+            query=f"SELECT c.id FROM c WHERE c.{field} = @blob_url",
+            parameters=[{"name": "@blob_url", "value": blob_url}],
+            enable_cross_partition_query=True
+        )
+        if any(item["id"] != document_id for item in items):
+            return True
+    return False
+
+
+def release_document_blob(blob_url, document_id=None):
+    """
+    Drop one document version's reference to blob_url, deleting the blob and
+    its extracted pages with the last reference. document_id is the metadata
+    item being deleted with this reference; the blob is kept while any other
+    document still points at it, registered or not.
+    """
+    registry = get_content_registry()
+    entry = registry.release(blob_url) if registry else None
+    if entry and entry["references"] > 0:
+        print(f"Kept blob {blob_url}: {entry['references']} documents still use it")
+        return
+    if entry and entry.get("pages_url"):
+        try:
+            delete_blob(entry["pages_url"])
+        except Exception as e:
+            print(f"Error deleting extracted pages {entry['pages_url']}: {e}")
+    if blob_in_use(blob_url, document_id):
+        print(f"Kept blob {blob_url}: other documents still point at it")
+        return
+    if entry and registry.get(entry["id"]):
+        # Uploaded and registered again since the last reference was dropped
+        return
+    delete_blob(blob_url)
@@ -0,0 +1,142 @@
+# functions_credentials.py
+#
+# Kept free of "from config import *" because config.py needs the shared
+# credential while it is still being imported (Cosmos client creation).
+
+import asyncio
+import os
+import threading
+import time
+from azure.identity import DefaultAzureCredential
+
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("AZURE_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+
+class SharedTokenCredential:
+    """
+    Process-wide TokenCredential shared by every Azure SDK client.
+
+    Wraps a single DefaultAzureCredential (so the credential chain is only
+    walked once per process) and caches access tokens per scope. A token
+    that is inside the refresh margin is still handed out while a
+    background thread fetches its replacement, so callers only ever block
+    on the very first token for a scope.
+
+    For local testing point the managed identity chain at a fake token
+    endpoint with IDENTITY_ENDPOINT / IDENTITY_HEADER; nothing here needs
+    to change.
+    """
+
+    def __init__(self, credential_factory=DefaultAzureCredential, refresh_margin_seconds=TOKEN_REFRESH_MARGIN_SECONDS):
+        self._credential_factory = credential_factory
+        self._refresh_margin_seconds = refresh_margin_seconds
+        self._credential = None
+        self._tokens = {}
+        self._fetch_locks = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _get_credential(self):
+        if self._credential is None:
+            with self._lock:
+                if self._credential is None:
+                    self._credential = self._credential_factory()
+        return self._credential
+
+    def _get_fetch_lock(self, cache_key):
+        with self._lock:
+            return self._fetch_locks.setdefault(cache_key, threading.Lock())
+
+    def _fetch(self, cache_key, scopes, kwargs):
+        with self._get_fetch_lock(cache_key):
+            token = self._tokens.get(cache_key)
+            if token and token.expires_on - time.time() > self._refresh_margin_seconds:
+                return token
+            token = self._get_credential().get_token(*scopes, **kwargs)
+            self._tokens[cache_key] = token
+            return token
+
+    def _refresh_in_background(self, cache_key, scopes, kwargs):
+        with self._lock:
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+
+        def refresh():
+            try:
+                self._fetch(cache_key, scopes, kwargs)
+            except Exception as e:
+                print(f"Background token refresh failed for {scopes}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(cache_key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def get_token(self, *scopes, claims=None, tenant_id=None, **kwargs):
+        if claims:
+            # Claims challenges (CAE) must always go to the identity provider
+            return self._get_credential().get_token(*scopes, claims=claims, tenant_id=tenant_id, **kwargs)
+
+        if tenant_id:
+            kwargs["tenant_id"] = tenant_id
+        cache_key = (tuple(sorted(scopes)), tenant_id, bool(kwargs.get("enable_cae")))
+
+        token = self._tokens.get(cache_key)
+        remaining = token.expires_on - time.time() if token else 0
+        if remaining > self._refresh_margin_seconds:
+            return token
+        if remaining > 30:
+            self._refresh_in_background(cache_key, scopes, kwargs)
+            return token
+        return self._fetch(cache_key, scopes, kwargs)
+
+    def reset(self):
+        """Forget the wrapped credential and all cached tokens (e.g. after fork)."""
+        with self._lock:
+            self._credential = None
+            self._tokens = {}
+            self._fetch_locks = {}
+            self._refreshing = set()
+
+    def close(self):
+        credential = self._credential
+        self.reset()
+        if credential is not None and hasattr(credential, "close"):
+            credential.close()
+
+
+class AsyncSharedTokenCredential:
+    """
+    Async (azure.core AsyncTokenCredential) view of a SharedTokenCredential,
+    for the aio SDK clients used by the ASGI chat path. get_token runs on a
+    thread so a token fetch never blocks the event loop.
+    """
+
+    def __init__(self, shared_credential):
+        self._shared_credential = shared_credential
+
+    async def get_token(self, *scopes, **kwargs):
+        return await asyncio.to_thread(self._shared_credential.get_token, *scopes, **kwargs)
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+_shared_credential = SharedTokenCredential()
+
+
+def get_shared_credential():
+    """Return the process-wide managed identity credential."""
+    return _shared_credential
+
+
+def get_async_shared_credential():
+    """Return an async wrapper around the process-wide managed identity credential."""
+    return AsyncSharedTokenCredential(_shared_credential)
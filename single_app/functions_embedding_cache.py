@@ -0,0 +1,213 @@
+# functions_embedding_cache.py
+#
+# Content-addressed embedding cache. A vector is stored under
+# hash(normalized text, embedding model, dimensions), so unchanged chunks of
+# a new document version, and the same file uploaded to several workspaces,
+# are only embedded once.
+#
+#   local tier   SQLite file at EMBEDDING_CACHE_PATH, shared by the workers on
+#                a host, bounded to EMBEDDING_CACHE_MAX_ENTRIES (LRU eviction)
+#   shared tier  the "embedding_cache" Cosmos container, when
+#                EMBEDDING_CACHE_COSMOS_ENABLED=true
+#
+# Cache failures are logged and treated as misses; they never fail an upload.
+
+import sqlite3
+import unicodedata
+from array import array
+
+from config import *
+from functions_metrics import *
+
+# Rows evicted at once when the local tier is full, as a fraction of its size
+EVICTION_FRACTION = 0.1
+# Max ids per ARRAY_CONTAINS query against the shared tier
+COSMOS_LOOKUP_BATCH_SIZE = 100
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_embedding_text(text):
+    """Unicode NFC with runs of whitespace collapsed to one space."""
+    return _WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def embedding_cache_key(text, model, dimensions=None):
+    """
+    Cache key of one text for one embedding model. `model` should identify
+    the deployment unambiguously (endpoint and deployment name); dimensions
+    is None when the deployment's default vector size is used.
+    """
+    payload = "\0".join([normalize_embedding_text(text), model or "", str(dimensions or "default")])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LocalEmbeddingCache:
+    """SQLite store of float32 vectors with least-recently-used eviction."""
+
+    def __init__(self, path, max_entries):
+        self._path = path
+        self._max_entries = max_entries
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            # WAL lets the other workers on the host read while one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._local.connection = connection
+        return connection
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys that are cached."""
+        found = {}
+        connection = self._connection()
+        keys = list(keys)
+        # Stay well below SQLite's limit on bound parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+        if found:
+            now = time.time()
+            connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+        return found
+
+    def put_many(self, vectors):
+        """Store {key: vector} and evict the least recently used rows over the limit."""
+        if not vectors:
+            return
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in vectors.items()]
+            )
+            count = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self._max_entries:
+                evict = count - self._max_entries + int(self._max_entries * EVICTION_FRACTION)
+                connection.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (evict,)
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+
+class CosmosEmbeddingCache:
+    """Shared tier: one item per vector in the embedding_cache container (partition key /id)."""
+
+    def __init__(self, container):
+        self._container = container
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), COSMOS_LOOKUP_BATCH_SIZE):
+            chunk = keys[start:start + COSMOS_LOOKUP_BATCH_SIZE]
+            wanted = set(chunk)
+            items = self._container.query_items(
+                query="SELECT c.id, c.embedding FROM c WHERE ARRAY_CONTAINS(@ids, c.id)",
+                parameters=[{"name": "@ids", "value": chunk}],
+                enable_cross_partition_query=True
+            )
+            for item in items:
+                if item.get("id") in wanted and item.get("embedding"):
+                    found[item["id"]] = item["embedding"]
+        return found
+
+    def put_many(self, vectors):
+        for key, vector in vectors.items():
+            self._container.upsert_item({"id": key, "embedding": vector})
+
+
+class EmbeddingCache:
+    """Local tier in front of the optional shared tier."""
+
+    def __init__(self, local, shared=None):
+        self._local = local
+        self._shared = shared
+        # Writes to the shared tier happen off the request thread
+        self._shared_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache") if shared else None
+
+    def _lookup(self, tier, store, keys):
+        try:
+            found = store.get_many(keys)
+        except Exception as e:
+            print(f"Embedding cache ({tier}) lookup failed: {e}")
+            found = {}
+        EMBEDDING_CACHE_LOOKUPS.labels(tier=tier, result='hit').inc(len(found))
+        EMBEDDING_CACHE_LOOKUPS.labels(tier=tier, result='miss').inc(len(keys) - len(found))
+        return found
+
+    def get_many(self, keys):
+        """Return {key: vector} for every key found in either tier."""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        found = self._lookup('local', self._local, keys)
+        missing = [key for key in keys if key not in found]
+        if missing and self._shared:
+            shared_found = self._lookup('cosmos', self._shared, missing)
+            if shared_found:
+                self._put_local(shared_found)
+                found.update(shared_found)
+        return found
+
+    def _put_local(self, vectors):
+        try:
+            self._local.put_many(vectors)
+        except Exception as e:
+            print(f"Embedding cache (local) write failed: {e}")
+
+    def _put_shared(self, vectors):
+        try:
+            self._shared.put_many(vectors)
+        except Exception as e:
+            print(f"Embedding cache (cosmos) write failed: {e}")
+
+    def put_many(self, vectors):
+        """Store {key: vector} in both tiers."""
+        vectors = {key: vector for key, vector in vectors.items() if vector}
+        if not vectors:
+            return
+        self._put_local(vectors)
+        if self._shared:
+            self._shared_writer.submit(self._put_shared, vectors)
+
+
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """The process-wide EmbeddingCache, or None if EMBEDDING_CACHE_ENABLED is off."""
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    cache = CLIENTS.get("embedding_cache")
+    if cache is None:
+        with _embedding_cache_lock:
+            cache = CLIENTS.get("embedding_cache")
+            if cache is None:
+                shared = CosmosEmbeddingCache(embedding_cache_container) if embedding_cache_container is not None else None
+                cache = EmbeddingCache(LocalEmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES), shared)
+                CLIENTS["embedding_cache"] = cache
+    return cache
@@ -0,0 +1,176 @@
+# functions_incremental_index.py
+#
+# Incremental re-indexing of a re-uploaded file (ENABLE_INCREMENTAL_REINDEX).
+# Instead of indexing the new version as a separate document, the previous
+# version's document is updated in place: its indexed chunks are matched to
+# the new chunks by content hash, unchanged chunks keep their index document
+# and vector, and only new chunks are embedded and uploaded and only
+# vanished chunks are deleted -- after the document's metadata describes the
+# new version, so a failed update can be rolled back to the previous one.
+
+from config import *
+from functions_content import *
+from functions_embedding_cache import normalize_embedding_text
+from functions_content_registry import get_content_registry, release_document_blob
+from functions_ingestion_jobs import report_ingestion_progress
+
+def chunk_content_hash(text):
+    return hashlib.sha256(normalize_embedding_text(text).encode("utf-8")).hexdigest()
+
+
+def get_indexed_chunks(search_client, document_id, extra_fields=()):
+    """The chunk documents of document_id currently in the index (without vectors)."""
+    results = search_client.search(
+        search_text="*",
+        filter=f"document_id eq '{document_id}'",
+        select=["id", "chunk_id", "chunk_text", "chunk_sequence", "page_number", *extra_fields]
+    )
+    return list(results)
+
+
+def delete_chunks(search_client, chunk_ids):
+    """
+    Remove chunks by id. Uploads are not searchable right away, so chunks
+    written moments ago are deleted by the ids they were written with.
+    """
+    _index_actions(search_client, [("delete", {"id": chunk_id}) for chunk_id in chunk_ids])
+
+
+def diff_chunks(indexed_chunks, chunks_with_pages):
+    """
+    Match the new (text, page) chunks against the indexed chunks by content
+    hash, in document order. Returns (kept, new_indexes, stale_ids):
+      kept         {new chunk index: matching indexed chunk}
+      new_indexes  new chunk indexes without a match
+      stale_ids    ids of indexed chunks no new chunk matched
+    """
+    by_hash = {}
+    for chunk in sorted(indexed_chunks, key=lambda c: c.get("chunk_sequence") or 0):
+        by_hash.setdefault(chunk_content_hash(chunk.get("chunk_text") or ""), []).append(chunk)
+
+    kept = {}
+    new_indexes = []
+    for idx, (text, _, _) in enumerate(chunks_with_pages):
+        candidates = by_hash.get(chunk_content_hash(text))
+        if candidates:
+            kept[idx] = candidates.pop(0)
+        else:
+            new_indexes.append(idx)
+
+    stale_ids = [chunk["id"] for candidates in by_hash.values() for chunk in candidates]
+    return kept, new_indexes, stale_ids
+
+
+def _index_actions(search_client, actions):
+    """Send an iterable of (action_type, document) pairs in batches of INDEX_BATCH_SIZE."""
+    actions = iter(actions)
+    while True:
+        chunk = list(islice(actions, INDEX_BATCH_SIZE))
+        if not chunk:
+            return
+        batch = IndexDocumentsBatch()
+        for action_type, document in chunk:
+            if action_type == "upload":
+                batch.add_upload_actions([document])
+            elif action_type == "merge":
+                batch.add_merge_actions([document])
+            else:
+                batch.add_delete_actions([document])
+        search_client.index_documents(batch)
+
+
+def reindex_document_chunks(search_client, document_id, version, chunks_with_pages, build_chunk_document, updated_fields):
+    """
+    Bring the indexed chunks of an existing document_id up to date with
+    chunks_with_pages for a new version.
+
+    build_chunk_document(chunk_id, idx, chunk_text, page_number, embedding)
+    returns the full index document of a new chunk. Kept chunks only get
+    their position and page merged, plus updated_fields (version, upload
+    date, blob URL), so every chunk of the document describes the current
+    version.
+
+    New chunks are uploaded first, then kept chunks are merged. Chunks the
+    new version no longer has are left in place: the caller deletes them
+    with delete_stale_chunks() once the document's metadata describes the
+    new version, or undoes everything with rollback_reindex(). A failure
+    here is rolled back before it is raised. Returns a summary dict.
+    """
+    indexed_chunks = get_indexed_chunks(search_client, document_id, extra_fields=list(updated_fields))
+    kept, new_indexes, stale_ids = diff_chunks(indexed_chunks, chunks_with_pages)
+    summary = {
+        "kept": len(kept),
+        "added": len(new_indexes),
+        "deleted": len(stale_ids),
+        "stale_ids": stale_ids,
+        # Position-based ids of earlier versions may still be in use by kept chunks
+        "new_ids": [f"{document_id}_v{version}_{idx}" for idx in new_indexes],
+        "restore": [
+            {field: chunk.get(field) for field in ("id", "chunk_id", "chunk_sequence", "page_number", *updated_fields)}
+            for chunk in kept.values()
+        ]
+    }
+
+    def actions():
+        # New chunks are embedded window by window as the batches are sent
+        new_chunks = iter_embedded_chunks(
+            (chunks_with_pages[idx] for idx in new_indexes), total_chunks=len(new_indexes)
+        )
+        for position, chunk_text_content, page_number, embedding in new_chunks:
+            idx = new_indexes[position]
+            yield ("upload", build_chunk_document(
+                summary["new_ids"][position], idx, chunk_text_content, normalize_page_number(page_number), embedding
+            ))
+
+        for idx, chunk in kept.items():
+            yield ("merge", {
+                "id": chunk["id"],
+                "chunk_id": str(idx),
+                "chunk_sequence": idx,
+                "page_number": normalize_page_number(chunks_with_pages[idx][1]),
+                **updated_fields
+            })
+
+    report_ingestion_progress('indexing')
+    try:
+        _index_actions(search_client, actions())
+    except Exception:
+        rollback_reindex(search_client, summary)
+        raise
+
+    print(f"Incremental reindex of {document_id} v{version}: {summary['kept']} chunks kept, "
+          f"{summary['added']} added, {summary['deleted']} to delete")
+    return summary
+
+
+def rollback_reindex(search_client, summary):
+    """Put the indexed chunks back as they were before reindex_document_chunks()."""
+    try:
+        delete_chunks(search_client, summary["new_ids"])
+        _index_actions(search_client, [("merge", chunk) for chunk in summary["restore"]])
+    except Exception as e:
+        print(f"Could not roll back incremental reindex: {e}")
+
+
+def delete_stale_chunks(search_client, summary):
+    """Delete the chunks the new version no longer has."""
+    try:
+        delete_chunks(search_client, summary["stale_ids"])
+    except Exception as e:
+        print(f"Error deleting {len(summary['stale_ids'])} stale chunks: {e}")
+
+
+def delete_replaced_blob(previous_blob_url, blob_url):
+    """Release the blob of the version that was just replaced in place."""
+    if not previous_blob_url:
+        return
+    try:
+        if previous_blob_url == blob_url:
+            # Same content, stored once: only drop the replaced version's reference
+            registry = get_content_registry()
+            if registry:
+                registry.release(blob_url)
+            return
+        release_document_blob(previous_blob_url)
+    except Exception as e:
+        print(f"Error deleting replaced blob {previous_blob_url}: {e}")
@@ -0,0 +1,370 @@
+# functions_ingestion.py
+#
+# The document ingestion engine shared by personal, group and default
+# documents. Every upload goes through the same stages:
+#
+#   store     validate the file and save it to Blob Storage
+#   extract   local parsing for txt/md/csv/json and Office/HTML files,
+#             Document Intelligence for PDFs, images and the rest
+#   index     chunk -> embed -> search index, streamed in windows; a new
+#             version of an existing file is re-indexed incrementally
+#   metadata  the document's metadata item in Cosmos DB
+#
+# What differs per workspace type (Cosmos container, search index, how
+# earlier versions are found, owner fields) is described by an IngestionSink,
+# registered in INGESTION_SINKS under its ingestion job kind. Batching, the
+# embedding cache, rate limiting and background jobs therefore apply to all
+# workspace types alike.
+#
+# Uploads are hashed as they are read; a file already stored for any
+# workspace reuses its blob and extracted pages (functions_content_registry).
+
+from config import *
+from functions_settings import *
+from functions_content import *
+from functions_metrics import *
+from functions_blob_storage import download_from_blob_storage
+from functions_content_registry import *
+from functions_incremental_index import (
+    reindex_document_chunks, rollback_reindex, delete_stale_chunks, delete_chunks, delete_replaced_blob
+)
+from functions_ingestion_jobs import *
+
+DOCUMENT_INTELLIGENCE_EXTENSIONS = {
+    '.pdf', '.docx', '.xlsx', '.pptx', '.html', '.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.heif'
+}
+TEXT_EXTENSIONS = {'.txt', '.md', '.csv'}
+
+CONTENT_TYPES = {
+    '.pdf': 'application/pdf',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    '.txt': 'text/plain',
+    '.csv': 'text/csv',
+    '.md': 'text/markdown',
+    '.json': 'application/json',
+    '.html': 'text/html',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.bmp': 'image/bmp',
+    '.tiff': 'image/tiff',
+    '.tif': 'image/tiff',
+    '.heif': 'image/heif'
+}
+
+
+class IngestionSink:
+    """
+    Where the documents of one workspace type are kept. `scope` holds the
+    owner fields of an upload, named by scope_fields.
+    """
+    kind = None
+    scope_fields = ()
+    search_client_name = "search_client_user"
+    # Field holding the blob URL on the metadata item and on each chunk
+    metadata_url_field = "storage_url"
+    chunk_url_field = "storage_url"
+
+    def container(self):
+        raise NotImplementedError
+
+    def version_filters(self, scope):
+        """(field, value) pairs that, with the file name, identify earlier versions."""
+        return []
+
+    def metadata_fields(self, scope):
+        return {}
+
+    def chunk_fields(self, scope):
+        return {}
+
+    def latest_version(self, file_name, scope):
+        """The metadata item of the newest version of file_name, or None."""
+        conditions = ["c.file_name = @file_name", 'c.type = "document_metadata"']
+        parameters = [{"name": "@file_name", "value": file_name}]
+        for field, value in self.version_filters(scope):
+            conditions.append(f"c.{field} = @{field}")
+            parameters.append({"name": f"@{field}", "value": value})
+        existing = list(self.container().query_items(
+            query=f"SELECT c.id, c.version, c.{self.metadata_url_field} FROM c WHERE {' AND '.join(conditions)}",
+            parameters=parameters,
+            enable_cross_partition_query=True
+        ))
+        if not existing:
+            return None
+        return max(existing, key=lambda d: d.get('version') or 0)
+
+
+class UserDocumentSink(IngestionSink):
+    kind = "user"
+    scope_fields = ("user_id",)
+
+    def container(self):
+        return documents_container
+
+    def version_filters(self, scope):
+        return [("user_id", scope["user_id"])]
+
+    def metadata_fields(self, scope):
+        return {"user_id": scope["user_id"]}
+
+    def chunk_fields(self, scope):
+        return {"user_id": scope["user_id"]}
+
+
+class GroupDocumentSink(IngestionSink):
+    kind = "group"
+    scope_fields = ("group_id", "user_id")
+    search_client_name = "search_client_group"
+    metadata_url_field = "document_source_url"
+    chunk_url_field = "blob_url"
+
+    def container(self):
+        return group_documents_container
+
+    def version_filters(self, scope):
+        return [("group_id", scope["group_id"])]
+
+    def metadata_fields(self, scope):
+        return {"group_id": scope["group_id"], "uploaded_by_user_id": scope["user_id"]}
+
+    def chunk_fields(self, scope):
+        return {"group_id": scope["group_id"]}
+
+
+class DefaultDocumentSink(IngestionSink):
+    kind = "default"
+
+    def container(self):
+        return default_documents_container
+
+    def chunk_fields(self, scope):
+        return {"is_default": True}
+
+
+INGESTION_SINKS = {sink.kind: sink for sink in (UserDocumentSink(), GroupDocumentSink(), DefaultDocumentSink())}
+
+
+def get_content_type_from_extension(filename):
+    """Determine content type based on file extension."""
+    return CONTENT_TYPES.get(os.path.splitext(filename)[1].lower(), 'application/octet-stream')
+
+
+def store_uploaded_file(file):
+    """
+    Validate an uploaded file and store it in Blob Storage, or reuse the
+    blob of an earlier upload with the same content.
+    Returns (filename, file_content, blob_url, content_hash).
+    """
+    settings = get_settings()
+    filename = secure_filename(file.filename)
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext.replace('.', '') not in ALLOWED_EXTENSIONS:
+        raise Exception(f"Unsupported file type: {file_ext}")
+
+    file.seek(0, os.SEEK_END)
+    file_length = file.tell()
+    max_bytes = settings.get('max_file_size_mb', 16) * 1024 * 1024
+    if file_length > max_bytes:
+        raise Exception(f"File size exceeds maximum allowed size ({file_length} > {max_bytes})")
+    file.seek(0)
+    file_content, content_hash = read_and_hash(file)
+
+    blob_url = store_content(file_content, content_hash, filename, get_content_type_from_extension(filename))
+    print(f"File {filename} stored in blob storage: {blob_url}")
+    return filename, file_content, blob_url, content_hash
+
+
+def _decode_text(file_content):
+    # Same newline handling as reading the file in text mode
+    return file_content.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def extract_document(file_content, filename):
+    """
+    Extract the per-page content of a file. Returns (pages, placeholder):
+    a list of {page_number, text}, and whether any page is only a message
+    standing in for text that could not be extracted.
+    """
+    file_ext = os.path.splitext(filename)[1].lower()
+
+    if file_ext in DOCUMENT_INTELLIGENCE_EXTENSIONS:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp_file:
+            tmp_file.write(file_content)
+            temp_file_path = tmp_file.name
+        try:
+            result = extract_content(temp_file_path, file_ext)
+            return result["content"], result.get("placeholder", False)
+        finally:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+
+    if file_ext in TEXT_EXTENSIONS:
+        text = _decode_text(file_content)
+    elif file_ext == '.json':
+        text = json.dumps(json.loads(_decode_text(file_content)), indent=2)
+    else:
+        raise Exception(f"Unsupported file type: {file_ext}")
+    return [{"page_number": 1, "text": text}], False
+
+
+def extract_or_reuse_pages(file_content, filename, blob_url, content_hash=None):
+    """
+    The pages of a file, reused from an earlier upload of the same content
+    when possible. file_content may be None to download the blob only if
+    extraction has to run.
+    """
+    file_ext = os.path.splitext(filename)[1].lower()
+    pages_content = load_registered_pages(content_hash, file_ext)
+    if pages_content is None:
+        if file_content is None:
+            file_content = download_from_blob_storage(blob_url)
+        pages_content, placeholder = extract_document(file_content, filename)
+        # A failed extraction is retried by the next upload of the content
+        if not placeholder:
+            register_pages(content_hash, file_ext, pages_content)
+    return pages_content
+
+
+def index_document(sink, pages_content, file_name, blob_url, scope, content_hash=None):
+    """
+    Chunk, embed and index the pages of a file, then write its metadata.
+    A new version of a file already in the workspace updates the previous
+    version's document in place (ENABLE_INCREMENTAL_REINDEX). Returns the
+    document id.
+
+    If indexing or the metadata write fails, the index is put back as it
+    was: the chunks of a new document are deleted, and an incremental
+    update is rolled back to the previous version.
+    """
+    search_client = CLIENTS[sink.search_client_name]
+    previous = sink.latest_version(file_name, scope)
+    version = previous['version'] + 1 if previous else 1
+    incremental = ENABLE_INCREMENTAL_REINDEX and previous is not None
+    document_id = previous['id'] if incremental else str(uuid4())
+    upload_date = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    chunk_fields = sink.chunk_fields(scope)
+
+    def build_chunk_document(chunk_id, idx, chunk_text_content, page_number, embedding):
+        return {
+            "id": chunk_id,
+            "document_id": document_id,
+            "chunk_id": str(idx),
+            "chunk_text": chunk_text_content,
+            "embedding": embedding,
+            "file_name": file_name,
+            "chunk_sequence": idx,
+            "page_number": page_number,
+            "upload_date": upload_date,
+            "version": version,
+            sink.chunk_url_field: blob_url,
+            **chunk_fields
+        }
+
+    reindex = None
+    # Ids of the chunks of a new document sent to the index so far
+    uploaded_ids = []
+
+    def new_chunk_documents(embedded_chunks):
+        for idx, chunk_text_content, page_number, embedding in embedded_chunks:
+            uploaded_ids.append(f"{document_id}_{idx}")
+            yield build_chunk_document(
+                uploaded_ids[-1], idx, chunk_text_content, normalize_page_number(page_number), embedding
+            )
+
+    report_ingestion_progress('chunking')
+    try:
+        with time_ingestion_stage(sink.kind, 'index'):
+            if incremental:
+                # Matching against the indexed version needs the whole chunk list
+                chunks_with_pages = chunk_text(pages_content)
+                num_chunks = len(chunks_with_pages)
+                reindex = reindex_document_chunks(
+                    search_client, document_id, version, chunks_with_pages, build_chunk_document,
+                    {"version": version, "upload_date": upload_date, sink.chunk_url_field: blob_url}
+                )
+            else:
+                # Chunks are embedded and uploaded as they are produced
+                embedded_chunks = iter_embedded_chunks(iter_chunks(pages_content), total_pages=len(pages_content))
+                num_chunks = upload_chunk_documents(search_client, new_chunk_documents(embedded_chunks))
+
+        with time_ingestion_stage(sink.kind, 'metadata'):
+            sink.container().upsert_item({
+                "id": document_id,
+                "file_name": file_name,
+                "upload_date": upload_date,
+                "version": version,
+                "num_chunks": num_chunks,
+                "type": "document_metadata",
+                "content_hash": content_hash,
+                sink.metadata_url_field: blob_url,
+                **sink.metadata_fields(scope)
+            })
+    except Exception:
+        # reindex_document_chunks rolls back its own failures
+        if reindex is not None:
+            rollback_reindex(search_client, reindex)
+        elif uploaded_ids:
+            try:
+                delete_chunks(search_client, uploaded_ids)
+            except Exception as e:
+                print(f"Could not remove the indexed chunks of failed document {document_id}: {e}")
+        raise
+
+    if incremental:
+        delete_stale_chunks(search_client, reindex)
+        delete_replaced_blob(previous.get(sink.metadata_url_field), blob_url)
+    return document_id
+
+
+def ingest_document(kind, file_content, filename, blob_url, content_hash=None, **scope):
+    """
+    Extract and index a file already stored at blob_url into the workspace
+    of `kind`. The upload's reference to the blob is released if ingestion
+    fails.
+    """
+    sink = INGESTION_SINKS[kind]
+    try:
+        report_ingestion_progress('extracting')
+        with time_ingestion_stage(kind, 'extract'):
+            pages_content = extract_or_reuse_pages(file_content, filename, blob_url, content_hash)
+        print(f"Extracted {len(pages_content)} pages from {filename}")
+
+        document_id = index_document(sink, pages_content, filename, blob_url, scope, content_hash)
+        print(f"Document processing completed successfully: {document_id}")
+        return document_id
+    except Exception as e:
+        print(f"Error ingesting {kind} document {filename}: {e}")
+        try:
+            release_document_blob(blob_url)
+            print(f"Released blob after processing error: {blob_url}")
+        except Exception as cleanup_err:
+            print(f"Error during blob cleanup: {str(cleanup_err)}")
+        raise
+
+
+def process_upload(kind, file, **scope):
+    """Store and ingest an uploaded file within the request (INGESTION_MODE=sync)."""
+    filename, file_content, blob_url, content_hash = store_uploaded_file(file)
+    return ingest_document(kind, file_content, filename, blob_url, content_hash, **scope)
+
+
+def enqueue_upload(kind, file, submitted_by, **scope):
+    """Store an uploaded file and queue its ingestion job."""
+    filename, _, blob_url, content_hash = store_uploaded_file(file)
+    return enqueue_ingestion_job(
+        kind, filename, blob_url, submitted_by=submitted_by, content_hash=content_hash, **scope
+    )
+
+
+def run_document_job(job):
+    sink = INGESTION_SINKS[job['kind']]
+    scope = {field: job[field] for field in sink.scope_fields}
+    # The file is only downloaded if its pages are not registered yet
+    return ingest_document(sink.kind, None, job['file_name'], job['blob_url'], job.get('content_hash'), **scope)
+
+
+for _kind in INGESTION_SINKS:
+    register_ingestion_handler(_kind, run_document_job)
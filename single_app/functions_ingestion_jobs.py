@@ -0,0 +1,427 @@
+# functions_ingestion_jobs.py
+#
+# Background document ingestion. Upload routes store the file in Blob
+# Storage, enqueue a job and answer 202 with the job id; ingestion workers
+# then run extraction, chunking, embedding and indexing, and record the
+# job's stage and progress for GET /api/ingestion/jobs/<job_id>.
+#
+# The ingestion engine (functions_ingestion.py) registers a handler for each
+# job kind (user, group, default) with register_ingestion_handler(). Jobs live in a pluggable store
+# picked by INGESTION_JOB_STORE:
+#
+#   sqlite  local file shared by every process on the host (default)
+#   cosmos  the "ingestion_jobs" container, for several instances
+#   memory  this process only; INGESTION_MODE=background with one worker
+
+import socket
+import sqlite3
+
+from config import *
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_SUCCEEDED = "succeeded"
+JOB_STATUS_FAILED = "failed"
+
+# Fields a job owner may see through the status API
+PUBLIC_JOB_FIELDS = (
+    "id", "kind", "file_name", "status", "stage", "progress", "error",
+    "document_id", "attempts", "created_at", "started_at", "finished_at", "updated_at"
+)
+
+INGESTION_HANDLERS = {}
+
+_current_job = threading.local()
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _stale_before():
+    stale_at = datetime.now(timezone.utc).timestamp() - INGESTION_JOB_STALE_SECONDS
+    return datetime.fromtimestamp(stale_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class MemoryJobStore:
+    """Jobs in a dict; only visible to the process that created them."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id, fields, owner=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or (owner and job.get("worker") != owner):
+                return False
+            job.update(fields, updated_at=_now())
+            return True
+
+    def claim(self, worker_id):
+        stale_before = _stale_before()
+        with self._lock:
+            for job in sorted(self._jobs.values(), key=lambda j: j["created_at"]):
+                if job["status"] == JOB_STATUS_QUEUED or (
+                    job["status"] == JOB_STATUS_RUNNING and job["updated_at"] < stale_before
+                ):
+                    now = _now()
+                    job.update(status=JOB_STATUS_RUNNING, worker=worker_id, attempts=job["attempts"] + 1,
+                               started_at=now, updated_at=now)
+                    return dict(job)
+        return None
+
+
+class SQLiteJobStore:
+    """Jobs as JSON rows in a SQLite file; claims are serialized by the write lock."""
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS ingestion_jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, created_at TEXT NOT NULL, "
+                "updated_at TEXT NOT NULL, data TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ingestion_jobs_status ON ingestion_jobs (status, created_at)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def create(self, job):
+        self._connection().execute(
+            "INSERT INTO ingestion_jobs (id, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?)",
+            (job["id"], job["status"], job["created_at"], job["updated_at"], json.dumps(job))
+        )
+
+    def get(self, job_id):
+        row = self._connection().execute("SELECT data FROM ingestion_jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, fields, owner=None):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT data FROM ingestion_jobs WHERE id = ?", (job_id,)).fetchone()
+            updated = False
+            if row:
+                job = json.loads(row[0])
+                if not owner or job.get("worker") == owner:
+                    job.update(fields, updated_at=_now())
+                    connection.execute(
+                        "UPDATE ingestion_jobs SET status = ?, updated_at = ?, data = ? WHERE id = ?",
+                        (job["status"], job["updated_at"], json.dumps(job), job_id)
+                    )
+                    updated = True
+            connection.execute("COMMIT")
+            return updated
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def claim(self, worker_id):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT data FROM ingestion_jobs WHERE status = ? OR (status = ? AND updated_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, _stale_before())
+            ).fetchone()
+            job = None
+            if row:
+                job = json.loads(row[0])
+                now = _now()
+                job.update(status=JOB_STATUS_RUNNING, worker=worker_id, attempts=job["attempts"] + 1,
+                           started_at=now, updated_at=now)
+                connection.execute(
+                    "UPDATE ingestion_jobs SET status = ?, updated_at = ?, data = ? WHERE id = ?",
+                    (job["status"], job["updated_at"], json.dumps(job), job["id"])
+                )
+            connection.execute("COMMIT")
+            return job
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+
+class CosmosJobStore:
+    """Jobs as items of the ingestion_jobs container; claims use ETag checks."""
+
+    def __init__(self, container):
+        self._container = container
+
+    def create(self, job):
+        self._container.create_item(body=job)
+
+    def get(self, job_id):
+        try:
+            return self._container.read_item(item=job_id, partition_key=job_id)
+        except CosmosResourceNotFoundError:
+            return None
+
+    def update(self, job_id, fields, owner=None):
+        for _ in range(5):
+            job = self.get(job_id)
+            if job is None or (owner and job.get("worker") != owner):
+                return False
+            job.update(fields, updated_at=_now())
+            try:
+                # Fails if another worker claimed the job since it was read
+                self._container.replace_item(
+                    item=job_id,
+                    body=job,
+                    etag=job.get("_etag"),
+                    match_condition=MatchConditions.IfNotModified
+                )
+                return True
+            except exceptions.CosmosAccessConditionFailedError:
+                continue
+        return False
+
+    def claim(self, worker_id):
+        candidates = self._container.query_items(
+            query="""
+                SELECT TOP 10 * FROM c
+                WHERE c.status = @queued OR (c.status = @running AND c.updated_at < @stale_before)
+                ORDER BY c.created_at
+            """,
+            parameters=[
+                {"name": "@queued", "value": JOB_STATUS_QUEUED},
+                {"name": "@running", "value": JOB_STATUS_RUNNING},
+                {"name": "@stale_before", "value": _stale_before()}
+            ],
+            enable_cross_partition_query=True
+        )
+        for job in candidates:
+            now = _now()
+            job.update(status=JOB_STATUS_RUNNING, worker=worker_id, attempts=job["attempts"] + 1,
+                       started_at=now, updated_at=now)
+            try:
+                # Another worker claimed it first if the ETag changed
+                return self._container.replace_item(
+                    item=job["id"],
+                    body=job,
+                    etag=job.get("_etag"),
+                    match_condition=MatchConditions.IfNotModified
+                )
+            except exceptions.CosmosAccessConditionFailedError:
+                continue
+        return None
+
+
+JOB_STORES = {
+    "memory": lambda: MemoryJobStore(),
+    "sqlite": lambda: SQLiteJobStore(INGESTION_JOB_STORE_PATH),
+    "cosmos": lambda: CosmosJobStore(ingestion_jobs_container),
+}
+
+_job_store_lock = threading.Lock()
+
+
+def get_job_store():
+    store = CLIENTS.get("ingestion_job_store")
+    if store is None:
+        with _job_store_lock:
+            store = CLIENTS.get("ingestion_job_store")
+            if store is None:
+                if INGESTION_JOB_STORE not in JOB_STORES:
+                    raise ValueError(f"Unsupported INGESTION_JOB_STORE: {INGESTION_JOB_STORE}")
+                store = JOB_STORES[INGESTION_JOB_STORE]()
+                CLIENTS["ingestion_job_store"] = store
+    return store
+
+
+def register_ingestion_handler(kind, handler):
+    """handler(job) runs the pipeline for one job and returns the document id."""
+    INGESTION_HANDLERS[kind] = handler
+
+
+def ingestion_is_async():
+    return INGESTION_MODE in ("background", "queue")
+
+
+def enqueue_ingestion_job(kind, file_name, blob_url, **fields):
+    """Record a queued job for an uploaded blob and wake the local workers."""
+    now = _now()
+    job = {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "file_name": file_name,
+        "blob_url": blob_url,
+        "status": JOB_STATUS_QUEUED,
+        "stage": "queued",
+        "progress": 0.0,
+        "error": None,
+        "document_id": None,
+        "attempts": 0,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "updated_at": now,
+        **fields
+    }
+    get_job_store().create(job)
+    print(f"Queued ingestion job {job['id']} ({kind}) for {file_name}")
+    if INGESTION_MODE == "background":
+        start_ingestion_workers()
+        _workers["wakeup"].set()
+    return job
+
+
+def accepted_job_response(job, message):
+    """The 202 response of an upload route."""
+    return jsonify({
+        'message': message,
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': f"/api/ingestion/jobs/{job['id']}"
+    }), 202
+
+
+def get_ingestion_job(job_id):
+    return get_job_store().get(job_id)
+
+
+def public_job_view(job):
+    return {field: job.get(field) for field in PUBLIC_JOB_FIELDS}
+
+
+def current_ingestion_job():
+    """(job_id, owner) of the job running on this thread, to report its progress from other threads."""
+    return getattr(_current_job, "job_id", None), getattr(_current_job, "owner", None)
+
+
+def report_ingestion_progress(stage, progress=None, job=None):
+    """
+    Record the stage (and optionally 0..1 progress within it) of the job
+    running on this thread, or of `job` as returned by
+    current_ingestion_job(). Does nothing outside an ingestion job, e.g. for
+    INGESTION_MODE=sync uploads.
+    """
+    job_id, owner = job or current_ingestion_job()
+    if not job_id:
+        return
+    fields = {"stage": stage}
+    if progress is not None:
+        fields["progress"] = round(max(0.0, min(1.0, progress)), 3)
+    try:
+        get_job_store().update(job_id, fields, owner=owner)
+    except Exception as e:
+        print(f"Could not record progress of ingestion job {job_id}: {e}")
+
+
+def _heartbeat(store, job_id, owner, stopped):
+    """Keep updated_at of a running job fresh so no other worker claims it as stale."""
+    while not stopped.wait(INGESTION_JOB_HEARTBEAT_SECONDS):
+        try:
+            if not store.update(job_id, {}, owner=owner):
+                print(f"Ingestion job {job_id} is no longer owned by {owner}")
+                return
+        except Exception as e:
+            print(f"Could not record heartbeat of ingestion job {job_id}: {e}")
+
+
+def run_ingestion_job(job):
+    """
+    Run one claimed job to completion and record the outcome, unless another
+    worker has claimed the job in the meantime.
+    """
+    store = get_job_store()
+    handler = INGESTION_HANDLERS.get(job["kind"])
+    owner = job.get("worker")
+    _current_job.job_id = job["id"]
+    _current_job.owner = owner
+    stopped = threading.Event()
+    Thread(target=_heartbeat, args=(store, job["id"], owner, stopped),
+           name=f"ingestion-heartbeat-{job['id'][:8]}", daemon=True).start()
+    try:
+        if handler is None:
+            raise Exception(f"No ingestion handler for job kind '{job['kind']}'")
+        document_id = handler(job)
+        outcome = {
+            "status": JOB_STATUS_SUCCEEDED,
+            "stage": "completed",
+            "progress": 1.0,
+            "document_id": document_id,
+            "finished_at": _now()
+        }
+        print(f"Ingestion job {job['id']} completed: {document_id}")
+    except Exception as e:
+        traceback.print_exc()
+        outcome = {
+            "status": JOB_STATUS_FAILED,
+            "error": str(e),
+            "finished_at": _now()
+        }
+        print(f"Ingestion job {job['id']} failed: {e}")
+    finally:
+        stopped.set()
+        _current_job.job_id = None
+    if not store.update(job["id"], outcome, owner=owner):
+        print(f"Outcome of ingestion job {job['id']} not recorded: claimed by another worker")
+
+
+_workers = {"pid": None, "threads": [], "wakeup": threading.Event(), "stop": threading.Event()}
+_workers_lock = threading.Lock()
+
+
+def _worker_loop(worker_id):
+    store = get_job_store()
+    while not _workers["stop"].is_set():
+        try:
+            job = store.claim(worker_id)
+        except Exception as e:
+            print(f"Ingestion worker {worker_id} could not claim a job: {e}")
+            job = None
+        if job is None:
+            _workers["wakeup"].wait(INGESTION_POLL_INTERVAL_SECONDS)
+            _workers["wakeup"].clear()
+            continue
+        if job["attempts"] > INGESTION_JOB_MAX_ATTEMPTS:
+            # Claimed again after its workers kept dying (see INGESTION_JOB_STALE_SECONDS)
+            store.update(job["id"], {"status": JOB_STATUS_FAILED, "error": "Too many attempts", "finished_at": _now()})
+            continue
+        run_ingestion_job(job)
+
+
+def start_ingestion_workers(count=None):
+    """
+    Start this process's ingestion worker threads (once per process, so
+    forked web workers start their own).
+    """
+    if _workers["pid"] == os.getpid():
+        return
+    with _workers_lock:
+        if _workers["pid"] == os.getpid():
+            return
+        _workers["pid"] = os.getpid()
+        _workers["stop"].clear()
+        _workers["threads"] = []
+        for number in range(count or INGESTION_WORKERS):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{number}"
+            thread = Thread(target=_worker_loop, args=(worker_id,), name=f"ingestion-{number}", daemon=True)
+            thread.start()
+            _workers["threads"].append(thread)
+        print(f"Started {len(_workers['threads'])} ingestion workers (pid {os.getpid()})")
+
+
+def stop_ingestion_workers():
+    _workers["stop"].set()
+    _workers["wakeup"].set()
@@ -0,0 +1,106 @@
+# functions_metrics.py
+
+from config import *
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+
+# Remote calls range from ~10 ms point reads to minute-long LLM streams
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+CHAT_STAGE_SECONDS = Histogram(
+    'simplechat_chat_stage_seconds',
+    'Latency of each remote step in the /api/chat pipeline',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+CHAT_REQUEST_SECONDS = Histogram(
+    'simplechat_chat_request_seconds',
+    'Time spent in chat_api before the response (or stream) is returned',
+    buckets=LATENCY_BUCKETS
+)
+CHAT_TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    'simplechat_chat_time_to_first_token_seconds',
+    'Time from starting the streaming completion to the first content token',
+    buckets=LATENCY_BUCKETS
+)
+CHAT_STREAM_DURATION_SECONDS = Histogram(
+    'simplechat_chat_stream_duration_seconds',
+    'Total duration of an SSE chat stream',
+    buckets=LATENCY_BUCKETS
+)
+DEPENDENCY_ERRORS = Counter(
+    'simplechat_dependency_errors_total',
+    'Failed calls to remote dependencies',
+    ['dependency']
+)
+# Document ingestion stages take from seconds to many minutes
+INGESTION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+INGESTION_STAGE_SECONDS = Histogram(
+    'simplechat_ingestion_stage_seconds',
+    'Duration of each document ingestion stage by workspace type',
+    ['kind', 'stage'],
+    buckets=INGESTION_BUCKETS
+)
+PDF_PAGES_EXTRACTED = Counter(
+    'simplechat_pdf_pages_extracted_total',
+    'PDF pages extracted from their text layer or sent to Document Intelligence',
+    ['method']
+)
+EMBEDDING_CACHE_LOOKUPS = Counter(
+    'simplechat_embedding_cache_lookups_total',
+    'Embedding cache lookups by tier and result (hit rate = hit / (hit + miss))',
+    ['tier', 'result']
+)
+
+
+def record_dependency_error(dependency):
+    DEPENDENCY_ERRORS.labels(dependency=dependency).inc()
+
+
+@contextmanager
+def time_stage(stage, dependency=None):
+    """
+    Time a pipeline stage into CHAT_STAGE_SECONDS. If the block raises, the
+    error is counted against `dependency` and re-raised.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if dependency:
+            record_dependency_error(dependency)
+        raise
+    finally:
+        CHAT_STAGE_SECONDS.labels(stage=stage).observe(time.perf_counter() - start_time)
+
+
+@contextmanager
+def time_ingestion_stage(kind, stage):
+    """Time one stage of a document ingestion into INGESTION_STAGE_SECONDS."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        INGESTION_STAGE_SECONDS.labels(kind=kind, stage=stage).observe(time.perf_counter() - start_time)
+
+
+def render_metrics():
+    """
+    Return (body, content_type) in Prometheus text format. Under gunicorn
+    the metrics of all workers are aggregated through PROMETHEUS_MULTIPROC_DIR.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,137 @@
+# functions_openai.py
+
+from config import *
+
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+# Guards CLIENTS["openai_clients"]; kept separate from CLIENTS_LOCK so a slow
+# initialize_clients() never blocks a chat turn that only needs an OpenAI client.
+OPENAI_CLIENTS_LOCK = threading.Lock()
+
+
+def _openai_client_fingerprint(kind, endpoint, api_version, auth_type, deployment, api_key):
+    """Hash of everything that requires a new client when it changes."""
+    key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    payload = json.dumps([kind, endpoint, api_version, auth_type, deployment, key_hash])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _build_openai_http_client(is_async=False):
+    http_client_class = openai.DefaultAsyncHttpxClient if is_async else openai.DefaultHttpxClient
+    return http_client_class(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_SECONDS
+        ),
+        timeout=OPENAI_REQUEST_TIMEOUT_SECONDS
+    )
+
+
+def get_openai_client(kind, endpoint, api_version, auth_type="key", api_key=None, deployment=None, is_async=False):
+    """
+    Return a long-lived AzureOpenAI client for the given configuration.
+
+    Clients are stored in CLIENTS["openai_clients"] by kind (e.g. "gpt",
+    "embedding") together with a fingerprint of their configuration. The
+    client, its connection pool and its token provider are only rebuilt
+    when the fingerprint changes, i.e. when an admin changes the settings.
+
+    With is_async=True an AsyncAzureOpenAI client is returned instead, kept
+    in CLIENTS["async_openai_clients"]. Its connection pool belongs to the
+    event loop it is first used on, so only call it from the worker's loop.
+    """
+    fingerprint = _openai_client_fingerprint(kind, endpoint, api_version, auth_type, deployment, api_key)
+    registry_key = "async_openai_clients" if is_async else "openai_clients"
+
+    registry = CLIENTS.get(registry_key) or {}
+    entry = registry.get(kind)
+    if entry and entry["fingerprint"] == fingerprint:
+        return entry["client"]
+
+    with OPENAI_CLIENTS_LOCK:
+        registry = CLIENTS.setdefault(registry_key, {})
+        entry = registry.get(kind)
+        if entry and entry["fingerprint"] == fingerprint:
+            return entry["client"]
+
+        client_class = AsyncAzureOpenAI if is_async else AzureOpenAI
+        if auth_type == "managed_identity":
+            token_provider = get_bearer_token_provider(get_shared_credential(), COGNITIVE_SERVICES_SCOPE)
+            client = client_class(
+                api_version=api_version,
+                azure_endpoint=endpoint,
+                azure_ad_token_provider=token_provider,
+                http_client=_build_openai_http_client(is_async)
+            )
+        else:
+            client = client_class(
+                api_version=api_version,
+                azure_endpoint=endpoint,
+                api_key=api_key,
+                http_client=_build_openai_http_client(is_async)
+            )
+
+        # Old clients are not closed here: a streaming response may still be
+        # reading from them. They are released once the last reference goes.
+        registry[kind] = {"fingerprint": fingerprint, "client": client}
+        print(f"Created {'async ' if is_async else ''}Azure OpenAI client for '{kind}'")
+        return client
+
+
+def _selected_deployment(settings, model_key):
+    model_obj = settings.get(model_key, {})
+    if model_obj and model_obj.get('selected'):
+        return model_obj['selected'][0]['deploymentName']
+    return None
+
+
+def _get_service_client(settings, service, is_async=False):
+    """
+    Shared lookup for the gpt / embedding / image_gen settings blocks.
+    Returns (client, deployment_name).
+    """
+    if settings.get(f'enable_{service}_apim', False):
+        deployment = settings.get(f'azure_apim_{service}_deployment')
+        client = get_openai_client(
+            service,
+            endpoint=settings.get(f'azure_apim_{service}_endpoint'),
+            api_version=settings.get(f'azure_apim_{service}_api_version'),
+            api_key=settings.get(f'azure_apim_{service}_subscription_key'),
+            deployment=deployment,
+            is_async=is_async
+        )
+        return client, deployment
+
+    deployment = _selected_deployment(settings, f'{service}_model')
+    auth_type = settings.get(f'azure_openai_{service}_authentication_type')
+    client = get_openai_client(
+        service,
+        endpoint=settings.get(f'azure_openai_{service}_endpoint'),
+        api_version=settings.get(f'azure_openai_{service}_api_version'),
+        auth_type=auth_type,
+        api_key=None if auth_type == 'managed_identity' else settings.get(f'azure_openai_{service}_key'),
+        deployment=deployment,
+        is_async=is_async
+    )
+    return client, deployment
+
+
+def get_gpt_client(settings):
+    """Return (client, deployment_name) for chat completions."""
+    return _get_service_client(settings, 'gpt')
+
+
+def get_async_gpt_client(settings):
+    """Return (AsyncAzureOpenAI client, deployment_name) for the async chat stream."""
+    return _get_service_client(settings, 'gpt', is_async=True)
+
+
+def get_embedding_client(settings):
+    """Return (client, deployment_name) for embeddings."""
+    return _get_service_client(settings, 'embedding')
+
+
+def get_image_gen_client(settings):
+    """Return (client, deployment_name) for image generation."""
+    return _get_service_client(settings, 'image_gen')
@@ -0,0 +1,132 @@
+# functions_rate_limit.py
+#
+# Client-side rate limiting for Azure OpenAI deployments. Has no dependency
+# on config.py; the quotas are passed in by the caller.
+
+import threading
+import time
+
+
+def retry_after_seconds(headers, default=1.0):
+    """
+    Wait time requested by a 429 response, from retry-after-ms or
+    retry-after (seconds). Falls back to default when neither is usable.
+    """
+    if not headers:
+        return default
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except (TypeError, ValueError):
+            continue
+    return default
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket for a deployment's tokens-per-minute (TPM) and
+    requests-per-minute (RPM) quota.
+
+    Only `share` of the quota is handed out; the rest is left for other
+    traffic on the same deployment (e.g. query embeddings during chat).
+    The buckets are also corrected from what Azure reports: the
+    x-ratelimit-remaining-* headers of every response, and 429s, which
+    pause all callers for Retry-After and halve the refill rate until
+    requests succeed again.
+    """
+
+    MIN_RATE_FACTOR = 0.1
+
+    def __init__(self, tokens_per_minute, requests_per_minute, share=1.0):
+        self._tpm = float(tokens_per_minute)
+        self._rpm = float(requests_per_minute)
+        self._share = share
+        self._token_capacity = self._tpm * share
+        self._request_capacity = self._rpm * share
+        self._tokens = self._token_capacity
+        self._requests = self._request_capacity
+        self._rate_factor = 1.0
+        self._paused_until = 0.0
+        self._updated_at = time.monotonic()
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        if now <= self._updated_at:
+            return
+        elapsed_minutes = (now - self._updated_at) / 60.0
+        self._updated_at = now
+        self._tokens = min(self._token_capacity, self._tokens + elapsed_minutes * self._token_capacity * self._rate_factor)
+        self._requests = min(self._request_capacity, self._requests + elapsed_minutes * self._request_capacity * self._rate_factor)
+
+    def _wait_seconds(self, tokens):
+        """Time until the request fits, or 0 if it can go now. Call with the lock held."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        token_rate = self._token_capacity * self._rate_factor / 60.0
+        request_rate = self._request_capacity * self._rate_factor / 60.0
+        return max(
+            (tokens - self._tokens) / token_rate if self._tokens < tokens else 0.0,
+            (1 - self._requests) / request_rate if self._requests < 1 else 0.0
+        )
+
+    def acquire(self, tokens):
+        """Block until one request of about `tokens` tokens may be sent."""
+        # A request larger than the whole bucket waits for a full bucket
+        tokens = min(tokens, self._token_capacity)
+        with self._condition:
+            while True:
+                wait_seconds = self._wait_seconds(tokens)
+                if wait_seconds <= 0:
+                    self._tokens -= tokens
+                    self._requests -= 1
+                    return
+                self._condition.wait(timeout=wait_seconds)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Settle the difference between the estimate taken in acquire() and the real usage."""
+        if actual_tokens is None:
+            return
+        with self._condition:
+            self._tokens = min(self._token_capacity, self._tokens + estimated_tokens - actual_tokens)
+            self._condition.notify_all()
+
+    def record_response(self, headers):
+        """Adopt Azure's view of the remaining quota and recover from earlier 429s."""
+        with self._condition:
+            self._rate_factor = min(1.0, self._rate_factor * 1.25)
+            if not headers:
+                return
+            # Azure counts all callers of the deployment; keep our reserve out of it
+            for header, capacity, attribute in (
+                ("x-ratelimit-remaining-tokens", self._tpm, "_tokens"),
+                ("x-ratelimit-remaining-requests", self._rpm, "_requests"),
+            ):
+                value = headers.get(header)
+                if value is None:
+                    continue
+                try:
+                    available = float(value) - capacity * (1 - self._share)
+                except (TypeError, ValueError):
+                    continue
+                setattr(self, attribute, min(getattr(self, attribute), available))
+
+    def record_rate_limited(self, retry_after):
+        """A request got a 429: pause everyone for retry_after seconds and slow down."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._rate_factor = max(self.MIN_RATE_FACTOR, self._rate_factor / 2)
+            # Start refilling from empty once the pause is over
+            self._tokens = min(self._tokens, 0.0)
+            self._requests = min(self._requests, 0.0)
+            self._updated_at = max(self._updated_at, self._paused_until)
+            self._condition.notify_all()
+
+    def pause_seconds(self):
+        """Seconds left of the current 429 pause (0 if none)."""
+        with self._condition:
+            return max(0.0, self._paused_until - time.monotonic())
@@ -5,6 +5,71 @@ from functions_content import *
 from functions_documents import *
 from functions_content import generate_embedding
 from functions_content import *
+from functions_metrics import *
+from functions_embedding_cache import embedding_cache_key
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache with expiry for query embeddings, shared by all requests in a
+    worker. Concurrent lookups of the same missing key are coalesced: one
+    caller computes the vector while the others wait for its result.
+    """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    EMBEDDING_CACHE_LOOKUPS.labels(tier='query', result='hit').inc()
+                    return value
+                del self._entries[key]
+            call = self._in_flight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._in_flight[key] = {"done": threading.Event(), "value": None}
+
+        if not is_leader:
+            EMBEDDING_CACHE_LOOKUPS.labels(tier='query', result='coalesced').inc()
+            call["done"].wait()
+            return call["value"]
+
+        EMBEDDING_CACHE_LOOKUPS.labels(tier='query', result='miss').inc()
+        value = None
+        try:
+            value = compute()
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                # Failures (None) are not cached; the next request tries again
+                if value is not None:
+                    self._entries[key] = (time.monotonic() + self._ttl_seconds, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self._max_entries:
+                        self._entries.popitem(last=False)
+            call["value"] = value
+            call["done"].set()
+        return value
+
+
+QUERY_EMBEDDING_CACHE = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_MAX_ENTRIES, QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+
+
+def get_query_embedding(query):
+    """Embedding of a search query, from QUERY_EMBEDDING_CACHE when possible."""
+    settings = get_settings()
+    _, embedding_model = get_embedding_client(settings)
+    key = embedding_cache_key(query, embedding_model_id(settings, embedding_model))
+    return QUERY_EMBEDDING_CACHE.get_or_compute(key, lambda: generate_embedding(query))
 
 
 # Update this function in functions_search.py
@@ -31,7 +96,8 @@ def hybrid_search(query, user_id, document_id=None, top_n=3, doc_scope="all", ac
             if doc_group_id:
                 print(f"Document belongs to group_id: {doc_group_id}")
                 
-        query_embedding = generate_embedding(query)
+        with time_stage('query_embedding'):
+            query_embedding = get_query_embedding(query)
         if query_embedding is None:
             print("Warning: Failed to generate embedding for query")
             return []
@@ -65,26 +131,28 @@ def hybrid_search(query, user_id, document_id=None, top_n=3, doc_scope="all", ac
                 # Only search personal docs if we're not specifically looking for a group document
                 if not (document_id and doc_group_id):
                     user_filter = f"user_id eq '{user_id}'{doc_filter}"
-                    user_results = search_client_user.search(
-                        search_text=query,
-                        vector_queries=[vector_query],
-                        filter=user_filter,
-                        select=user_select_fields
-                    )
-                    user_results_final = extract_search_results(user_results, top_n)
+                    with time_stage('search_user', 'search'):
+                        user_results = search_client_user.search(
+                            search_text=query,
+                            vector_queries=[vector_query],
+                            filter=user_filter,
+                            select=user_select_fields
+                        )
+                        user_results_final = extract_search_results(user_results, top_n)
                     results.extend(user_results_final)
             
             # Then search for default documents (they're also in user search index)
             # Only search default docs if we're not specifically looking for a group document
             if not (document_id and doc_group_id):
                 default_filter = f"is_default eq true{doc_filter}"
-                default_results = search_client_user.search(
-                    search_text=query,
-                    vector_queries=[vector_query],
-                    filter=default_filter,
-                    select=user_select_fields
-                )
-                default_results_final = extract_search_results(default_results, top_n)
+                with time_stage('search_default', 'search'):
+                    default_results = search_client_user.search(
+                        search_text=query,
+                        vector_queries=[vector_query],
+                        filter=default_filter,
+                        select=user_select_fields
+                    )
+                    default_results_final = extract_search_results(default_results, top_n)
                 results.extend(default_results_final)
         
         if doc_scope == "all" or doc_scope == "group":
@@ -93,13 +161,14 @@ def hybrid_search(query, user_id, document_id=None, top_n=3, doc_scope="all", ac
                 group_filter = f"group_id eq '{doc_group_id}' and document_id eq '{document_id}'"
                 print(f"Searching with filter: {group_filter}")
                 
-                group_results = search_client_group.search(
-                    search_text=query,
-                    vector_queries=[vector_query],
-                    filter=group_filter,
-                    select=group_select_fields
-                )
-                group_results_final = extract_search_results(group_results, top_n)
+                with time_stage('search_group', 'search'):
+                    group_results = search_client_group.search(
+                        search_text=query,
+                        vector_queries=[vector_query],
+                        filter=group_filter,
+                        select=group_select_fields
+                    )
+                    group_results_final = extract_search_results(group_results, top_n)
                 results.extend(group_results_final)
                 
             # Otherwise, search in the active group if available
@@ -108,13 +177,14 @@ def hybrid_search(query, user_id, document_id=None, top_n=3, doc_scope="all", ac
                 if document_id:
                     group_filter += f" and document_id eq '{document_id}'"
                     
-                group_results = search_client_group.search(
-                    search_text=query,
-                    vector_queries=[vector_query],
-                    filter=group_filter,
-                    select=group_select_fields
-                )
-                group_results_final = extract_search_results(group_results, top_n)
+                with time_stage('search_group', 'search'):
+                    group_results = search_client_group.search(
+                        search_text=query,
+                        vector_queries=[vector_query],
+                        filter=group_filter,
+                        select=group_select_fields
+                    )
+                    group_results_final = extract_search_results(group_results, top_n)
                 results.extend(group_results_final)
         
         # Sort combined results by relevance score
@@ -0,0 +1,117 @@
+# functions_session.py
+#
+# Server-side session storage. Imported by config.py, so it must not import
+# config itself.
+#
+#   SESSION_BACKEND=redis       shared across workers and instances (SESSION_REDIS_URL,
+#                               any Redis-protocol server, e.g. a local one in tests)
+#   SESSION_BACKEND=memory      in-process LRU; sessions live in one process only, so
+#                               use it with a single worker or sticky routing
+#   SESSION_BACKEND=filesystem  the previous local-disk store
+#
+# Defaults to redis when SESSION_REDIS_URL is set, otherwise filesystem.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask_session import Session
+
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL")
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "redis" if SESSION_REDIS_URL else "filesystem").lower()
+SESSION_MEMORY_MAX_ENTRIES = int(os.getenv("SESSION_MEMORY_MAX_ENTRIES", "10000"))
+
+# The only ID token claims the app reads (user id, with sub as its fallback,
+# display name, e-mail, app roles). Everything else MSAL returns is left out of the session.
+SESSION_USER_CLAIMS = ("oid", "sub", "tid", "name", "preferred_username", "email", "roles")
+
+
+class LRUSessionCache:
+    """
+    In-process session store implementing the cachelib interface
+    (get/set/delete/has) that Flask-Session's cachelib backend uses.
+
+    Values are stored and returned as given: no second serialization on
+    top of what Flask-Session hands over. Flask-Session builds a new
+    session object from the returned data on every request, and the app
+    only assigns top-level session keys, so requests do not share changes.
+    The store is bounded: once max_entries is reached the least recently
+    used session is evicted.
+    """
+
+    def __init__(self, max_entries=SESSION_MEMORY_MAX_ENTRIES, default_timeout=300):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self._default_timeout = default_timeout
+
+    def _expires_at(self, timeout):
+        if timeout is None:
+            timeout = self._default_timeout
+        # cachelib convention: a timeout of 0 never expires
+        return time.monotonic() + timeout if timeout > 0 else None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._entries[key] = (self._expires_at(timeout), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return True
+
+
+def compact_user_claims(id_token_claims):
+    """The subset of the ID token claims that is kept in the session."""
+    claims = id_token_claims or {}
+    return {claim: claims[claim] for claim in SESSION_USER_CLAIMS if claim in claims}
+
+
+def configure_session(app):
+    """Configure Flask-Session for SESSION_BACKEND and attach it to the app."""
+    # Only write a session back when the request changed it (i.e. at login
+    # and logout), instead of re-saving it on every request.
+    app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+    app.config['SESSION_SERIALIZATION_FORMAT'] = 'msgpack'
+
+    if SESSION_BACKEND == "memory":
+        app.config['SESSION_TYPE'] = 'cachelib'
+        app.config['SESSION_CACHELIB'] = LRUSessionCache()
+    elif SESSION_BACKEND == "redis":
+        import redis
+
+        if not SESSION_REDIS_URL:
+            raise ValueError("SESSION_BACKEND=redis requires SESSION_REDIS_URL")
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.from_url(SESSION_REDIS_URL)
+    elif SESSION_BACKEND == "filesystem":
+        app.config['SESSION_TYPE'] = 'filesystem'
+    else:
+        raise ValueError(f"Unsupported SESSION_BACKEND: {SESSION_BACKEND}")
+
+    Session(app)
+    print(f"Session backend: {SESSION_BACKEND}")
@@ -3,15 +3,116 @@
 from config import *
 from functions_authentication import *
 
+import copy
+
+# Per-worker snapshot of the app_settings document. get_settings() hands out
+# copies of this, so callers are free to mutate what they get back.
+_settings_cache = {
+    "snapshot": None,
+    "etag": None,
+    "checked_at": 0.0,
+    "version_stamp": None
+}
+_settings_cache_lock = threading.Lock()
+
+
+def _read_settings_version_stamp():
+    try:
+        return os.stat(SETTINGS_VERSION_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _bump_settings_version_stamp():
+    """Touch the shared version file so other workers on this host refresh immediately."""
+    try:
+        with open(SETTINGS_VERSION_FILE, 'a'):
+            pass
+        os.utime(SETTINGS_VERSION_FILE, None)
+    except OSError as e:
+        print(f"Could not update settings version file: {str(e)}")
+
+
+def _store_settings_snapshot(settings_item, version_stamp):
+    _settings_cache["snapshot"] = settings_item
+    _settings_cache["etag"] = settings_item.get('_etag')
+    _settings_cache["checked_at"] = time.monotonic()
+    _settings_cache["version_stamp"] = version_stamp
+
+
+def _get_settings_snapshot():
+    """
+    Return the cached settings snapshot, revalidating it when the TTL expired
+    or another worker bumped the version file. Revalidation is a conditional
+    read (If-None-Match on the cached ETag), so an unchanged document costs
+    an empty 304 instead of the full item.
+    """
+    version_stamp = _read_settings_version_stamp()
+    if (_settings_cache["snapshot"] is not None
+            and _settings_cache["version_stamp"] == version_stamp
+            and time.monotonic() - _settings_cache["checked_at"] < SETTINGS_CACHE_TTL_SECONDS):
+        return _settings_cache["snapshot"]
+
+    with _settings_cache_lock:
+        # Another thread may have refreshed while we waited for the lock
+        if (_settings_cache["snapshot"] is not None
+                and _settings_cache["version_stamp"] == version_stamp
+                and time.monotonic() - _settings_cache["checked_at"] < SETTINGS_CACHE_TTL_SECONDS):
+            return _settings_cache["snapshot"]
+
+        try:
+            if _settings_cache["snapshot"] is not None and _settings_cache["etag"]:
+                settings_item = settings_container.read_item(
+                    item="app_settings",
+                    partition_key="app_settings",
+                    etag=_settings_cache["etag"],
+                    match_condition=MatchConditions.IfModified
+                )
+                if not settings_item:
+                    # 304 Not Modified - keep the snapshot we already have
+                    _settings_cache["checked_at"] = time.monotonic()
+                    _settings_cache["version_stamp"] = version_stamp
+                    return _settings_cache["snapshot"]
+            else:
+                settings_item = settings_container.read_item(
+                    item="app_settings",
+                    partition_key="app_settings"
+                )
+            print("Successfully retrieved settings.")
+            _store_settings_snapshot(settings_item, version_stamp)
+            return settings_item
+        except CosmosResourceNotFoundError:
+            default_settings = _create_default_settings()
+            _store_settings_snapshot(default_settings, version_stamp)
+            return default_settings
+        except Exception as e:
+            print(f"Error retrieving settings: {str(e)}")
+            # Serve the last known settings rather than failing the request
+            return _settings_cache["snapshot"]
+
+
 def get_settings():
+    """
+    Return the app settings as a dict.
+
+    Settings are served from a per-worker snapshot instead of a Cosmos read
+    per call. Within a request every call returns the same copy, so one
+    request sees one consistent version of the settings.
+    """
+    if has_request_context():
+        settings = g.get('_app_settings')
+        if settings is None:
+            snapshot = _get_settings_snapshot()
+            settings = copy.deepcopy(snapshot) if snapshot is not None else None
+            g._app_settings = settings
+        return settings
+
+    snapshot = _get_settings_snapshot()
+    return copy.deepcopy(snapshot) if snapshot is not None else None
+
+
+def _create_default_settings():
     try:
-        settings_item = settings_container.read_item(
-            item="app_settings",
-            partition_key="app_settings"
-        )
-        print("Successfully retrieved settings.")
-        return settings_item
-    except CosmosResourceNotFoundError:
         default_settings = {
             'id': 'app_settings',
 
@@ -117,19 +218,25 @@ def get_settings():
             'default_system_prompt': ''
         }
 
-        settings_container.create_item(body=default_settings)
+        default_settings = settings_container.create_item(body=default_settings)
         print("Default settings created and returned.")
         return default_settings
-    except Exception as e:
-        print(f"Error retrieving settings: {str(e)}")
-        return None
+    except CosmosResourceExistsError:
+        # Another worker created the defaults first
+        return settings_container.read_item(
+            item="app_settings",
+            partition_key="app_settings"
+        )
 
 
 def update_settings(new_settings):
     try:
         settings_item = get_settings()
         settings_item.update(new_settings)
-        settings_container.upsert_item(settings_item)
+        saved_item = settings_container.upsert_item(settings_item)
+        _bump_settings_version_stamp()
+        with _settings_cache_lock:
+            _store_settings_snapshot(saved_item, _read_settings_version_stamp())
         print("Settings updated successfully.")
         return True
     except Exception as e:
@@ -0,0 +1,85 @@
+# functions_startup.py
+#
+# Startup instrumentation. Deliberately has no dependency on config.py: it is
+# imported first by app.py so it can time everything config.py pulls in.
+
+import builtins
+import os
+import sys
+import time
+
+SIMPLECHAT_IMPORT_PROFILE = os.getenv("SIMPLECHAT_IMPORT_PROFILE", "false").lower() == "true"
+SIMPLECHAT_IMPORT_PROFILE_TOP = int(os.getenv("SIMPLECHAT_IMPORT_PROFILE_TOP", "25"))
+
+_profile = {
+    "started_at": None,
+    "original_import": None,
+    "depth": 0,
+    "records": []
+}
+
+
+def _profiled_import(name, globals=None, locals=None, fromlist=(), level=0):
+    original_import = _profile["original_import"]
+    if level or name in sys.modules:
+        return original_import(name, globals, locals, fromlist, level)
+
+    depth = _profile["depth"]
+    _profile["depth"] = depth + 1
+    start = time.perf_counter()
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        _profile["depth"] = depth
+        _profile["records"].append((name, time.perf_counter() - start, depth))
+
+
+def start_import_profiling():
+    """
+    Start the startup clock. With SIMPLECHAT_IMPORT_PROFILE=true, also time
+    every first-time import so report_startup() can list the slowest ones.
+    """
+    if _profile["started_at"] is not None:
+        return
+    _profile["started_at"] = time.perf_counter()
+    if SIMPLECHAT_IMPORT_PROFILE:
+        _profile["original_import"] = builtins.__import__
+        builtins.__import__ = _profiled_import
+
+
+def get_rss_mb():
+    """Resident set size of this process in MB (None if unavailable)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        return max_rss / (1024.0 * 1024.0) if sys.platform == "darwin" else max_rss / 1024.0
+    except (ImportError, OSError):
+        return None
+
+
+def report_startup():
+    """Print the application import time, RSS and, if profiling, the slowest imports."""
+    if _profile["started_at"] is None:
+        return
+    elapsed = time.perf_counter() - _profile["started_at"]
+    rss_mb = get_rss_mb()
+    rss_text = f"{rss_mb:.1f} MB" if rss_mb is not None else "unknown"
+    print(f"Application imported in {elapsed:.2f}s (pid {os.getpid()}, RSS {rss_text}, {len(sys.modules)} modules)")
+
+    if _profile["original_import"] is None:
+        return
+    builtins.__import__ = _profile["original_import"]
+    _profile["original_import"] = None
+
+    slowest = sorted(_profile["records"], key=lambda record: record[1], reverse=True)[:SIMPLECHAT_IMPORT_PROFILE_TOP]
+    print(f"Slowest imports (cumulative, {len(_profile['records'])} timed):")
+    for name, seconds, depth in slowest:
+        print(f"  {seconds * 1000:9.1f} ms  {'  ' * min(depth, 6)}{name}")
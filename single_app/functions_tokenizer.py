@@ -0,0 +1,132 @@
+# functions_tokenizer.py
+#
+# Token counting for chunking, embedding batching and prompt budgeting.
+# Uses the tiktoken encoding TOKENIZER_ENCODING (cl100k_base, the encoding of
+# the text-embedding-3 and ada-002 models) loaded from TIKTOKEN_CACHE_DIR; the
+# Docker image downloads it at build time so nothing is fetched at runtime.
+# Without tiktoken or its encoding file, counts fall back to an estimate of
+# 4 characters per token.
+
+from bisect import bisect_right
+
+from config import *
+
+# Characters per token assumed by the fallback estimate
+FALLBACK_CHARS_PER_TOKEN = 4
+# Tokens added per chat message for the role and message framing
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding_lock = threading.Lock()
+_encoding_state = {"loaded": False, "encoding": None}
+
+
+def get_encoding():
+    """The tiktoken encoding, or None when only the fallback estimate is available."""
+    if not _encoding_state["loaded"]:
+        with _encoding_lock:
+            if not _encoding_state["loaded"]:
+                try:
+                    import tiktoken
+                    _encoding_state["encoding"] = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    print(f"Tokenizer {TOKENIZER_ENCODING} unavailable, estimating token counts: {e}")
+                _encoding_state["loaded"] = True
+    return _encoding_state["encoding"]
+
+
+def count_tokens(text):
+    """Number of tokens in text."""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // FALLBACK_CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def token_offsets(text):
+    """Character offset at which each token of text starts."""
+    encoding = get_encoding()
+    if encoding is None:
+        return list(range(0, len(text), FALLBACK_CHARS_PER_TOKEN))
+    _, offsets = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+    return offsets
+
+
+def split_text_by_tokens(text, chunk_tokens, overlap_tokens):
+    """
+    Split text into pieces of at most chunk_tokens tokens, each starting
+    overlap_tokens before the end of the previous one. Like the character
+    chunker, a piece ends at the last sentence end, line break or space in
+    its second half when there is one. Yields (piece, token_count).
+    """
+    starts = token_offsets(text)
+    total = len(starts)
+    if total <= chunk_tokens:
+        piece = text.strip()
+        if piece:
+            yield piece, total
+        return
+
+    bounds = starts + [len(text)]
+    position = 0
+    while position < total:
+        end = min(position + chunk_tokens, total)
+        if end < total:
+            half = bounds[position + chunk_tokens // 2]
+            natural_break = text.rfind('. ', half, bounds[end])
+            if natural_break == -1:
+                natural_break = text.rfind('\n', half, bounds[end])
+            if natural_break == -1:
+                natural_break = text.rfind(' ', half, bounds[end])
+            if natural_break != -1:
+                # Last token starting at or before the break
+                break_token = bisect_right(bounds, natural_break + 1) - 1
+                if break_token > position + chunk_tokens // 2:
+                    end = break_token
+
+        piece = text[bounds[position]:bounds[end]].strip()
+        if piece:
+            yield piece, end - position
+
+        if end >= total:
+            break
+        position = max(end - overlap_tokens, position + 1)
+
+
+def count_message_tokens(message):
+    content = message.get('content')
+    if not isinstance(content, str):
+        content = json.dumps(content) if content else ""
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def fit_messages_to_token_budget(messages, budget):
+    """
+    Drop the oldest messages until the prompt fits in budget tokens. The
+    leading system prompt, the latest user message and the messages after
+    it (its search and web results, uploaded files) are always kept, so the
+    prompt may still exceed the budget when they alone do. Everything else,
+    including system messages holding the results of earlier turns, is
+    dropped oldest first.
+    """
+    if not budget or not messages:
+        return messages
+    counts = [count_message_tokens(message) for message in messages]
+    total = sum(counts)
+    if total <= budget:
+        return messages
+
+    first = 1 if messages[0].get('role') == 'system' else 0
+    last_user = max(
+        (idx for idx, message in enumerate(messages) if message.get('role') == 'user'), default=len(messages)
+    )
+    dropped = set()
+    for idx in range(first, last_user):
+        if total <= budget:
+            break
+        dropped.add(idx)
+        total -= counts[idx]
+    if dropped:
+        print(f"Dropped {len(dropped)} oldest messages to fit the {budget} token prompt budget ({total} tokens)")
+    return [message for idx, message in enumerate(messages) if idx not in dropped]
@@ -0,0 +1,93 @@
+# gunicorn.conf.py
+#
+# Production serving profile. Loaded automatically by "gunicorn" when
+# started from this directory (see Dockerfile).
+
+import os
+import shutil
+import signal
+import tempfile
+
+def _available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Prometheus metrics are aggregated across workers through a shared directory.
+# It has to be set before prometheus_client is imported by the preloaded app.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "simplechat_prometheus"))
+shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# SIMPLECHAT_ASGI=true serves asgi:application on uvicorn workers: streaming
+# /api/chat runs on the event loop (no thread per open stream) and the rest
+# of the Flask app runs on ASGI_WSGI_THREADS threads per worker.
+SIMPLECHAT_ASGI = os.getenv("SIMPLECHAT_ASGI", "false").lower() == "true"
+wsgi_app = "asgi:application" if SIMPLECHAT_ASGI else "app:app"
+
+# gthread workers: each worker serves GUNICORN_THREADS requests concurrently,
+# which suits the I/O bound Azure calls and keeps long SSE streams from
+# starving the rest of the worker.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn.workers.UvicornWorker" if SIMPLECHAT_ASGI else "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", str(_available_cores() * 2 + 1)))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+if os.getenv("SESSION_BACKEND", "").lower() == "memory" and workers > 1:
+    print("WARNING: SESSION_BACKEND=memory keeps sessions per worker; "
+          "use SESSION_BACKEND=redis or GUNICORN_WORKERS=1")
+
+# Import the app once in the master so workers fork with modules already loaded.
+preload_app = True
+
+# /api/chat streams can run for minutes. With gthread the worker heartbeat
+# is independent of request duration, so timeout only catches hung workers;
+# graceful_timeout bounds how long in-flight streams may drain on SIGTERM.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "120"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    import config
+    config.reset_clients_after_fork()
+
+
+def post_worker_init(worker):
+    # gunicorn already drains on SIGTERM; additionally flip /readyz to 503
+    # so the load balancer stops routing new requests to this worker.
+    # Uvicorn workers install their own SIGTERM handler when they start
+    # serving; asgi.py sets the flag on lifespan shutdown instead.
+    if SIMPLECHAT_ASGI:
+        return
+    import config
+    gunicorn_handler = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        config.CLIENTS_STATE["draining"] = True
+        if callable(gunicorn_handler):
+            gunicorn_handler(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    from functions_credentials import get_shared_credential
+    try:
+        get_shared_credential().close()
+    except Exception as e:
+        print(f"Error closing shared credential: {e}")
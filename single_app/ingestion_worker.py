@@ -0,0 +1,45 @@
+# ingestion_worker.py
+#
+# Standalone ingestion worker for INGESTION_MODE=queue. Runs the jobs that
+# the web workers enqueue, so extraction and embedding never compete with
+# chat requests for the web workers' threads. Needs a job store shared with
+# the web app (INGESTION_JOB_STORE=sqlite on the same host, or cosmos).
+#
+#   python ingestion_worker.py [--workers N]
+
+import argparse
+import signal
+
+# Importing the app registers the ingestion handlers of every upload path
+from app import ensure_clients_initialized
+from config import *
+from functions_ingestion_jobs import *
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run SimpleChat document ingestion jobs")
+    parser.add_argument("--workers", type=int, default=INGESTION_WORKERS, help="worker threads")
+    args = parser.parse_args()
+
+    if INGESTION_JOB_STORE == "memory":
+        raise SystemExit("INGESTION_JOB_STORE=memory cannot be shared with the web app")
+
+    while not ensure_clients_initialized():
+        time.sleep(INGESTION_POLL_INTERVAL_SECONDS)
+
+    stopped = threading.Event()
+
+    def handle_signal(signum, frame):
+        print("Stopping ingestion workers...")
+        stop_ingestion_workers()
+        stopped.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    start_ingestion_workers(args.workers)
+    stopped.wait()
+
+
+if __name__ == "__main__":
+    main()
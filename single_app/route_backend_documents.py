@@ -93,6 +93,11 @@ def register_route_backend_documents(app):
                 return jsonify({'error': f'Unsupported file type: {file_ext}'}), 400
             
             try:
+                if ingestion_is_async():
+                    # Extraction, embedding and indexing run on an ingestion worker
+                    job = enqueue_user_document(file, user_id)
+                    return accepted_job_response(job, 'Document uploaded and queued for processing')
+
                 # Use the process_file_with_blob_storage function
                 document_id = process_file_with_blob_storage(file, user_id)
                 
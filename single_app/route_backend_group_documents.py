@@ -83,6 +83,9 @@ def register_route_backend_group_documents(app):
             return jsonify({'error': 'No selected file'}), 400
 
         try:
+            if ingestion_is_async():
+                job = enqueue_group_document(file, active_group_id, user_id)
+                return accepted_job_response(job, 'Document uploaded and queued for processing')
             document_id = process_group_document_upload(file, active_group_id, user_id)
             return jsonify({'message': 'Document uploaded successfully', 'document_id': document_id}), 200
         except Exception as e:
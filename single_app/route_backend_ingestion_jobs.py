@@ -0,0 +1,23 @@
+# route_backend_ingestion_jobs.py
+
+from config import *
+from functions_authentication import *
+from functions_ingestion_jobs import *
+
+
+def register_route_backend_ingestion_jobs(app):
+    @app.route('/api/ingestion/jobs/<job_id>', methods=['GET'])
+    @login_required
+    @user_required
+    def get_ingestion_job_status(job_id):
+        """Stage, progress and outcome of a document ingestion job."""
+        user_id = get_current_user_id()
+        if not user_id:
+            return jsonify({'error': 'User not authenticated'}), 401
+
+        job = get_ingestion_job(job_id)
+        # Only the uploader sees a job; don't reveal whether other ids exist
+        if not job or job.get('submitted_by') != user_id:
+            return jsonify({'error': 'Job not found'}), 404
+
+        return jsonify(public_job_view(job)), 200
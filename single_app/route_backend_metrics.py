@@ -0,0 +1,19 @@
+# route_backend_metrics.py
+
+from config import *
+from functions_metrics import *
+
+
+def register_route_backend_metrics(app):
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """
+        Prometheus scrape endpoint. When METRICS_AUTH_TOKEN is set the scraper
+        must send it as a bearer token.
+        """
+        expected_token = os.getenv("METRICS_AUTH_TOKEN")
+        if expected_token and request.headers.get("Authorization") != f"Bearer {expected_token}":
+            return jsonify({"error": "Unauthorized"}), 401
+
+        body, content_type = render_metrics()
+        return Response(body, mimetype=content_type.split(";")[0], headers={"Content-Type": content_type})
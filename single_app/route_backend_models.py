@@ -17,6 +17,8 @@ def register_route_backend_models(app):
         """
         Fetch GPT-like deployments using Azure Mgmt library.
         """
+        from azure.mgmt.cognitiveservices import CognitiveServicesManagementClient
+
         settings = get_settings()
 
         subscription_id = settings.get('azure_openai_gpt_subscription_id', '')
@@ -76,6 +78,8 @@ def register_route_backend_models(app):
         """
         Fetch Embedding-like deployments using Azure Mgmt library.
         """
+        from azure.mgmt.cognitiveservices import CognitiveServicesManagementClient
+
         settings = get_settings()
 
         subscription_id = settings.get('azure_openai_embedding_subscription_id', '')
@@ -132,6 +136,8 @@ def register_route_backend_models(app):
         """
         Fetch DALL-E-like image-generation deployments using Azure Mgmt library.
         """
+        from azure.mgmt.cognitiveservices import CognitiveServicesManagementClient
+
         settings = get_settings()
 
         subscription_id = settings.get('azure_openai_image_gen_subscription_id', '')
@@ -84,7 +84,7 @@ def _test_gpt_connection(payload):
         gpt_model = selected_model.get('deploymentName')
 
         if direct_data.get('auth_type') == 'managed_identity':
-            token_provider = get_bearer_token_provider(DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default")
+            token_provider = get_bearer_token_provider(get_shared_credential(), "https://cognitiveservices.azure.com/.default")
             
             gpt_client = AzureOpenAI(
                 api_version=api_version,
@@ -137,7 +137,7 @@ def _test_embedding_connection(payload):
         embedding_model = selected_model.get('deploymentName')
 
         if direct_data.get('auth_type') == 'managed_identity':
-            token_provider = get_bearer_token_provider(DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default")
+            token_provider = get_bearer_token_provider(get_shared_credential(), "https://cognitiveservices.azure.com/.default")
             
             embedding_client = AzureOpenAI(
                 api_version=api_version,
@@ -190,7 +190,7 @@ def _test_image_gen_connection(payload):
         image_gen_model = selected_model.get('deploymentName')
 
         if direct_data.get('auth_type') == 'managed_identity':
-            token_provider = get_bearer_token_provider(DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default")
+            token_provider = get_bearer_token_provider(get_shared_credential(), "https://cognitiveservices.azure.com/.default")
             
             image_gen_client = AzureOpenAI(
                 api_version=api_version,
@@ -220,6 +220,9 @@ def _test_image_gen_connection(payload):
 
 def _test_safety_connection(payload):
     """Attempt to connect to a content safety endpoint using ephemeral settings."""
+    from azure.ai.contentsafety import ContentSafetyClient
+    from azure.ai.contentsafety.models import AnalyzeTextOptions
+
     enabled = payload.get('enabled', False)
     if not enabled:
         # If the user toggled content safety off, just return success
@@ -245,7 +248,7 @@ def _test_safety_connection(payload):
             
             content_safety_client = ContentSafetyClient(
                 endpoint=endpoint,
-                credential=DefaultAzureCredential()
+                credential=get_shared_credential()
             )
         else:
             content_safety_client = ContentSafetyClient(
@@ -301,6 +304,8 @@ def _test_web_search_connection(payload):
 
 def _test_azure_ai_search_connection(payload):
     """Attempt to connect to Azure Cognitive Search (or APIM-wrapped)."""
+    from azure.ai.contentsafety import ContentSafetyClient
+
     enable_apim = payload.get('enable_apim', False)
 
     if enable_apim:
@@ -321,7 +326,7 @@ def _test_azure_ai_search_connection(payload):
             
             content_safety_client = ContentSafetyClient(
                 endpoint=endpoint,
-                credential=DefaultAzureCredential()
+                credential=get_shared_credential()
             )
         else:
             content_safety_client = ContentSafetyClient(
@@ -360,6 +365,8 @@ def _test_azure_ai_search_connection(payload):
 
 def _test_azure_doc_intelligence_connection(payload):
     """Attempt to connect to Azure Form Recognizer / Document Intelligence."""
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+
     enable_apim = payload.get('enable_apim', False)
 
     enable_apim = payload.get('enable_apim', False)
@@ -382,7 +389,7 @@ def _test_azure_doc_intelligence_connection(payload):
             
             document_intelligence_client = DocumentAnalysisClient(
                 endpoint=endpoint,
-                credential=DefaultAzureCredential()
+                credential=get_shared_credential()
             )
         else:
             document_intelligence_client = DocumentAnalysisClient(
@@ -4,6 +4,7 @@ from config import *
 from functions_documents import *
 from functions_authentication import *
 from functions_settings import *
+from functions_openai import *
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -32,8 +33,9 @@ def register_route_frontend_admin_settings(app):
                 gpt_api_version = settings.get("azure_openai_gpt_api_version", "2023-12-01-preview").strip()
                 gpt_key = settings.get("azure_openai_gpt_key", "").strip()
                 if gpt_endpoint:
-                    client_gpt = AzureOpenAI(
-                        azure_endpoint=gpt_endpoint.rstrip("/"),
+                    client_gpt = get_openai_client(
+                        'gpt_deployments',
+                        endpoint=gpt_endpoint.rstrip("/"),
                         api_version=gpt_api_version,
                         api_key=gpt_key
                     )
@@ -49,8 +51,9 @@ def register_route_frontend_admin_settings(app):
                 embed_api_version = settings.get("azure_openai_embedding_api_version", "2023-12-01-preview").strip()
                 embed_key = settings.get("azure_openai_embedding_key", "").strip()
                 if embed_endpoint:
-                    client_embeddings = AzureOpenAI(
-                        azure_endpoint=embed_endpoint.rstrip("/"),
+                    client_embeddings = get_openai_client(
+                        'embedding_deployments',
+                        endpoint=embed_endpoint.rstrip("/"),
                         api_version=embed_api_version,
                         api_key=embed_key
                     )
@@ -68,8 +71,9 @@ def register_route_frontend_admin_settings(app):
                     image_api_version = settings.get("azure_openai_image_gen_api_version", "2023-12-01-preview").strip()
                     image_key = settings.get("azure_openai_image_gen_key", "").strip()
                     if image_endpoint:
-                        client_image = AzureOpenAI(
-                            azure_endpoint=image_endpoint.rstrip("/"),
+                        client_image = get_openai_client(
+                            'image_gen_deployments',
+                            endpoint=image_endpoint.rstrip("/"),
                             api_version=image_api_version,
                             api_key=image_key
                         )
@@ -33,7 +33,7 @@ def register_route_frontend_authentication(app):
             error_description = result.get("error_description", result.get("error"))
             print(f"Login failure: {error_description}")
             return f"Login failure: {error_description}", 500
-        session["user"] = result.get("id_token_claims")
+        session["user"] = compact_user_claims(result.get("id_token_claims"))
         session["access_token"] = result.get("access_token")
         print("User logged in successfully.")
         return redirect(url_for('index'))
@@ -0,0 +1,47 @@
+// js/ingestion_jobs.js
+// Uploads answer 202 with a job id while the document is processed in the
+// background. waitForIngestionJob polls the job until it finishes; for a
+// synchronous upload response (no job_id) it resolves right away. The
+// promise rejects if processing fails.
+
+const INGESTION_POLL_INTERVAL_MS = 2000;
+
+function waitForIngestionJob(data, onProgress) {
+  if (!data || !data.job_id) {
+    return Promise.resolve(data);
+  }
+  const statusUrl = data.status_url || `/api/ingestion/jobs/${data.job_id}`;
+
+  return new Promise((resolve, reject) => {
+    function poll() {
+      fetch(statusUrl)
+        .then((res) => {
+          if (!res.ok) throw new Error(`Could not check upload status (${res.status})`);
+          return res.json();
+        })
+        .then((job) => {
+          if (job.status === "succeeded") {
+            // Same shape as a synchronous upload response
+            resolve(Object.assign({}, job, { message: "Document uploaded and processed successfully" }));
+            return;
+          }
+          if (job.status === "failed") {
+            reject(new Error(job.error || "Document processing failed"));
+            return;
+          }
+          if (onProgress) onProgress(job);
+          setTimeout(poll, INGESTION_POLL_INTERVAL_MS);
+        })
+        .catch(reject);
+    }
+    poll();
+  });
+}
+
+function describeIngestionJob(job) {
+  const stage = job.stage || job.status;
+  if (typeof job.progress === "number" && job.progress > 0) {
+    return `${stage} (${Math.round(job.progress * 100)}%)`;
+  }
+  return stage;
+}
@@ -0,0 +1,18 @@
+# conftest.py
+#
+# Tests import the app modules against the in-memory service fakes used by
+# the benchmarks, so config.py needs no real Azure resources.
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.run_benchmarks import configure_environment
+
+configure_environment(tempfile.mkdtemp())
+
+from benchmarks.fakes import FakeServices, install_fakes
+
+install_fakes(FakeServices(latency_scale=0))
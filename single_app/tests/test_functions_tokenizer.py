@@ -0,0 +1,51 @@
+# test_functions_tokenizer.py
+
+from functions_tokenizer import count_message_tokens, fit_messages_to_token_budget
+
+
+def _message(role, name, words):
+    return {'role': role, 'content': f"{name} " + "word " * words}
+
+
+def _names(messages):
+    return [message['content'].split()[0] for message in messages]
+
+
+def test_fit_messages_drops_old_results_before_the_question():
+    messages = [
+        _message('system', 'prompt', 20),
+        _message('user', 'q1', 20),
+        _message('system', 'file', 2000),
+        _message('system', 'results1', 2000),
+        _message('assistant', 'a1', 50),
+        _message('user', 'q2', 20),
+        _message('system', 'results2', 2000),
+        _message('assistant', 'a2', 50),
+        _message('user', 'q3', 20),
+        _message('system', 'results3', 1000),
+    ]
+    kept_tail = [messages[0]] + messages[-2:]
+    budget = sum(count_message_tokens(message) for message in kept_tail) + count_message_tokens(messages[-3]) + 10
+
+    fitted = fit_messages_to_token_budget(messages, budget)
+
+    assert _names(fitted) == ['prompt', 'a2', 'q3', 'results3']
+    assert sum(count_message_tokens(message) for message in fitted) <= budget
+
+
+def test_fit_messages_keeps_prompt_and_question_over_budget():
+    messages = [
+        _message('system', 'prompt', 20),
+        _message('user', 'q1', 200),
+        _message('assistant', 'a1', 200),
+        _message('user', 'q2', 20),
+        _message('system', 'results', 3000),
+    ]
+
+    assert _names(fit_messages_to_token_budget(messages, 100)) == ['prompt', 'q2', 'results']
+
+
+def test_fit_messages_within_budget_is_unchanged():
+    messages = [_message('system', 'prompt', 5), _message('user', 'q', 5)]
+
+    assert fit_messages_to_token_budget(messages, 10000) is messages